@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Comparaison de l'écriture des marchés aplatis en parquet :
+- "ndjson" : ancien chemin, orjson.dumps dans un NDJSON temporaire puis pl.scan_ndjson
+- "arrow" : ParquetRowWriter, colonnes Arrow écrites directement en parquet
+
+Les fichiers de test sont répétés (--repeat) pour obtenir des durées mesurables.
+
+Usage : python script/benchmark_get.py [--repeat 2000] [--runs 3]
+"""
+
+import argparse
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import ijson
+import orjson
+import polars as pl
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+
+from src.config import DecpFormat  # noqa: E402
+from src.schemas import SCHEMA_MARCHE_2019, SCHEMA_MARCHE_2022  # noqa: E402
+from src.tasks.get import write_marche_rows  # noqa: E402
+from src.tasks.output import ParquetRowWriter, sink_to_files  # noqa: E402
+from src.tasks.utils import FieldCensus  # noqa: E402
+
+FIXTURES = {
+    "decp_test_2019.json": DecpFormat("DECP 2019", SCHEMA_MARCHE_2019, "marches"),
+    "decp_test_2022.json": DecpFormat(
+        "DECP 2022", SCHEMA_MARCHE_2022, "marches.marche"
+    ),
+}
+
+
+class NdjsonRowWriter:
+    """Reproduction de l'ancien chemin : une ligne NDJSON par version de marché."""
+
+    def __init__(self, file):
+        self.file = file
+
+    def write_row(self, row: dict):
+        self.file.write(orjson.dumps(row))
+        self.file.write(b"\n")
+
+
+def load_marches(path: Path, decp_format: DecpFormat) -> list[dict]:
+    # NaN => null, comme dans json_stream_to_parquet
+    data = re.sub(rb"NaN([,\n])", rb"null\1", path.read_bytes())
+    return list(
+        ijson.items(data, f"{decp_format.prefixe_json_marches}.item", use_float=True)
+    )
+
+
+def accepted_by_ndjson(marches, decp_format, output_path) -> list[dict]:
+    """Marchés que l'ancien chemin sait ingérer (un marché malformé fait échouer toute
+    la ressource avec pl.scan_ndjson)."""
+    accepted = []
+    for marche in marches:
+        try:
+            run_ndjson(orjson.loads(orjson.dumps([marche])), decp_format, output_path)
+            accepted.append(marche)
+        except Exception:
+            pass
+    return accepted
+
+
+def run_ndjson(marches, decp_format, output_path: Path):
+    with tempfile.NamedTemporaryFile(mode="wb", suffix=".ndjson") as tmp_file:
+        writer = NdjsonRowWriter(tmp_file)
+        census = FieldCensus()
+        for marche in marches:
+            write_marche_rows(marche, writer, decp_format, census)
+        tmp_file.flush()
+        lf = pl.scan_ndjson(tmp_file.name, schema=decp_format.schema)
+        sink_to_files(lf, output_path, file_format="parquet")
+
+
+def run_arrow(marches, decp_format, output_path: Path):
+    census = FieldCensus()
+    with ParquetRowWriter(output_path, decp_format.schema) as writer:
+        for marche in marches:
+            write_marche_rows(marche, writer, decp_format, census)
+
+
+def bench(function, marches, decp_format, output_path, runs) -> float | str:
+    durations = []
+    for _ in range(runs):
+        # write_marche_rows consomme les modifications (pop) : copie profonde
+        copies = orjson.loads(orjson.dumps(marches))
+        start = time.perf_counter()
+        try:
+            function(copies, decp_format, output_path)
+        except Exception as e:
+            return f"échec ({type(e).__name__})"
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    data_dir = Path(__file__).absolute().parent.parent / "tests" / "data"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        for filename, decp_format in FIXTURES.items():
+            marches = load_marches(data_dir / filename, decp_format)
+            compare(filename, marches, decp_format, tmp_dir, args)
+
+            accepted = accepted_by_ndjson(marches, decp_format, tmp_dir / "check")
+            if len(accepted) < len(marches):
+                compare(
+                    f"{filename}, marchés acceptés par l'ancien chemin",
+                    accepted,
+                    decp_format,
+                    tmp_dir,
+                    args,
+                )
+
+
+def compare(label: str, marches: list[dict], decp_format, tmp_dir: Path, args):
+    marches = marches * args.repeat
+    results = {}
+    for name, function in [("ndjson", run_ndjson), ("arrow", run_arrow)]:
+        results[name] = bench(function, marches, decp_format, tmp_dir / name, args.runs)
+
+    print(f"{label} ({len(marches)} marchés)")
+    for name, duration in results.items():
+        if isinstance(duration, float):
+            print(f"  {name:<7} {duration:.3f} s")
+        else:
+            print(f"  {name:<7} {duration}")
+
+    ndjson_path = (tmp_dir / "ndjson").with_suffix(".parquet")
+    if all(isinstance(d, float) for d in results.values()):
+        identical = pl.read_parquet(ndjson_path).equals(
+            pl.read_parquet((tmp_dir / "arrow").with_suffix(".parquet"))
+        )
+        print(f"  résultats identiques : {identical}")
+    ndjson_path.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    main()
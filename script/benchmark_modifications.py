@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Comparaison de l'application des modifications (apply_modifications) :
+- "jointure" : ancien chemin, unique("uid") des marchés et des colonnes fixes, concaténation
+  diagonale des modifications, jointure des colonnes fixes, tri et fill_null().over("uid")
+- "tri" : apply_modifications, une seule passe triée sans jointure
+
+Les ressources sont synthétiques, dans l'ordre produit par yield_modifications (version
+initiale puis modifications de chaque marché), avec --modifications modifications par
+marché dont les dates ne sont pas dans l'ordre chronologique.
+
+Les résultats de chaque configuration sont affichés au fur et à mesure. Les ressources sont
+construites en Python : au-delà de quelques dizaines de milliers de marchés, leur
+construction prend plusieurs minutes et plusieurs Go de mémoire.
+
+Usage : python script/benchmark_modifications.py [--marches 2000] [--modifications 0 5 50] [--runs 3]
+"""
+
+import argparse
+import random
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import polars as pl
+import polars.selectors as cs
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+
+from src.schemas import SCHEMA_TITULAIRE_2019  # noqa: E402
+from src.tasks.transform import apply_modifications  # noqa: E402
+
+# Colonnes fixes, comme dans les parquet de l'étape get
+FIXED_COLUMNS = [
+    "acheteur_id",
+    "objet",
+    "nature",
+    "codeCPV",
+    "procedure",
+    "lieuExecution_code",
+    "formePrix",
+    "sourceFile",
+]
+
+
+def join_apply_modifications(lff: pl.LazyFrame) -> pl.LazyFrame:
+    """Reproduction de l'ancien chemin."""
+    columns = lff.collect_schema().names()
+    columns_no_modif = [col for col in columns if not (col.startswith("modification_"))]
+
+    lf_mods = (
+        lff.select(cs.by_name("uid") | cs.starts_with("modification_"))
+        .rename(
+            {
+                column: column.removeprefix("modification_").removesuffix(
+                    "Modification"
+                )
+                for column in columns
+                if column.startswith("modification_") and column != "modification_id"
+            }
+        )
+        .filter(~pl.all_horizontal(pl.all().exclude("uid").is_null()))
+    )
+    lff = lff.unique("uid")
+    lf_base = lff.drop(cs.starts_with("modification_"))
+    modified_columns = [
+        "uid",
+        "dateNotification",
+        "datePublicationDonnees",
+        "montant",
+        "dureeMois",
+        "titulaires",
+    ]
+    lff = pl.concat([lf_base.select(modified_columns), lf_mods], how="diagonal")
+    columns_to_keep = [col for col in columns_no_modif if col not in modified_columns]
+    lf_fixed_columns = lf_base.select(["uid"] + columns_to_keep).unique("uid")
+    lf_final = lff.join(lf_fixed_columns, on="uid", how="left")
+    lf_final = lf_final.sort(["uid", "dateNotification"], descending=[False, False])
+    return lf_final.with_columns(
+        pl.col("montant", "dureeMois", "titulaires")
+        .fill_null(strategy="forward")
+        .over("uid")
+    )
+
+
+def make_resource(marches: int, modifications: int, seed: int = 0) -> pl.DataFrame:
+    """Marchés aplatis comme par yield_modifications : les modifications reprennent les
+    colonnes de la version initiale et renseignent une partie des champs modification_."""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(marches):
+        titulaires = [{"id": f"{i:014d}", "typeIdentifiant": "SIRET"}]
+        initial = {
+            "uid": f"{rng.randrange(10**14):014d}{i}",
+            "dateNotification": f"2024-{rng.randint(1, 6):02d}-{rng.randint(1, 28):02d}",
+            "datePublicationDonnees": "2024-07-01",
+            "montant": str(rng.randint(1000, 10**6)),
+            "dureeMois": str(rng.randint(1, 48)),
+            "titulaires": titulaires,
+            **{column: f"{column} {i}" for column in FIXED_COLUMNS},
+            "modification_dateNotificationModification": None,
+            "modification_datePublicationDonneesModification": None,
+            "modification_montant": None,
+            "modification_dureeMois": None,
+            "modification_titulaires": None,
+        }
+        rows.append(initial)
+        # Dates distinctes : l'ordre de deux modifications de même date n'est pas déterminé
+        for days in rng.sample(range(1, 180), modifications):
+            notification = date(2024, 7, 1) + timedelta(days=days)
+            rows.append(
+                initial
+                | {
+                    "modification_dateNotificationModification": str(notification),
+                    "modification_datePublicationDonneesModification": str(
+                        notification + timedelta(days=2)
+                    ),
+                    "modification_montant": rng.choice(
+                        [None, str(rng.randint(1000, 10**6))]
+                    ),
+                    "modification_dureeMois": rng.choice(
+                        [None, str(rng.randint(1, 48))]
+                    ),
+                    "modification_titulaires": rng.choice([None, titulaires * 2]),
+                }
+            )
+    schema_overrides = {
+        "titulaires": pl.List(SCHEMA_TITULAIRE_2019),
+        "modification_titulaires": pl.List(SCHEMA_TITULAIRE_2019),
+    }
+    return pl.DataFrame(
+        rows, schema_overrides=schema_overrides, infer_schema_length=None
+    )
+
+
+def bench(function, df: pl.DataFrame, runs: int) -> tuple[float, pl.DataFrame]:
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function(df.lazy()).collect()
+        durations.append(time.perf_counter() - start)
+    return min(durations), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--marches", type=int, default=2_000)
+    parser.add_argument("--modifications", type=int, nargs="+", default=[0, 5, 50])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    for modifications in args.modifications:
+        print(
+            f"{args.marches} marchés, {modifications} modifications par marché",
+            flush=True,
+        )
+        start = time.perf_counter()
+        df = make_resource(args.marches, modifications)
+        print(
+            f"  {df.height} lignes construites en {time.perf_counter() - start:.1f} s",
+            flush=True,
+        )
+        results = {}
+        for name, function in [
+            ("jointure", join_apply_modifications),
+            ("tri", apply_modifications),
+        ]:
+            duration, results[name] = bench(function, df, args.runs)
+            print(f"  {name:<9} {duration:.3f} s", flush=True)
+
+        sort_by = [c for c, d in results["tri"].schema.items() if d != pl.List]
+        identical = (
+            results["jointure"]
+            .select(results["tri"].columns)
+            .sort(sort_by)
+            .equals(results["tri"].sort(sort_by))
+        )
+        print(f"  résultats identiques : {identical}")
+
+
+if __name__ == "__main__":
+    main()
@@ -39,10 +39,95 @@ ALL_CONFIG["LOG_LEVEL"] = LOG_LEVEL
 MAX_PREFECT_WORKERS = int(os.getenv("MAX_PREFECT_WORKERS", 4))
 ALL_CONFIG["MAX_PREFECT_WORKERS"] = MAX_PREFECT_WORKERS
 
+# Mode d'exécution du traitement des ressources (get_clean) : "thread" ou "process". Défaut : thread
+# En mode "process", le parsing et l'aplatissement des marchés (limités par le GIL) sont répartis sur plusieurs cœurs
+RESOURCE_EXECUTOR = os.getenv("RESOURCE_EXECUTOR", "thread").lower()
+if RESOURCE_EXECUTOR not in ["thread", "process"]:
+    raise ValueError(
+        f"RESOURCE_EXECUTOR doit valoir 'thread' ou 'process' (valeur : {RESOURCE_EXECUTOR})"
+    )
+ALL_CONFIG["RESOURCE_EXECUTOR"] = RESOURCE_EXECUTOR
+
+# Nombre de shards du traitement des ressources (src/tasks/sharding.py). Défaut : 0 (pas de shards)
+# Chaque shard traite une plage déterministe des checksums des ressources et écrit dans le cache
+# des ressources, qui doit donc être partagé entre les workers
+DECP_SHARD_COUNT = int(os.getenv("DECP_SHARD_COUNT", 0))
+ALL_CONFIG["DECP_SHARD_COUNT"] = DECP_SHARD_COUNT
+
+# Déploiement Prefect du flow decp_ingest_shard ("decp-ingest-shard/prod" par exemple) pour
+# exécuter les shards sur des workers Prefect. Si vide, les shards sont des processus locaux
+DECP_SHARD_DEPLOYMENT = os.getenv("DECP_SHARD_DEPLOYMENT", "")
+ALL_CONFIG["DECP_SHARD_DEPLOYMENT"] = DECP_SHARD_DEPLOYMENT
+
+# Durée maximale d'attente de la fin de tous les shards, en heures. Défaut : 6
+SHARD_TIMEOUT_HOURS = float(os.getenv("SHARD_TIMEOUT_HOURS", 6))
+ALL_CONFIG["SHARD_TIMEOUT_HOURS"] = SHARD_TIMEOUT_HOURS
+
+# Nettoyage groupé des petites ressources (src/tasks/get.py, clean_batch) : les ressources d'un
+# même format et d'un même schéma sont nettoyées en une seule requête Polars, par lots de
+# BATCH_CLEANING_SIZE ressources. Défaut : false
+DECP_BATCH_CLEANING = os.getenv("DECP_BATCH_CLEANING", "false").lower() == "true"
+ALL_CONFIG["DECP_BATCH_CLEANING"] = DECP_BATCH_CLEANING
+
+# Taille maximale (en octets) des ressources nettoyées par lots. Défaut : 1000000 (1 Mo)
+BATCH_CLEANING_MAX_FILESIZE = int(os.getenv("BATCH_CLEANING_MAX_FILESIZE", 1_000_000))
+ALL_CONFIG["BATCH_CLEANING_MAX_FILESIZE"] = BATCH_CLEANING_MAX_FILESIZE
+
+# Nombre maximal de ressources par lot. Défaut : 500
+BATCH_CLEANING_SIZE = int(os.getenv("BATCH_CLEANING_SIZE", 500))
+ALL_CONFIG["BATCH_CLEANING_SIZE"] = BATCH_CLEANING_SIZE
+
+# Nombre de ressources traitées par un processus avant qu'il soit remplacé (mode "process"). Défaut : 50
+# Le recyclage des processus limite l'accumulation de mémoire (fragmentation, caches)
+MAX_TASKS_PER_CHILD = int(os.getenv("MAX_TASKS_PER_CHILD", 50))
+ALL_CONFIG["MAX_TASKS_PER_CHILD"] = MAX_TASKS_PER_CHILD
+
+# Budget mémoire (en Mo) des ressources traitées en même temps (src/tasks/scheduler.py), 0 pour
+# ne pas le limiter. Défaut : 0
+# La mémoire utilisée est estimée pour les ressources en cours à partir de leur taille (filesize),
+# et corrigée par la mémoire résidente mesurée du processus et des workers. Une nouvelle ressource
+# attend si le budget est dépassé : MAX_PREFECT_WORKERS peut donc être augmenté sans risque de
+# manquer de mémoire
+RESOURCE_MEMORY_BUDGET_MB = int(os.getenv("RESOURCE_MEMORY_BUDGET_MB", 0))
+ALL_CONFIG["RESOURCE_MEMORY_BUDGET_MB"] = RESOURCE_MEMORY_BUDGET_MB
+
+# Taille maximale (en octets) des ressources JSON lues et parsées en entier avec orjson. Défaut : 5000000 (5 Mo)
+# Au-delà, les ressources sont parsées en flux avec ijson
+JSON_WHOLE_DOCUMENT_MAX_SIZE = int(os.getenv("JSON_WHOLE_DOCUMENT_MAX_SIZE", 5_000_000))
+ALL_CONFIG["JSON_WHOLE_DOCUMENT_MAX_SIZE"] = JSON_WHOLE_DOCUMENT_MAX_SIZE
+
+# Téléchargement asynchrone des ressources, séparé de leur traitement (src/tasks/download.py). Défaut : false
+# Si false, chaque ressource est téléchargée par le worker qui la traite
+ASYNC_DOWNLOAD = os.getenv("ASYNC_DOWNLOAD", "false").lower() == "true"
+ALL_CONFIG["ASYNC_DOWNLOAD"] = ASYNC_DOWNLOAD
+
+# Nombre maximal de téléchargements simultanés, au total et par hôte. Défauts : 16 et 4
+DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS", 16))
+ALL_CONFIG["DOWNLOAD_MAX_CONNECTIONS"] = DOWNLOAD_MAX_CONNECTIONS
+DOWNLOAD_MAX_CONNECTIONS_PER_HOST = int(
+    os.getenv("DOWNLOAD_MAX_CONNECTIONS_PER_HOST", 4)
+)
+ALL_CONFIG["DOWNLOAD_MAX_CONNECTIONS_PER_HOST"] = DOWNLOAD_MAX_CONNECTIONS_PER_HOST
+
+# Nombre maximal de ressources téléchargées en attente de traitement ou en cours de traitement.
+# Défaut : 2 x MAX_PREFECT_WORKERS
+DOWNLOAD_QUEUE_SIZE = int(os.getenv("DOWNLOAD_QUEUE_SIZE", 2 * MAX_PREFECT_WORKERS))
+ALL_CONFIG["DOWNLOAD_QUEUE_SIZE"] = DOWNLOAD_QUEUE_SIZE
+
+# Utilisation de HTTP/2 pour les téléchargements (nécessite le paquet h2). Défaut : false
+DOWNLOAD_HTTP2 = os.getenv("DOWNLOAD_HTTP2", "false").lower() == "true"
+ALL_CONFIG["DOWNLOAD_HTTP2"] = DOWNLOAD_HTTP2
+
 # Durée avant l'expiration du cache des ressources (en heure). Défaut : 168 (7 jours)
+# Compte à partir de la dernière utilisation du parquet, enregistrée dans le manifeste du cache
 CACHE_EXPIRATION_TIME_HOURS = int(os.getenv("CACHE_EXPIRATION_TIME_HOURS", 168))
 ALL_CONFIG["CACHE_EXPIRATION_TIME_HOURS"] = CACHE_EXPIRATION_TIME_HOURS
 
+# Taille maximale du cache des ressources, en Mo (0 pour ne pas la limiter). Défaut : 0
+# Au-delà, les parquet les moins récemment utilisés sont supprimés (src/tasks/cache_policy.py)
+RESOURCE_CACHE_MAX_SIZE_MB = int(os.getenv("RESOURCE_CACHE_MAX_SIZE_MB", 0))
+ALL_CONFIG["RESOURCE_CACHE_MAX_SIZE_MB"] = RESOURCE_CACHE_MAX_SIZE_MB
+
 
 DATE_NOW = datetime.now().isoformat()[0:10]  # YYYY-MM-DD
 MONTH_NOW = DATE_NOW[:7]  # YYYY-MM
@@ -97,6 +182,47 @@ RESOURCE_CACHE_DIR = make_path_from_env(
 RESOURCE_CACHE_DIR.mkdir(exist_ok=True, parents=True)
 ALL_CONFIG["RESOURCE_CACHE_DIR"] = RESOURCE_CACHE_DIR
 
+# Manifeste du cache des ressources : nombre de lignes, schéma, format... (src/tasks/cache_manifest.py)
+CACHE_MANIFEST_PATH = RESOURCE_CACHE_DIR / "manifest.sqlite"
+
+# Parquet de l'étape get (marchés aplatis, avant nettoyage), par checksum de ressource
+# Conservés avec le cache pour refaire le nettoyage sans télécharger à nouveau les ressources
+GET_DIR = DATA_DIR / "get"
+
+# Échanges entre l'exécution principale et les shards (src/tasks/sharding.py)
+SHARDS_DIR = RESOURCE_CACHE_DIR / "shards"
+
+# Jeu de données consolidé et enrichi, et index des uid par ressource (src/tasks/consolidated.py)
+CONSOLIDATED_DIR = DATA_DIR / "consolidated"
+
+# Dossiers des exécutions de decp_processing, pour la reprise des étapes (src/tasks/checkpoint.py)
+RUNS_DIR = DATA_DIR / "runs"
+
+# Traces des étapes des flows, au format Chrome trace (src/tasks/tracing.py)
+TRACES_DIR = DATA_DIR / "traces"
+
+# Coût du traitement de chaque ressource, par phase et par exécution (src/tasks/profiling.py)
+RESOURCE_PROFILES_DB_PATH = DATA_DIR / "resource_profiles.sqlite"
+
+# Nombre de ressources dans le classement des ressources les plus coûteuses. Défaut : 20
+RESOURCE_PROFILE_TOP_N = int(os.getenv("RESOURCE_PROFILE_TOP_N", 20))
+ALL_CONFIG["RESOURCE_PROFILE_TOP_N"] = RESOURCE_PROFILE_TOP_N
+
+# Ressources téléchargées en attente de traitement (src/tasks/download.py)
+DOWNLOAD_DIR = DATA_DIR / "downloads"
+
+# Validateurs HTTP (ETag, Last-Modified) des ressources sans checksum (src/tasks/revalidation.py)
+REVALIDATION_DB_PATH = DATA_DIR / "revalidation.sqlite"
+
+# Stockage des ressources téléchargées (src/tasks/raw_store.py)
+RAW_STORE_DIR = make_path_from_env("RAW_STORE_DIR", DATA_DIR / "raw_store")
+RAW_STORE_DIR.mkdir(exist_ok=True, parents=True)
+ALL_CONFIG["RAW_STORE_DIR"] = RAW_STORE_DIR
+
+# Taille maximale du stockage des ressources téléchargées, en Mo (0 pour le désactiver). Défaut : 0
+RAW_STORE_MAX_SIZE_MB = int(os.getenv("RAW_STORE_MAX_SIZE_MB", 0))
+ALL_CONFIG["RAW_STORE_MAX_SIZE_MB"] = RAW_STORE_MAX_SIZE_MB
+
 DIST_DIR = make_path_from_env("DECP_DIST_DIR", BASE_DIR / "dist")
 DIST_DIR.mkdir(exist_ok=True, parents=True, mode=777)
 ALL_CONFIG["DIST_DIR"] = DIST_DIR
@@ -149,6 +275,11 @@ ALL_CONFIG["SCRAPING_MONTH"] = SCRAPING_MONTH
 # Lecture ou non des ressource en cache
 DECP_USE_CACHE = os.getenv("DECP_USE_CACHE", "false").lower() == "true"
 
+# Construction incrémentale du jeu de données consolidé (src/tasks/consolidated.py) : seuls
+# les marchés des ressources nouvelles, modifiées ou retirées sont à nouveau consolidés et enrichis
+DECP_INCREMENTAL_BUILD = os.getenv("DECP_INCREMENTAL_BUILD", "false").lower() == "true"
+ALL_CONFIG["DECP_INCREMENTAL_BUILD"] = DECP_INCREMENTAL_BUILD
+
 # POSTGRESQL
 POSTGRESQL_DB_URI = os.getenv("POSTGRESQL_DB_URI", "")
 
@@ -156,6 +287,10 @@ POSTGRESQL_DB_URI = os.getenv("POSTGRESQL_DB_URI", "")
 REFERENCE_DIR = BASE_DIR / "reference"
 ALL_CONFIG["REFERENCE_DIR"] = REFERENCE_DIR
 
+# Formats de dates acceptés en plus des dates ISO, et corrections de dates (voir src/tasks/dates.py)
+DATE_CORRECTIONS_FILEPATH = REFERENCE_DIR / "date_corrections.json"
+ALL_CONFIG["DATE_CORRECTIONS_FILEPATH"] = DATE_CORRECTIONS_FILEPATH
+
 # Liste et ordre des colonnes pour le mono dataframe de base (avant normalisation et spécialisation)
 # Sert aussi à vérifier qu'au moins ces colonnes sont présentes (d'autres peuvent être présentes en plus, les colonnes "innatendues")
 schema_fields = json.load(open(REFERENCE_DIR / "schema_base.json", "r"))["fields"]
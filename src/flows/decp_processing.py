@@ -1,38 +1,71 @@
+import multiprocessing
 import os
 import shutil
-from concurrent.futures import ThreadPoolExecutor
+import sys
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from operator import itemgetter
+from pathlib import Path
 
 import polars as pl
 import polars.selectors as cs
+import pyarrow.parquet as pq
 from prefect import flow, task
 from prefect.artifacts import create_table_artifact
 from prefect.context import get_run_context
+from prefect.deployments import run_deployment
 from prefect_email import EmailServerCredentials, email_send_message
 
 from src.config import (
     BASE_DF_COLUMNS,
+    DATA_DIR,
     DATE_NOW,
+    DECP_INCREMENTAL_BUILD,
     DECP_PROCESSING_PUBLISH,
+    DECP_SHARD_COUNT,
+    DECP_SHARD_DEPLOYMENT,
     DIST_DIR,
     LOG_LEVEL,
     MAX_PREFECT_WORKERS,
+    MAX_TASKS_PER_CHILD,
     PREFECT_API_URL,
-    RESOURCE_CACHE_DIR,
+    RESOURCE_EXECUTOR,
+    RESOURCE_PROFILE_TOP_N,
     SIRENE_DATA_DIR,
     SOLO_DATASETS,
     TRACKED_DATASETS,
 )
 from src.flows.sirene_preprocess import sirene_preprocess
+from src.tasks.cache_manifest import cached_parquet_files, row_counts
+from src.tasks.cache_policy import evict_resource_cache
+from src.tasks.checkpoint import StageCheckpoints
+from src.tasks.clean import cleaning_fingerprint
+from src.tasks.consolidated import build_consolidated, build_fingerprint
 from src.tasks.dataset_utils import list_resources
+from src.tasks.download import DownloadPipeline
 from src.tasks.enrich import (
     add_duree_restante,
     add_type_marche,
     enrich_from_sirene,
     geocode_sirene,
 )
-from src.tasks.get import get_clean
+from src.tasks.get import (
+    PendingCleaning,
+    clean_batch,
+    clean_batch_in_worker,
+    cleaning_batches,
+    get_clean,
+    get_clean_in_worker,
+    init_get_clean_worker,
+)
 from src.tasks.output import generate_final_schema, sink_to_files
+from src.tasks.profiling import profile_report
 from src.tasks.publish import publish_to_datagouv, publish_to_s3
+from src.tasks.raw_store import evict_raw_store
+from src.tasks.scheduler import ResourceScheduler
+from src.tasks.sharding import ShardRun, select_shard
+from src.tasks.tracing import stage, traced
 from src.tasks.transform import (
     calculate_naf_cpv_matching,
     concat_parquet_files,
@@ -44,11 +77,12 @@ from src.tasks.utils import (
     generate_stats,
     get_logger,
     print_all_config,
-    remove_unused_cache,
 )
 
 
 @flow(log_prints=True)
+# Durée, CPU, mémoire et entrées/sorties de chaque étape (voir src/tasks/tracing.py)
+@traced("decp_processing")
 def decp_processing(enable_cache_removal: bool = True):
     logger = get_logger(level=LOG_LEVEL)
 
@@ -57,30 +91,51 @@ def decp_processing(enable_cache_removal: bool = True):
     print_all_config()
 
     logger.info("Liste de toutes les ressources des datasets...")
-    resources: list[dict] = list_resources(TRACKED_DATASETS)
-
-    # Initialisation du tableau des artifacts de ressources
-    resources_artifact = []
+    with stage("liste_ressources") as span:
+        resources: list[dict] = list_resources(TRACKED_DATASETS)
+        span.rows_out = len(resources)
 
-    # Liste des ressources en cache (checksums)
-    available_parquet_files = set(os.listdir(RESOURCE_CACHE_DIR))
-
-    # Traitement parallèle des ressources par lots pour éviter la surcharge mémoire
-    batch_size = 100
-    parquet_files = []
+    # Liste des ressources en cache (checksums), synchronisée avec le manifeste du cache.
+    # Les parquet produits par un autre nettoyage ne sont gardés que s'ils peuvent être
+    # nettoyés à nouveau à partir de l'étape get.
+    run_started_at = datetime.now().isoformat()
+    with stage("cache_ressources"):
+        available_parquet_files = cached_parquet_files(cleaning_fingerprint())
 
     # Filtrer les ressources à traiter, en ne gardant que les fichiers > 180 octets
     resources_to_process = [r for r in resources if r["filesize"] > 180]
 
-    for i in range(0, len(resources_to_process), batch_size):
-        process_batch(
-            available_parquet_files,
-            batch_size,
-            i,
-            parquet_files,
-            resources_artifact,
-            resources_to_process,
+    # Traitement parallèle des ressources, des plus grosses aux plus petites, dans la
+    # limite du budget mémoire (voir src/tasks/scheduler.py)
+    resources_to_process.sort(key=itemgetter("filesize"), reverse=True)
+    with stage("traitement_ressources", rows_in=len(resources_to_process)) as span:
+        if DECP_SHARD_COUNT > 0:
+            parquet_files, resources_artifact = ingest_shards(
+                resources_to_process, available_parquet_files
+            )
+        else:
+            parquet_files, resources_artifact = process_resources(
+                available_parquet_files, resources_to_process
+            )
+        span.rows_out = cached_row_count(parquet_files)
+
+    # Taille maximale du stockage des ressources téléchargées (voir src/tasks/raw_store.py)
+    with stage("eviction_stockage_brut"):
+        evict_raw_store()
+
+    # Ressources les plus coûteuses à traiter (voir src/tasks/profiling.py)
+    profiles = profile_report(RESOURCE_PROFILE_TOP_N)
+    if profiles:
+        create_table_artifact(
+            table=profiles,
+            key="ressources-couteuses",
+            description=f"Les ressources les plus coûteuses à traiter ({DATE_NOW})",
         )
+        for profile in profiles[:5]:
+            logger.info(
+                f"🐢 {profile['dataset_code']} - {profile['ori_filename']} : "
+                f"{profile['total_s']} s ({profile['evolution']})"
+            )
 
     # Afin d'être sûr que je ne publie pas par erreur un jeu de données de test
     decp_publish = (
@@ -97,34 +152,45 @@ def decp_processing(enable_cache_removal: bool = True):
         )
         del resources_artifact
 
-    # Réinitialisation de DIST_DIR
-    if os.path.exists(DIST_DIR):
-        shutil.rmtree(DIST_DIR)
-    os.makedirs(DIST_DIR)
-
-    logger.info("Concaténation des dataframes...")
-    lf: pl.LazyFrame = concat_parquet_files(parquet_files)
-
-    logger.info("Tri des modifications...")
-    lf = sort_modifications(lf)
-
-    logger.info("Ajout des données SIRENE...")
-    # Preprocessing des données SIRENE si :
-    # - le dossier n'existe pas encore (= les données n'ont pas déjà été preprocessed ce mois-ci)
-    # - on est au moins le 5 du mois (pour être sûr que les données SIRENE ont été mises à jour sur data.gouv.fr)
-    if not SIRENE_DATA_DIR.exists():
-        sirene_preprocess()
-
-    lf: pl.LazyFrame = enrich_from_sirene(lf)
-
-    logger.info("Géocodage des SIRETs manquants...")
-    lf, siret_latlong_path = geocode_sirene(lf)
-
-    if decp_publish:
-        publish_to_s3(file=siret_latlong_path, prefix="")
-
-    sink_to_files(lf, DIST_DIR / "decp", file_format="parquet")
-    lf: pl.LazyFrame = pl.scan_parquet(DIST_DIR / "decp.parquet")
+    # Étapes déjà effectuées par une exécution précédente du jour (voir src/tasks/checkpoint.py)
+    checkpoints = StageCheckpoints()
+    if not checkpoints.resumed:
+        checkpoints.remove_previous_runs()
+
+        # Réinitialisation de DIST_DIR
+        if os.path.exists(DIST_DIR):
+            shutil.rmtree(DIST_DIR)
+        os.makedirs(DIST_DIR)
+
+    decp_enrichi_path = checkpoints.run_dir / "decp_enrichi.parquet"
+    doublons_path = DIST_DIR / "statistiques_doublons_sources.parquet"
+    if checkpoints.should_run(
+        "consolidation",
+        inputs=parquet_files,
+        outputs=[decp_enrichi_path, doublons_path, DATA_DIR / "siret_latlong.parquet"],
+        params={"incremental": DECP_INCREMENTAL_BUILD, "build": build_fingerprint()},
+    ):
+        with stage("consolidation", rows_in=cached_row_count(parquet_files)) as span:
+            if DECP_INCREMENTAL_BUILD:
+                logger.info("Consolidation des dataframes...")
+                lf, siret_latlong_path = build_consolidated(parquet_files, enrich_decp)
+            else:
+                logger.info("Concaténation des dataframes...")
+                with stage("concatenation"):
+                    lf: pl.LazyFrame = concat_parquet_files(parquet_files)
+                lf, siret_latlong_path = enrich_decp(lf)
+
+            if decp_publish:
+                publish_to_s3(file=siret_latlong_path, prefix="")
+
+            with stage("ecriture_consolidation"):
+                sink_to_files(
+                    lf, decp_enrichi_path.with_suffix(""), file_format="parquet"
+                )
+            span.rows_out = pq.read_metadata(decp_enrichi_path).num_rows
+        checkpoints.done("consolidation")
+
+    lf: pl.LazyFrame = pl.scan_parquet(decp_enrichi_path)
 
     logger.info("Ajout de la colonne 'dureeRestanteMois'...")
     lf = add_duree_restante(lf)
@@ -132,68 +198,223 @@ def decp_processing(enable_cache_removal: bool = True):
     logger.info("Ajout du type de marché...")
     lf = add_type_marche(lf)
 
-    logger.info("Génération des probabilités NAF/CPV...")
-    calculate_naf_cpv_matching(lf)
+    if checkpoints.should_run(
+        "naf_cpv",
+        inputs=[decp_enrichi_path],
+        outputs=[DIST_DIR / "probabilites_naf_cpv.csv"],
+    ):
+        logger.info("Génération des probabilités NAF/CPV...")
+        with stage("naf_cpv"):
+            calculate_naf_cpv_matching(lf)
+        checkpoints.done("naf_cpv")
     lf = lf.drop(cs.starts_with("activite"))
 
-    logger.info("Génération de l'artefact (statistiques) sur le base df...")
-    generate_stats(lf)
-
-    logger.info(
-        "Génération du schéma et enregistrement des DECP aux formats CSV, Parquet..."
-    )
-    lf: pl.LazyFrame = sort_columns(lf, BASE_DF_COLUMNS)
-    generate_final_schema(lf)
-    sink_to_files(lf, DIST_DIR / "decp")
+    if checkpoints.should_run(
+        "statistiques",
+        inputs=[decp_enrichi_path, doublons_path],
+        outputs=[
+            DIST_DIR / "statistiques_marches.json",
+            DIST_DIR / "statistiques_sources.csv",
+        ],
+    ):
+        logger.info("Génération de l'artefact (statistiques) sur le base df...")
+        with stage("statistiques"):
+            generate_stats(lf)
+        checkpoints.done("statistiques")
+
+    export_paths = [
+        DIST_DIR / "decp.parquet",
+        DIST_DIR / "decp.csv",
+        DIST_DIR / "schema.json",
+    ]
+    if checkpoints.should_run(
+        "export", inputs=[decp_enrichi_path], outputs=export_paths
+    ):
+        logger.info(
+            "Génération du schéma et enregistrement des DECP aux formats CSV, Parquet..."
+        )
+        with stage("export") as span:
+            lf: pl.LazyFrame = sort_columns(lf, BASE_DF_COLUMNS)
+            generate_final_schema(lf)
+            sink_to_files(lf, DIST_DIR / "decp")
+            span.rows_out = pq.read_metadata(DIST_DIR / "decp.parquet").num_rows
+        checkpoints.done("export")
 
     # Base de données SQLite dédiée aux activités du Datalab d'Anticor
     # Désactivé pour l'instant https://github.com/ColinMaudry/decp-processing/issues/124
     # make_data_tables()
 
-    if decp_publish:
-        logger.info("Publication sur data.gouv.fr...")
-        publish_to_datagouv()
-
-        logger.info("Publication sur S3...")
-        publish_to_s3(
-            file=DIST_DIR / "decp.parquet", prefix=f"decp/{DATE_NOW}/decp.parquet"
-        )
-    else:
+    if not decp_publish:
         logger.info("Publication sur data.gouv.fr désactivée.")
+    elif checkpoints.should_run(
+        "publication",
+        inputs=export_paths
+        + [
+            doublons_path,
+            DIST_DIR / "statistiques_marches.json",
+            DIST_DIR / "statistiques_sources.csv",
+            DIST_DIR / "probabilites_naf_cpv.csv",
+        ],
+        outputs=[],
+    ):
+        with stage("publication"):
+            logger.info("Publication sur data.gouv.fr...")
+            publish_to_datagouv()
+
+            logger.info("Publication sur S3...")
+            publish_to_s3(
+                file=DIST_DIR / "decp.parquet", prefix=f"decp/{DATE_NOW}/decp.parquet"
+            )
+        checkpoints.done("publication")
 
     if enable_cache_removal:
         logger.info("Suppression des fichiers de cache inutilisés...")
-        remove_unused_cache()
+        # Les parquet des ressources de cette exécution sont conservés
+        with stage("eviction_cache"):
+            evict_resource_cache(
+                {r["checksum"] for r in resources_to_process}, run_started_at
+            )
 
     logger.info("☑️  Fin du flow principal decp_processing.")
 
 
-@task(retries=2, timeout_seconds=1800)
-def process_batch(
-    available_parquet_files,
-    batch_size,
-    i,
-    parquet_files,
-    resources_artifact,
-    resources_to_process,
-):
+def cached_row_count(parquet_files: list) -> int:
+    """Nombre total de lignes des parquet en cache, lu dans le manifeste du cache."""
+    counts = row_counts()
+    return sum(counts.get(Path(file).stem, 0) for file in parquet_files)
+
+
+def ingest_shards(
+    resources: list[dict], available_parquet_files: set
+) -> tuple[list[Path], list[dict]]:
+    """Traitement des ressources par DECP_SHARD_COUNT shards (voir src/tasks/sharding.py),
+    puis fusion de leurs résultats une fois tous les shards terminés."""
     logger = get_logger(level=LOG_LEVEL)
-    batch = resources_to_process[i : i + batch_size]
+
+    shard_run = ShardRun()
+    shard_run.write_resources(resources, available_parquet_files)
     logger.info(
-        f"🗃️ Traitement du lot {i // batch_size + 1} / {len(resources_to_process) // batch_size + 1}"
+        f"🧩 Traitement des ressources en {DECP_SHARD_COUNT} shards ({shard_run.run_id})"
     )
+
+    processes = []
+    for shard_index in range(DECP_SHARD_COUNT):
+        parameters = {
+            "run_id": shard_run.run_id,
+            "shard_index": shard_index,
+            "shard_count": DECP_SHARD_COUNT,
+        }
+        if DECP_SHARD_DEPLOYMENT:
+            # timeout=0 : pas d'attente de la fin de l'exécution du shard
+            run_deployment(DECP_SHARD_DEPLOYMENT, parameters=parameters, timeout=0)
+        else:
+            process = multiprocessing.get_context("spawn").Process(
+                target=run_shard, kwargs=parameters
+            )
+            process.start()
+            processes.append(process)
+
+    try:
+        return shard_run.wait_for_shards(
+            DECP_SHARD_COUNT,
+            is_running=(lambda i: processes[i].is_alive()) if processes else None,
+        )
+    finally:
+        for process in processes:
+            process.join()
+        shard_run.remove()
+
+
+@flow(log_prints=True)
+def decp_ingest_shard(run_id: str, shard_index: int, shard_count: int):
+    """Traitement des ressources d'un shard, dans le cache des ressources partagé."""
+    logger = get_logger(level=LOG_LEVEL)
+
+    shard_run = ShardRun(run_id)
+    try:
+        resources, available_parquet_files = shard_run.read_resources()
+        resources = select_shard(resources, shard_index, shard_count)
+        logger.info(
+            f"🧩 Shard {shard_index + 1}/{shard_count} : {len(resources)} ressources"
+        )
+        parquet_files, resources_artifact = process_resources(
+            available_parquet_files, resources
+        )
+    except Exception as e:
+        shard_run.write_error(shard_index, e)
+        raise
+    shard_run.write_result(shard_index, parquet_files, resources_artifact)
+
+
+def run_shard(run_id: str, shard_index: int, shard_count: int):
+    """Point d'entrée des processus locaux (mode sans DECP_SHARD_DEPLOYMENT)."""
+    decp_ingest_shard(run_id, shard_index, shard_count)
+
+
+def enrich_decp(lf: pl.LazyFrame) -> tuple[pl.LazyFrame, Path]:
+    """Tri des modifications, ajout des données SIRENE et géocodage des lignes consolidées."""
+    logger = get_logger(level=LOG_LEVEL)
+
+    logger.info("Tri des modifications...")
+    lf = sort_modifications(lf)
+
+    logger.info("Ajout des données SIRENE...")
+    # Preprocessing des données SIRENE si :
+    # - le dossier n'existe pas encore (= les données n'ont pas déjà été preprocessed ce mois-ci)
+    # - on est au moins le 5 du mois (pour être sûr que les données SIRENE ont été mises à jour sur data.gouv.fr)
+    if not SIRENE_DATA_DIR.exists():
+        with stage("sirene_preprocess"):
+            sirene_preprocess()
+
+    # Les jointures sont calculées à l'écriture du résultat : l'étape "sirene" ne compte
+    # que la préparation des SIRET des acheteurs et des titulaires
+    with stage("sirene"):
+        lf: pl.LazyFrame = enrich_from_sirene(lf)
+
+    logger.info("Géocodage des SIRETs manquants...")
+    with stage("geocodage"):
+        return geocode_sirene(lf)
+
+
+# Pas de timeout ni de nouvelle tentative : la tâche traite toutes les ressources, et
+# l'échec d'une ressource n'interrompt pas le traitement des autres
+@task
+def process_resources(
+    available_parquet_files, resources_to_process
+) -> tuple[list, list]:
+    """Parquet produits et lignes de l'artifact des ressources."""
+    logger = get_logger(level=LOG_LEVEL)
+    parquet_files = []
+    resources_artifact = []
+    logger.info(f"🗃️ Traitement de {len(resources_to_process)} ressources")
     futures = {}
-    with ThreadPoolExecutor(max_workers=MAX_PREFECT_WORKERS) as executor:
-        for resource in batch:
-            future = executor.submit(
-                get_clean, resource, resources_artifact, available_parquet_files
+    # Les ressources sont soumises au fur et à mesure de leur téléchargement
+    downloads = DownloadPipeline(resources_to_process, available_parquet_files)
+    scheduler = ResourceScheduler()
+    with make_executor(available_parquet_files) as executor:
+        if RESOURCE_EXECUTOR == "process":
+            submit = partial(executor.submit, get_clean_in_worker)
+        else:
+            submit = partial(
+                executor.submit,
+                get_clean,
+                resources_artifact=resources_artifact,
+                available_parquet_files=available_parquet_files,
             )
+        for resource, future in scheduler.run(downloads, submit):
+            future.add_done_callback(partial(downloads.done, resource))
             futures[future] = full_resource_name(resource)
 
+    pending = []
     for future in futures:
         try:
             result = future.result()
-            if result is not None:
+            if RESOURCE_EXECUTOR == "process":
+                result, artifact_rows = result
+                resources_artifact.extend(artifact_rows)
+            if isinstance(result, PendingCleaning):
+                pending.append(result)
+            elif result is not None:
                 parquet_files.append(result)
         except Exception as e:
             resource_name = futures[future]
@@ -204,6 +425,68 @@ def process_batch(
     # Nettoyage explicite
     futures.clear()
 
+    if pending:
+        clean_pending_resources(
+            pending, available_parquet_files, parquet_files, resources_artifact
+        )
+
+    return parquet_files, resources_artifact
+
+
+def clean_pending_resources(
+    pending: list,
+    available_parquet_files: set,
+    parquet_files: list,
+    resources_artifact: list,
+):
+    """Nettoyage par lots des petites ressources (DECP_BATCH_CLEANING, voir clean_batch)."""
+    logger = get_logger(level=LOG_LEVEL)
+    batches = cleaning_batches(pending)
+    logger.info(f"🧺 Nettoyage de {len(pending)} ressources en {len(batches)} lots")
+    futures = {}
+    with make_executor(available_parquet_files) as executor:
+        for batch in batches:
+            if RESOURCE_EXECUTOR == "process":
+                future = executor.submit(clean_batch_in_worker, batch)
+            else:
+                future = executor.submit(clean_batch, batch, resources_artifact)
+            futures[future] = len(batch)
+
+    for future in futures:
+        try:
+            result = future.result()
+            if RESOURCE_EXECUTOR == "process":
+                result, artifact_rows = result
+                resources_artifact.extend(artifact_rows)
+            parquet_files.extend(result)
+        except Exception as e:
+            logger.error(
+                f"❌ Erreur de nettoyage d'un lot de {futures[future]} ressources "
+                f"({type(e).__name__}):"
+            )
+            logger.info(e)
+
+
+def make_executor(available_parquet_files: set) -> Executor:
+    """Pool d'exécution de get_clean selon RESOURCE_EXECUTOR.
+
+    En mode "process", les processus sont lancés avec "spawn" (pas de fork d'un processus
+    qui a déjà des threads et un client HTTP ouvert) et recyclés toutes les
+    MAX_TASKS_PER_CHILD ressources."""
+    if RESOURCE_EXECUTOR == "process":
+        options = {}
+        # max_tasks_per_child n'existe qu'à partir de Python 3.11
+        if sys.version_info >= (3, 11):
+            options["max_tasks_per_child"] = MAX_TASKS_PER_CHILD
+        return ProcessPoolExecutor(
+            max_workers=MAX_PREFECT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_get_clean_worker,
+            initargs=(available_parquet_files,),
+            **options,
+        )
+    return ThreadPoolExecutor(max_workers=MAX_PREFECT_WORKERS)
+
 
 @sirene_preprocess.on_failure
 @decp_processing.on_failure
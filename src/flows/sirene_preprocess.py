@@ -1,4 +1,5 @@
 import polars as pl
+import pyarrow.parquet as pq
 from prefect import flow
 from prefect.transactions import transaction
 
@@ -10,11 +11,13 @@ from src.tasks.get import (
     get_from_s3,
     get_unite_legales,
 )
+from src.tasks.tracing import stage, traced
 from src.tasks.transform import prepare_etablissements
 from src.tasks.utils import create_sirene_data_dir, get_logger
 
 
 @flow(log_prints=True)
+@traced("sirene_preprocess")
 def sirene_preprocess():
     """Prétraitement mensuel des données SIRENE afin d'économiser du temps lors du traitement quotidien des DECP.
     Pour chaque ressource (unités légales, établissements), un fichier parquet est produit.
@@ -23,24 +26,29 @@ def sirene_preprocess():
     logger = get_logger(level=LOG_LEVEL)
 
     logger.info("🚀  Pré-traitement des données SIRENE")
+
     # Soit les tâches de ce flow vont au bout (success), soit le dossier SIRENE_DATA_DIR est supprimé (voir remove_sirene_data_dir())
     with transaction():
         create_sirene_data_dir()
 
         # Récupération et préparation des données du Code Officiel Géographique
-        get_cog()
+        with stage("cog"):
+            get_cog()
 
         # Récupération du cache de géolocalisations
-        lf_siret_latlong = get_from_s3(key="siret_latlong.parquet", prefix="")
+        with stage("siret_latlong"):
+            lf_siret_latlong = get_from_s3(key="siret_latlong.parquet", prefix="")
 
-        if not isinstance(lf_siret_latlong, pl.LazyFrame):
-            lf_siret_latlong = bootstrap_siret_latlong()
+            if not isinstance(lf_siret_latlong, pl.LazyFrame):
+                lf_siret_latlong = bootstrap_siret_latlong()
 
         # préparer les données unités légales
         processed_ul_parquet_path = SIRENE_DATA_DIR / "unites_legales.parquet"
         if not processed_ul_parquet_path.exists():
             logger.info("Téléchargement et préparation des unités légales...")
-            get_unite_legales(processed_ul_parquet_path)
+            with stage("unites_legales") as span:
+                get_unite_legales(processed_ul_parquet_path)
+                span.rows_out = pq.read_metadata(processed_ul_parquet_path).num_rows
         else:
             logger.info(str(processed_ul_parquet_path) + " existe, skipping.")
 
@@ -48,10 +56,12 @@ def sirene_preprocess():
         processed_etab_parquet_path = SIRENE_DATA_DIR / "etablissements.parquet"
         if not processed_etab_parquet_path.exists():
             logger.info("Téléchargement et préparation des établissements...")
-            lf: pl.LazyFrame = get_etablissements()
-            lf = prepare_etablissements(lf)
-            lf = lf.join(lf_siret_latlong, on="siret", how="left")
-            lf.sink_parquet(processed_etab_parquet_path)
+            with stage("etablissements") as span:
+                lf: pl.LazyFrame = get_etablissements()
+                lf = prepare_etablissements(lf)
+                lf = lf.join(lf_siret_latlong, on="siret", how="left")
+                lf.sink_parquet(processed_etab_parquet_path)
+                span.rows_out = pq.read_metadata(processed_etab_parquet_path).num_rows
         else:
             logger.info(str(processed_etab_parquet_path) + " existe, skipping.")
 
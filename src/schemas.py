@@ -106,3 +106,51 @@ SCHEMA_MARCHE_2022 = {
     "typesPrix_typePrix": pl.List(pl.String),
     **SCHEMA_MODIFICATION_2022,
 }
+
+# Types des colonnes à faible cardinalité, de clean_decp jusqu'à l'écriture des fichiers
+# (voir cast_low_cardinality). Cela réduit la mémoire utilisée par les tris et les jointures
+# des lignes explosées par titulaire, ainsi que la taille des parquet.
+# - pl.Enum : valeurs produites par le traitement lui-même (add_type_marche,
+#   add_unite_legale_data), ou nomenclature INSEE. Les valeurs hors de la liste sont
+#   converties en null.
+# - pl.Categorical : valeurs des sources ou du Code Officiel Géographique, qui ne
+#   respectent pas toujours les valeurs du schéma.
+# Les catégories des pl.Categorical sont globales au processus (polars >= 1.32, sans
+# pl.StringCache) : les parquet nettoyés par des processus différents sont concaténés et
+# joints sans conversion.
+TYPES_MARCHE = [
+    "Travaux",
+    "Fournitures",
+    "Services",
+    "Non catégorisé",
+    "Code CPV invalide",
+]
+
+CATEGORIES_ACHETEUR = [
+    "Commune",
+    "Groupement de communes",
+    "Département",
+    "Département outre-mer",
+    "Région",
+    "État",
+    "Établissement hospitalier",
+    "EPIC",
+    "Syndicat mixte",
+]
+
+SCHEMA_LOW_CARDINALITY = {
+    "nature": pl.Categorical,
+    "procedure": pl.Categorical,
+    "formePrix": pl.Categorical,
+    "ccag": pl.Categorical,
+    "typeGroupementOperateurs": pl.Categorical,
+    "titulaire_typeIdentifiant": pl.Categorical,
+    "type": pl.Enum(TYPES_MARCHE),
+    "acheteur_categorie": pl.Enum(CATEGORIES_ACHETEUR),
+    "titulaire_categorie": pl.Enum(["PME", "ETI", "GE"]),
+    **{
+        f"{type_siret}_{niveau}_nom": pl.Categorical
+        for type_siret in ["acheteur", "titulaire"]
+        for niveau in ["commune", "departement", "region"]
+    },
+}
@@ -0,0 +1,277 @@
+"""
+Manifeste du cache des ressources (RESOURCE_CACHE_DIR).
+
+Pour chaque parquet en cache, identifié par le checksum de la ressource : nombre de lignes,
+hash du schéma, format DECP détecté, recensement des champs (FieldCensus), tailles, dates
+de création et de dernière utilisation. La recherche dans le cache, la mise à l'écart des
+parquet vides et l'artifact des ressources ne nécessitent ainsi pas d'ouvrir les fichiers.
+
+Une entrée est ajoutée une fois le parquet entièrement écrit. Les parquet sans entrée
+(cache antérieur au manifeste) sont ajoutés à partir de leurs métadonnées parquet.
+
+Chaque entrée indique l'empreinte du nettoyage qui a produit le parquet
+(cleaning_fingerprint, voir src/tasks/clean.py) : un parquet produit par un autre
+nettoyage n'est réutilisable que si le parquet de l'étape get (GET_DIR) est disponible
+pour le nettoyer à nouveau.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+import pyarrow.parquet as pq
+
+from src.config import CACHE_MANIFEST_PATH, GET_DIR, LOG_LEVEL, RESOURCE_CACHE_DIR
+from src.tasks.utils import get_logger
+
+COLUMNS = [
+    "checksum",
+    "row_count",
+    "schema_hash",
+    "decp_format",
+    "source_row_count",
+    "field_census",
+    "parquet_size",
+    "source_size",
+    "created_at",
+    "last_used_at",
+    "cleaning_fingerprint",
+    "get_size",
+]
+
+# Colonnes ajoutées après la création du manifeste, avec leur type
+ADDED_COLUMNS = {"cleaning_fingerprint": "TEXT", "get_size": "INTEGER"}
+
+
+def connect() -> sqlite3.Connection:
+    # Plusieurs threads ou processus peuvent écrire en même temps
+    connection = sqlite3.connect(CACHE_MANIFEST_PATH, timeout=30)
+    connection.execute(
+        """CREATE TABLE IF NOT EXISTS resources (
+            checksum TEXT PRIMARY KEY,
+            row_count INTEGER,
+            schema_hash TEXT,
+            decp_format TEXT,
+            source_row_count INTEGER,
+            field_census TEXT,
+            parquet_size INTEGER,
+            source_size INTEGER,
+            created_at TEXT,
+            last_used_at TEXT,
+            cleaning_fingerprint TEXT,
+            get_size INTEGER
+        )"""
+    )
+    existing_columns = {
+        row[1] for row in connection.execute("PRAGMA table_info(resources)")
+    }
+    for column, column_type in ADDED_COLUMNS.items():
+        if column not in existing_columns:
+            connection.execute(
+                f"ALTER TABLE resources ADD COLUMN {column} {column_type}"
+            )
+    return connection
+
+
+def parquet_metadata(path: Path) -> tuple[int, str, int]:
+    """Nombre de lignes, hash du schéma et taille d'un parquet (lecture du footer)."""
+    metadata = pq.read_metadata(path)
+    schema = metadata.schema.to_arrow_schema()
+    schema_string = ", ".join(f"{field.name}: {field.type}" for field in schema)
+    schema_hash = hashlib.sha1(schema_string.encode()).hexdigest()[:16]
+    return metadata.num_rows, schema_hash, path.stat().st_size
+
+
+def record_resource(
+    resource: dict,
+    parquet_path: Path,
+    decp_format_label: str,
+    cleaning_fingerprint: str,
+    previous_entry: dict | None = None,
+) -> dict:
+    """Enregistrement d'un parquet qui vient d'être écrit dans le cache.
+
+    Si le parquet a été nettoyé à nouveau à partir de l'étape get, les informations de
+    l'étape get viennent de l'entrée précédente (previous_entry)."""
+    row_count, schema_hash, parquet_size = parquet_metadata(parquet_path)
+    get_path = GET_DIR / f"{resource['checksum']}.parquet"
+    now = datetime.now().isoformat()
+    entry = {
+        "checksum": resource["checksum"],
+        "row_count": row_count,
+        "schema_hash": schema_hash,
+        "decp_format": decp_format_label,
+        "source_row_count": resource.get("row_number"),
+        "field_census": resource.get("field_census"),
+        "parquet_size": parquet_size,
+        "source_size": resource["filesize"],
+        "created_at": now,
+        "last_used_at": now,
+        "cleaning_fingerprint": cleaning_fingerprint,
+        "get_size": get_path.stat().st_size if get_path.exists() else None,
+    }
+    if previous_entry is not None:
+        for column in ["source_row_count", "field_census", "created_at"]:
+            entry[column] = previous_entry[column]
+    _insert_entries([entry])
+    return entry
+
+
+def get_entry(checksum: str) -> dict | None:
+    """Entrée du manifeste d'un parquet en cache, dont la date d'utilisation est mise à jour."""
+    connection = connect()
+    try:
+        with connection:
+            connection.execute(
+                "UPDATE resources SET last_used_at = ? WHERE checksum = ?",
+                (datetime.now().isoformat(), checksum),
+            )
+            row = connection.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM resources WHERE checksum = ?",
+                (checksum,),
+            ).fetchone()
+    finally:
+        connection.close()
+    if row is None:
+        return None
+    entry = dict(zip(COLUMNS, row))
+    if entry["field_census"] is not None:
+        entry["field_census"] = json.loads(entry["field_census"])
+    return entry
+
+
+def row_counts() -> dict[str, int]:
+    """Nombre de lignes de chaque parquet en cache, par checksum."""
+    connection = connect()
+    try:
+        return dict(connection.execute("SELECT checksum, row_count FROM resources"))
+    finally:
+        connection.close()
+
+
+def list_entries() -> list[dict]:
+    """Tailles, dates et empreintes de toutes les entrées, de la moins récemment utilisée
+    à la plus récemment utilisée."""
+    columns = [
+        "checksum",
+        "parquet_size",
+        "get_size",
+        "created_at",
+        "last_used_at",
+        "cleaning_fingerprint",
+    ]
+    connection = connect()
+    try:
+        rows = connection.execute(
+            f"SELECT {', '.join(columns)} FROM resources ORDER BY last_used_at"
+        ).fetchall()
+    finally:
+        connection.close()
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def remove_entries(checksums: list[str]):
+    connection = connect()
+    try:
+        with connection:
+            connection.executemany(
+                "DELETE FROM resources WHERE checksum = ?",
+                [(checksum,) for checksum in checksums],
+            )
+    finally:
+        connection.close()
+
+
+def cached_parquet_files(
+    cleaning_fingerprint: str,
+    cache_dir: Path = RESOURCE_CACHE_DIR,
+    get_dir: Path = GET_DIR,
+) -> set[str]:
+    """Noms des parquet en cache ("<checksum>.parquet") réutilisables : produits par le
+    nettoyage actuel, ou dont le parquet de l'étape get permet de refaire le nettoyage.
+
+    Le manifeste est synchronisé avec le contenu du dossier : les entrées des fichiers
+    supprimés sont retirées, les fichiers sans entrée sont ajoutés (en supposant qu'ils
+    ont été produits par le nettoyage actuel)."""
+    logger = get_logger(level=LOG_LEVEL)
+
+    files = {name for name in os.listdir(cache_dir) if name.endswith(".parquet")}
+    checksums = {name.removesuffix(".parquet") for name in files}
+
+    entries = list_entries()
+    known = {entry["checksum"] for entry in entries}
+    remove_entries(list(known - checksums))
+
+    outdated = [
+        entry["checksum"]
+        for entry in entries
+        if entry["checksum"] in checksums
+        and entry["cleaning_fingerprint"] != cleaning_fingerprint
+    ]
+    recleanable = 0
+    for checksum in outdated:
+        if (get_dir / f"{checksum}.parquet").exists():
+            recleanable += 1
+        else:
+            files.discard(f"{checksum}.parquet")
+    if outdated:
+        logger.info(
+            f"{len(outdated)} parquet en cache produits par un autre nettoyage, dont "
+            f"{recleanable} à nettoyer à nouveau sans téléchargement"
+        )
+
+    new_entries = []
+    for checksum in checksums - known:
+        path = cache_dir / f"{checksum}.parquet"
+        try:
+            row_count, schema_hash, parquet_size = parquet_metadata(path)
+        except Exception as e:
+            # Parquet illisible : la ressource sera traitée à nouveau
+            logger.warning(f"Parquet en cache illisible, ignoré : {path.name} ({e})")
+            files.discard(path.name)
+            continue
+        created_at = datetime.fromtimestamp(path.stat().st_mtime).isoformat()
+        new_entries.append(
+            {
+                "checksum": checksum,
+                "row_count": row_count,
+                "schema_hash": schema_hash,
+                "decp_format": None,
+                "source_row_count": None,
+                "field_census": None,
+                "parquet_size": parquet_size,
+                "source_size": None,
+                "created_at": created_at,
+                "last_used_at": created_at,
+                "cleaning_fingerprint": cleaning_fingerprint,
+                "get_size": None,
+            }
+        )
+    if new_entries:
+        logger.info(f"{len(new_entries)} parquet en cache ajoutés au manifeste")
+        _insert_entries(new_entries)
+
+    return files
+
+
+def _insert_entries(entries: list[dict]):
+    connection = connect()
+    try:
+        with connection:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO resources VALUES ({', '.join('?' * len(COLUMNS))})",
+                [
+                    tuple(
+                        json.dumps(entry[column])
+                        if column == "field_census" and entry[column] is not None
+                        else entry[column]
+                        for column in COLUMNS
+                    )
+                    for entry in entries
+                ],
+            )
+    finally:
+        connection.close()
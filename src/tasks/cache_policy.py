@@ -0,0 +1,106 @@
+"""
+Politique d'éviction du cache des ressources (RESOURCE_CACHE_DIR).
+
+La date de dernière utilisation de chaque parquet est enregistrée dans le manifeste du
+cache (src/tasks/cache_manifest.py) quand get_clean le trouve en cache, plutôt que lue
+dans st_atime (non fiable sur un volume monté en noatime ou relatime).
+
+Sont supprimés, du moins récemment utilisé au plus récemment utilisé :
+- les parquet inutilisés depuis CACHE_EXPIRATION_TIME_HOURS
+- les parquet au-delà de la taille maximale du cache (RESOURCE_CACHE_MAX_SIZE_MB)
+Les parquet des ressources de l'exécution en cours ne sont jamais supprimés.
+
+Le parquet de l'étape get (GET_DIR) d'une ressource est supprimé avec celui du cache, et
+compte dans la taille du cache. Les parquet de GET_DIR sans entrée dans le manifeste
+(ressources dont le nettoyage a échoué par exemple) sont supprimés, sauf ceux de l'exécution
+en cours ou écrits depuis son début.
+"""
+
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from src.config import (
+    CACHE_EXPIRATION_TIME_HOURS,
+    GET_DIR,
+    LOG_LEVEL,
+    RESOURCE_CACHE_DIR,
+    RESOURCE_CACHE_MAX_SIZE_MB,
+)
+from src.tasks.cache_manifest import list_entries, remove_entries
+from src.tasks.utils import get_logger
+
+
+def evict_resource_cache(
+    protected_checksums: set[str],
+    run_started_at: str,
+    cache_dir: Path = RESOURCE_CACHE_DIR,
+    get_dir: Path = GET_DIR,
+    max_size_mb: int = RESOURCE_CACHE_MAX_SIZE_MB,
+    expiration_time_hours: int = CACHE_EXPIRATION_TIME_HOURS,
+) -> dict:
+    """Éviction des parquet en cache et statistiques du cache pour l'exécution en cours.
+
+    run_started_at (datetime.isoformat()) distingue les ressources de l'exécution trouvées
+    en cache de celles traitées (et mises en cache) pendant l'exécution."""
+    logger = get_logger(level=LOG_LEVEL)
+
+    entries = list_entries()
+    expired_before = (
+        datetime.now() - timedelta(hours=expiration_time_hours)
+    ).isoformat()
+    max_size = max_size_mb * 1024**2 if max_size_mb > 0 else None
+    sizes = {
+        entry["checksum"]: (entry["parquet_size"] or 0) + (entry["get_size"] or 0)
+        for entry in entries
+    }
+    total_size = sum(sizes.values())
+
+    evicted = []
+    freed_bytes = 0
+    for entry in entries:
+        if entry["checksum"] in protected_checksums:
+            continue
+        over_size = max_size is not None and total_size > max_size
+        if not over_size and entry["last_used_at"] >= expired_before:
+            # Les entrées suivantes sont plus récentes
+            break
+        (cache_dir / f"{entry['checksum']}.parquet").unlink(missing_ok=True)
+        (get_dir / f"{entry['checksum']}.parquet").unlink(missing_ok=True)
+        evicted.append(entry["checksum"])
+        size = sizes[entry["checksum"]]
+        freed_bytes += size
+        total_size -= size
+    remove_entries(evicted)
+
+    # Parquet de l'étape get sans entrée dans le manifeste
+    known_checksums = set(sizes) - set(evicted)
+    orphans = 0
+    for path in get_dir.glob("*.parquet"):
+        if path.stem in known_checksums or path.stem in protected_checksums:
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        if datetime.fromtimestamp(stat.st_mtime).isoformat() >= run_started_at:
+            continue
+        path.unlink(missing_ok=True)
+        orphans += 1
+        freed_bytes += stat.st_size
+
+    run_entries = [e for e in entries if e["checksum"] in protected_checksums]
+    hits = sum(1 for e in run_entries if e["created_at"] < run_started_at)
+    stats = {
+        "evicted_files": len(evicted) + orphans,
+        "freed_bytes": freed_bytes,
+        "cache_size_bytes": total_size,
+        "hits": hits,
+        "misses": len(run_entries) - hits,
+        "hit_ratio": round(hits / len(run_entries), 3) if run_entries else None,
+    }
+    logger.info(
+        f"-> {stats['evicted_files']} fichiers de cache supprimés "
+        f"({freed_bytes / 1024**2:.0f} Mo libérés, {total_size / 1024**2:.0f} Mo en cache), "
+        f"taux de succès du cache : {stats['hit_ratio']}"
+    )
+    return stats
@@ -0,0 +1,126 @@
+"""
+Points de reprise des étapes du flow decp_processing.
+
+Chaque étape terminée est enregistrée dans le dossier de l'exécution du jour
+(RUNS_DIR/<DATE_NOW>/checkpoints.json) avec le hash du contenu de ses entrées et de ses
+sorties. Une exécution relancée (après l'échec de la publication par exemple) saute les
+étapes dont les entrées n'ont pas changé et dont les sorties sont intactes, et reprend à
+la première étape qui a échoué.
+
+    checkpoints = StageCheckpoints()
+    if checkpoints.should_run("export", inputs=[path], outputs=[...]):
+        ...
+        checkpoints.done("export")
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+from src.config import DATE_NOW, LOG_LEVEL, RUNS_DIR
+from src.tasks.utils import get_logger
+
+PARQUET_MAGIC = b"PAR1"
+
+
+def file_hash(path: Path) -> str | None:
+    """Hash du contenu d'un fichier, None s'il n'existe pas.
+
+    Pour un parquet, seul le footer est lu : il contient les positions et les
+    statistiques de toutes les colonnes, et change donc avec le contenu du fichier."""
+    path = Path(path)
+    if not path.exists():
+        return None
+    hasher = hashlib.sha1()
+    size = path.stat().st_size
+    hasher.update(str(size).encode())
+    with open(path, "rb") as f:
+        if path.suffix == ".parquet" and size > 12:
+            f.seek(size - 8)
+            footer_length = int.from_bytes(f.read(4), "little")
+            if f.read(4) == PARQUET_MAGIC and footer_length <= size - 12:
+                f.seek(size - 8 - footer_length)
+                hasher.update(f.read(footer_length))
+                return hasher.hexdigest()
+            f.seek(0)
+        while chunk := f.read(1024**2):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def inputs_hash(inputs: list[Path], params: dict | None = None) -> str:
+    hasher = hashlib.sha1()
+    for path in sorted(str(path) for path in inputs):
+        hasher.update(f"{path}:{file_hash(path)}".encode())
+    hasher.update(json.dumps(params or {}, sort_keys=True, default=str).encode())
+    return hasher.hexdigest()
+
+
+class StageCheckpoints:
+    """Étapes terminées de l'exécution du jour, avec les hash de leurs entrées et sorties."""
+
+    def __init__(self, run_dir: Path | None = None):
+        self.run_dir = run_dir or RUNS_DIR / DATE_NOW
+        self.run_dir.mkdir(exist_ok=True, parents=True)
+        self.path = self.run_dir / "checkpoints.json"
+        self.stages = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                self.stages = json.load(f)
+        self._pending = {}
+
+    @property
+    def resumed(self) -> bool:
+        """Au moins une étape a déjà été terminée par une exécution précédente du jour."""
+        return bool(self.stages)
+
+    def should_run(
+        self,
+        stage: str,
+        inputs: list[Path],
+        outputs: list[Path],
+        params: dict | None = None,
+    ) -> bool:
+        """Faut-il exécuter l'étape ? (entrées modifiées, sorties absentes ou modifiées)"""
+        logger = get_logger(level=LOG_LEVEL)
+
+        input_hash = inputs_hash(inputs, params)
+        self._pending[stage] = (input_hash, outputs)
+        record = self.stages.get(stage)
+        if (
+            record is not None
+            and record["inputs_hash"] == input_hash
+            and all(
+                file_hash(path) == record["outputs"].get(str(path)) for path in outputs
+            )
+        ):
+            logger.info(
+                f"⏭️ Étape {stage} déjà effectuée le {record['finished_at']} "
+                "(entrées inchangées)"
+            )
+            return False
+        # L'étape sera à nouveau enregistrée une fois terminée
+        self.stages.pop(stage, None)
+        return True
+
+    def done(self, stage: str):
+        input_hash, outputs = self._pending.pop(stage)
+        self.stages[stage] = {
+            "inputs_hash": input_hash,
+            "outputs": {str(path): file_hash(path) for path in outputs},
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        # Écriture atomique : une exécution interrompue ne laisse pas un fichier tronqué
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.stages, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def remove_previous_runs(self):
+        """Suppression des dossiers des exécutions des jours précédents."""
+        for run_dir in self.run_dir.parent.iterdir():
+            if run_dir.is_dir() and run_dir != self.run_dir:
+                shutil.rmtree(run_dir)
@@ -1,23 +1,179 @@
 import datetime
+import hashlib
+import inspect
 import re
+import sys
+import time
+from dataclasses import dataclass
+from functools import cache
 
 import polars as pl
 from polars import selectors as cs
 
-from src.config import DecpFormat
+import src.schemas
+import src.tasks.dates
+import src.tasks.transform
+from src.config import DATE_CORRECTIONS_FILEPATH, LOG_LEVEL, DecpFormat
+from src.tasks.dates import parse_date
 from src.tasks.transform import (
     apply_modifications,
+    cast_low_cardinality,
 )
+from src.tasks.utils import get_logger
+
+# Colonne identifiant la ressource de chaque ligne lors d'un nettoyage de plusieurs
+# ressources en une seule requête (voir clean_batch)
+RESOURCE_KEY_COLUMN = "resource_checksum"
 
 
 def clean_decp(lf: pl.LazyFrame, decp_format: DecpFormat) -> pl.LazyFrame:
     """
     The bulk of Polars data cleaning is grouped here, with the exception of process_modifications and explode_titulaires that are not
     cleaning tasks.
+
+    The cleaning plan is built once per format and input schema (see cleaning_plan).
     :param lf:
     :param decp_format:
     :return:
     """
+    return cleaning_plan(decp_format, lf.collect_schema()).apply(lf)
+
+
+@dataclass
+class CleaningPlan:
+    """Nettoyage résolu pour un format et un schéma d'entrée, applicable à chaque ressource."""
+
+    label: str
+    # Opérations (nom de la méthode de pl.LazyFrame, arguments)
+    steps: list[tuple[str, tuple, dict]]
+    # Nombre de with_columns, après et avant fusion
+    projections: int
+    requested_projections: int
+    build_seconds: float
+
+    @property
+    def depth(self) -> int:
+        return len(self.steps)
+
+    @property
+    def unfused_depth(self) -> int:
+        return self.depth - self.projections + self.requested_projections
+
+    def apply(self, lf: pl.LazyFrame) -> pl.LazyFrame:
+        for name, args, kwargs in self.steps:
+            lf = getattr(lf, name)(*args, **kwargs)
+        return lf
+
+
+class CleaningPlanBuilder:
+    """Construction d'un CleaningPlan, avec les méthodes de pl.LazyFrame utilisées par le
+    nettoyage (build_cleaning_plan et ses fonctions).
+
+    Le schéma est résolu à chaque opération sur un LazyFrame vide, plutôt qu'en résolvant
+    à chaque collect_schema() tout le plan de la ressource. Les expressions des with_columns
+    successifs sont regroupées dans une même projection tant qu'elles ne lisent pas et ne
+    réécrivent pas une colonne produite par une autre expression du groupe. Une expression
+    à plusieurs colonnes (sélecteur) commence toujours une nouvelle projection."""
+
+    def __init__(self, schema: pl.Schema):
+        self.schema = schema
+        self.steps = []
+        self.projections = 0
+        self.requested_projections = 0
+        self._pending: list[pl.Expr] = []
+        self._pending_outputs: set[str] = set()
+
+    def collect_schema(self) -> pl.Schema:
+        return self.schema
+
+    def with_columns(self, *exprs) -> "CleaningPlanBuilder":
+        self.requested_projections += 1
+        for expr in [
+            e for item in exprs for e in (item if isinstance(item, list) else [item])
+        ]:
+            probe = pl.LazyFrame(schema=self.schema)
+            outputs = set(probe.select(expr).collect_schema().names())
+            reads = set(expr.meta.root_names())
+            # Les colonnes lues par un sélecteur (cs.string(), pl.col(pl.String)...) ne
+            # sont pas dans root_names() et dépendent du schéma : ces expressions
+            # commencent une nouvelle projection
+            if expr.meta.has_multiple_outputs() or (
+                (reads | outputs) & self._pending_outputs
+            ):
+                self._flush()
+            self._pending.append(expr)
+            self._pending_outputs |= outputs
+            self.schema = probe.with_columns(expr).collect_schema()
+        return self
+
+    def filter(self, *args, **kwargs) -> "CleaningPlanBuilder":
+        return self._operation("filter", *args, **kwargs)
+
+    def drop(self, *args, **kwargs) -> "CleaningPlanBuilder":
+        return self._operation("drop", *args, **kwargs)
+
+    def rename(self, *args, **kwargs) -> "CleaningPlanBuilder":
+        return self._operation("rename", *args, **kwargs)
+
+    def explode(self, *args, **kwargs) -> "CleaningPlanBuilder":
+        return self._operation("explode", *args, **kwargs)
+
+    def unnest(self, *args, **kwargs) -> "CleaningPlanBuilder":
+        return self._operation("unnest", *args, **kwargs)
+
+    def pipe(self, function, *args, **kwargs) -> "CleaningPlanBuilder":
+        return self._operation("pipe", function, *args, **kwargs)
+
+    def build(self, label: str, build_seconds: float) -> CleaningPlan:
+        self._flush()
+        return CleaningPlan(
+            label=label,
+            steps=self.steps,
+            projections=self.projections,
+            requested_projections=self.requested_projections,
+            build_seconds=build_seconds,
+        )
+
+    def _operation(self, name: str, *args, **kwargs) -> "CleaningPlanBuilder":
+        self._flush()
+        self.steps.append((name, args, kwargs))
+        probe = pl.LazyFrame(schema=self.schema)
+        self.schema = getattr(probe, name)(*args, **kwargs).collect_schema()
+        return self
+
+    def _flush(self):
+        if self._pending:
+            self.steps.append(("with_columns", tuple(self._pending), {}))
+            self.projections += 1
+            self._pending = []
+            self._pending_outputs = set()
+
+
+# Plans de nettoyage du processus, par format, schéma d'entrée et jour (les dates dans le
+# futur sont supprimées par rapport à la date de construction du plan)
+_cleaning_plans: dict[tuple, CleaningPlan] = {}
+
+
+def cleaning_plan(decp_format: DecpFormat, schema: pl.Schema) -> CleaningPlan:
+    key = (decp_format.label, tuple(schema.items()), datetime.date.today())
+    if key not in _cleaning_plans:
+        logger = get_logger(level=LOG_LEVEL)
+
+        start = time.perf_counter()
+        builder = build_cleaning_plan(CleaningPlanBuilder(schema), decp_format)
+        plan = builder.build(decp_format.label, time.perf_counter() - start)
+        logger.info(
+            f"🧹 Plan de nettoyage {plan.label} construit en "
+            f"{plan.build_seconds * 1000:.0f} ms : {plan.depth} opérations "
+            f"({plan.unfused_depth} sans fusion des projections)"
+        )
+        _cleaning_plans[key] = plan
+    return _cleaning_plans[key]
+
+
+def build_cleaning_plan(
+    lf: CleaningPlanBuilder, decp_format: DecpFormat
+) -> CleaningPlanBuilder:
     #
     # CLEAN DATA
     #
@@ -55,7 +211,9 @@ def clean_decp(lf: pl.LazyFrame, decp_format: DecpFormat) -> pl.LazyFrame:
     # Application des modifications
     # le plus tôt possible pour que les fonctions suivantes clean les
     # champs modifiés (dateNotification, datePublicationDonnnes, montant, titulaires, dureeMois)
-    lf = apply_modifications(lf)
+    columns = lf.collect_schema().names()
+    keys = [RESOURCE_KEY_COLUMN, "uid"] if RESOURCE_KEY_COLUMN in columns else ["uid"]
+    lf = lf.pipe(apply_modifications, columns=columns, keys=keys)
 
     # Explosion des titulaires
     lf = lf.explode("titulaires").unnest("titulaires")
@@ -70,38 +228,6 @@ def clean_decp(lf: pl.LazyFrame, decp_format: DecpFormat) -> pl.LazyFrame:
         .alias("montant")
     )
 
-    # Dates
-    date_replacements = {
-        # ID marché invalide et SIRET de l'acheteur
-        "0002-11-30": "",
-        "September, 16 2021 00:00:00": "2021-09-16",  # 2000769
-        # 5800012 19830766200017 (plein !)
-        "16 2021 00:00:00": "",
-        "0222-04-29": "2022-04-29",  # 202201L0100
-        "0021-12-05": "2022-12-05",  # 20222022/1400
-        "0001-06-21": "",  # 0000000000000000 21850109600018
-        "0019-10-18": "",  # 0000000000000000 34857909500012
-        "5021-02-18": "2021-02-18",  # 20213051200 21590015000016
-        "2921-11-19": "",  # 20220057201 20005226400013
-        "0022-04-29": "2022-04-29",  # 2022AOO-GASL0100 25640454200035
-    }
-
-    # Using replace_many for efficient replacement of multiple date values
-    lf = lf.with_columns(
-        pl.col(["datePublicationDonnees", "dateNotification"])
-        .str.replace_many(date_replacements)
-        .cast(pl.Utf8)
-        .name.keep()
-    )
-
-    # suppression des suffixes de fuseau horaire
-    lf = lf.with_columns(
-        pl.col(["datePublicationDonnees", "dateNotification"])
-        .str.split("+")
-        .list[0]
-        .name.keep()
-    )
-
     # Nature
     lf = lf.with_columns(
         pl.col("nature")
@@ -158,6 +284,9 @@ def clean_decp(lf: pl.LazyFrame, decp_format: DecpFormat) -> pl.LazyFrame:
     # Correction des datatypes
     lf = fix_data_types(lf)
 
+    # Colonnes à faible cardinalité en pl.Enum ou pl.Categorical
+    lf = cast_low_cardinality(lf)
+
     return lf
 
 
@@ -172,11 +301,14 @@ def extract_innermost_struct(x):
     return None  # fallback
 
 
+# "ASCII control characters", caractères invalides en XML. Ce sont des octets < 0x80,
+# qui ne peuvent donc pas faire partie d'un caractère multi-octets (UTF-8 ou autre)
+INVALID_XML_CHARACTERS = rb"[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]"
+
+
 def clean_invalid_characters(chunk: bytes):
     """Supprime les "ASCII control characters", caractères invalides en XML."""
-    chunk = chunk.decode("utf-8")
-    chunk = re.sub(r"[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]", "", chunk)
-    return bytes(chunk, "utf-8")
+    return re.sub(INVALID_XML_CHARACTERS, b"", chunk)
 
 
 def clean_null_equivalent(lf: pl.LazyFrame) -> pl.LazyFrame:
@@ -290,7 +422,6 @@ def fix_data_types(lf: pl.LazyFrame) -> pl.LazyFrame:
         # Les valeurs qui ne sont pas des chiffres sont converties en null
         lf = lf.with_columns(pl.col(column).cast(dtype, strict=False))
 
-    # Convert date columns to datetime using str.strptime
     dates_col = [
         "dateNotification",
         # "dateNotificationActeSousTraitance",
@@ -302,11 +433,9 @@ def fix_data_types(lf: pl.LazyFrame) -> pl.LazyFrame:
         # "datePublicationDonneesModificationModification",
     ]
 
-    # Fix dates
-    lf = lf.with_columns(
-        # Les valeurs qui ne sont pas des dates sont converties en null
-        pl.col(dates_col).str.strptime(pl.Date, format="%Y-%m-%d", strict=False)
-    )
+    # Dates ISO, formats récurrents et corrections (voir src/tasks/dates.py)
+    # Les valeurs qui ne sont pas des dates sont converties en null
+    lf = lf.with_columns([parse_date(col) for col in dates_col])
 
     # Suppression des dates dans le futur
     for col in dates_col:
@@ -361,3 +490,22 @@ def process_string_lists(lf: pl.LazyFrame):
     lf = lf.with_columns(cs.by_dtype(pl.List(pl.String)).list.join(", ").name.keep())
 
     return lf
+
+
+@cache
+def cleaning_fingerprint() -> str:
+    """Empreinte du code des modules utilisés par le nettoyage (ce module, src.schemas,
+    src.tasks.transform, src.tasks.dates) et des corrections de dates.
+
+    Elle fait partie de la clé du cache des ressources : si elle change, les ressources
+    en cache sont nettoyées à nouveau à partir des parquet de l'étape get."""
+    hasher = hashlib.sha1()
+    for module in [
+        sys.modules[__name__],
+        src.schemas,
+        src.tasks.transform,
+        src.tasks.dates,
+    ]:
+        hasher.update(inspect.getsource(module).encode())
+    hasher.update(DATE_CORRECTIONS_FILEPATH.read_bytes())
+    return hasher.hexdigest()[:16]
@@ -0,0 +1,249 @@
+"""
+Construction incrémentale du jeu de données consolidé (DECP_INCREMENTAL_BUILD).
+
+Le jeu de données consolidé et enrichi (concaténation, dédoublonnage, tri des
+modifications, données SIRENE et géocodage) est conservé d'une exécution à l'autre dans
+CONSOLIDATED_DIR, avec un index des uid de chaque ressource (checksum).
+
+À chaque exécution :
+- les uid des ressources retirées (index) et des ressources nouvelles ou modifiées
+  (nouveau checksum) sont les uid affectés
+- les lignes des uid affectés sont retirées du jeu de données consolidé
+- les marchés des uid affectés sont relus dans les seules ressources qui les contiennent,
+  puis dédoublonnés et enrichis, et ajoutés au jeu de données consolidé
+
+La durée de la consolidation dépend ainsi du nombre de ressources modifiées, et non du
+nombre total de ressources.
+
+Le jeu de données est reconstruit entièrement si le code de consolidation, le nettoyage
+ou les données SIRENE ont changé depuis sa construction (build_fingerprint). Les
+coordonnées de siret_latlong.parquet, mis à jour par le géocodage de chaque exécution,
+sont appliquées à toutes les lignes, y compris celles de la construction précédente
+(apply_siret_latlong).
+"""
+
+import hashlib
+import inspect
+import json
+import os
+from collections.abc import Callable
+from datetime import datetime
+from pathlib import Path
+
+import polars as pl
+import pyarrow.parquet as pq
+
+import src.tasks.enrich
+import src.tasks.transform
+from src.config import CONSOLIDATED_DIR, LOG_LEVEL, SIRENE_DATA_DIR
+from src.tasks.clean import cleaning_fingerprint
+from src.tasks.transform import (
+    concat_parquet_files,
+    non_empty_parquet_files,
+    remove_duplicate_rows,
+)
+from src.tasks.utils import calculate_duplicates_across_source, get_logger
+
+# Enrichissement des lignes consolidées : tri des modifications, SIRENE, géocodage.
+# Renvoie les lignes enrichies et le chemin de siret_latlong.parquet mis à jour.
+Enrich = Callable[[pl.LazyFrame], tuple[pl.LazyFrame, Path]]
+
+
+def build_fingerprint() -> str:
+    """Empreinte de ce qui détermine le contenu des lignes consolidées, en dehors des
+    ressources elles-mêmes."""
+    hasher = hashlib.sha1()
+    hasher.update(cleaning_fingerprint().encode())
+    hasher.update(SIRENE_DATA_DIR.name.encode())
+    # Contenu des données SIRENE (métadonnées des parquet : lignes, tailles, statistiques),
+    # qui peuvent être à nouveau préparées dans le même dossier
+    for name in ["unites_legales.parquet", "etablissements.parquet"]:
+        path = SIRENE_DATA_DIR / name
+        if path.exists():
+            hasher.update(repr(pq.read_metadata(path).to_dict()).encode())
+    for module in [src.tasks.transform, src.tasks.enrich]:
+        hasher.update(inspect.getsource(module).encode())
+    return hasher.hexdigest()[:16]
+
+
+def load_state(consolidated_dir: Path = CONSOLIDATED_DIR) -> dict | None:
+    """État de la dernière construction, None s'il n'y en a pas ou si ses fichiers
+    manquent."""
+    state_path = consolidated_dir / "state.json"
+    if not state_path.exists():
+        return None
+    if (
+        not (consolidated_dir / "decp.parquet").exists()
+        or not (consolidated_dir / "uid_index.parquet").exists()
+    ):
+        return None
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def scan_uids(parquet_files: list) -> pl.LazyFrame:
+    """Index des uid (et de leur source) de chaque ressource."""
+    return pl.concat(
+        [
+            pl.scan_parquet(file)
+            .select("uid", "sourceDataset")
+            .unique()
+            .with_columns(pl.lit(Path(file).stem).alias("checksum"))
+            for file in parquet_files
+        ],
+        how="vertical",
+    ).select("checksum", "uid", "sourceDataset")
+
+
+def build_consolidated(
+    parquet_files: list,
+    enrich: Enrich,
+    consolidated_dir: Path = CONSOLIDATED_DIR,
+) -> tuple[pl.LazyFrame, Path]:
+    """Jeu de données consolidé et enrichi, mis à jour à partir des ressources modifiées
+    depuis la dernière construction."""
+    logger = get_logger(level=LOG_LEVEL)
+    consolidated_dir.mkdir(exist_ok=True, parents=True)
+    decp_path = consolidated_dir / "decp.parquet"
+    index_path = consolidated_dir / "uid_index.parquet"
+
+    files = {Path(file).stem: file for file in non_empty_parquet_files(parquet_files)}
+    fingerprint = build_fingerprint()
+    state = load_state(consolidated_dir)
+    incremental = state is not None and state["build_fingerprint"] == fingerprint
+
+    if not incremental:
+        logger.info("Construction complète du jeu de données consolidé...")
+        lf, siret_latlong_path = enrich(concat_parquet_files(list(files.values())))
+        lf_index = scan_uids(list(files.values()))
+    else:
+        previous = set(state["checksums"])
+        added = [files[checksum] for checksum in files.keys() - previous]
+        removed = list(previous - files.keys())
+        logger.info(
+            f"Mise à jour du jeu de données consolidé : {len(added)} ressources "
+            f"nouvelles ou modifiées, {len(removed)} ressources retirées"
+        )
+
+        lf_previous_index = pl.scan_parquet(index_path)
+        lf_added_index = (
+            scan_uids(added).collect().lazy() if added else lf_previous_index.clear()
+        )
+        affected_uids = (
+            pl.concat(
+                [
+                    lf_previous_index.filter(pl.col("checksum").is_in(removed)),
+                    lf_added_index,
+                ]
+            )
+            .select("uid")
+            .unique()
+            .collect()
+            .to_series()
+        )
+        lf_index = pl.concat(
+            [
+                lf_previous_index.filter(~pl.col("checksum").is_in(removed)),
+                lf_added_index,
+            ]
+        )
+
+        # Seules les ressources qui contiennent des uid affectés sont relues
+        affected_checksums = (
+            lf_index.filter(pl.col("uid").is_in(affected_uids))
+            .select("checksum")
+            .unique()
+            .collect()
+            .to_series()
+            .to_list()
+        )
+        logger.info(
+            f"{len(affected_uids)} uid affectés, relus dans "
+            f"{len(affected_checksums)} ressources"
+        )
+        lf_affected = remove_duplicate_rows(
+            pl.concat(
+                [pl.scan_parquet(files[checksum]) for checksum in affected_checksums]
+                # Aucun uid affecté : l'enrichissement (et le géocodage) porte sur un lf vide
+                or [pl.scan_parquet(next(iter(files.values()))).clear()],
+                how="vertical",
+            ).filter(pl.col("uid").is_in(affected_uids))
+        )
+        lf_affected, siret_latlong_path = enrich(lf_affected)
+
+        lf_kept = pl.scan_parquet(decp_path).filter(~pl.col("uid").is_in(affected_uids))
+        lf = pl.concat(
+            [lf_kept, lf_affected.select(lf_kept.collect_schema().names())],
+            how="vertical_relaxed",
+        )
+
+    lf = apply_siret_latlong(lf, siret_latlong_path)
+
+    # Écriture dans des fichiers temporaires : les fichiers actuels sont lus par le lf
+    lf.sink_parquet(decp_path.with_suffix(".tmp"))
+    lf_index.sink_parquet(index_path.with_suffix(".tmp"))
+    os.replace(decp_path.with_suffix(".tmp"), decp_path)
+    os.replace(index_path.with_suffix(".tmp"), index_path)
+    with open(consolidated_dir / "state.json", "w") as f:
+        json.dump(
+            {
+                # Les données SIRENE ont pu être préparées pendant l'enrichissement
+                "build_fingerprint": build_fingerprint(),
+                "checksums": sorted(files),
+                "updated_at": datetime.now().isoformat(),
+            },
+            f,
+        )
+
+    if incremental:
+        # En construction complète, calculé par concat_parquet_files
+        logger.info("Calcul des % de doublons entre sources...")
+        calculate_duplicates_across_source(pl.scan_parquet(index_path))
+
+    return pl.scan_parquet(decp_path), siret_latlong_path
+
+
+def apply_siret_latlong(lf: pl.LazyFrame, siret_latlong_path: Path) -> pl.LazyFrame:
+    """Coordonnées des SIRET géocodés (siret_latlong.parquet) appliquées aux acheteurs et
+    aux titulaires, puis distance acheteur-titulaire recalculée.
+
+    Les lignes conservées de la construction précédente n'étant pas enrichies à nouveau,
+    elles reçoivent ainsi les SIRET géocodés depuis leur enrichissement."""
+    columns = lf.collect_schema().names()
+    if not Path(siret_latlong_path).exists() or not all(
+        f"{type_siret}_{coordinate}" in columns
+        for type_siret in ["acheteur", "titulaire"]
+        for coordinate in ["latitude", "longitude"]
+    ):
+        return lf
+
+    lf_latlong = (
+        pl.scan_parquet(siret_latlong_path)
+        .filter(pl.col("status") == "success")
+        .select("siret", "latitude", "longitude")
+        .unique("siret", keep="last")
+    )
+    for type_siret in ["acheteur", "titulaire"]:
+        is_siret = (
+            pl.col("titulaire_typeIdentifiant") == "SIRET"
+            if type_siret == "titulaire"
+            else pl.lit(True)
+        )
+        lf = lf.join(
+            lf_latlong,
+            left_on=f"{type_siret}_id",
+            right_on="siret",
+            how="left",
+            maintain_order="left",
+        )
+        lf = lf.with_columns(
+            [
+                pl.when(is_siret & pl.col(coordinate).is_not_null())
+                .then(pl.col(coordinate))
+                .otherwise(pl.col(f"{type_siret}_{coordinate}"))
+                .alias(f"{type_siret}_{coordinate}")
+                for coordinate in ["latitude", "longitude"]
+            ]
+        ).drop("latitude", "longitude")
+
+    return src.tasks.enrich.calculate_distance(lf)
@@ -0,0 +1,79 @@
+"""
+Normalisation des dates (dateNotification, datePublicationDonnees et leurs modifications).
+
+Les valeurs sont converties en pl.Date en une seule expression par colonne :
+- dates ISO, avec ou sans heure et fuseau horaire (2023-01-01, 2023-01-01T10:00:00,
+  2023-01-01+02:00, 2023-01-01-05:00, 2023-01-01Z...), dont seule la date est gardée
+- valeurs corrigées par la table de corrections (ex : 0222-04-29 → 2022-04-29), ou
+  supprimées si la correction est null
+- formats non ISO récurrents (ex : September, 16 2021 00:00:00)
+
+Les formats et les corrections sont dans DATE_CORRECTIONS_FILEPATH.
+"""
+
+import json
+from functools import cache
+
+import polars as pl
+
+from src.config import DATE_CORRECTIONS_FILEPATH
+
+# Date d'une date ou d'un datetime ISO, suivie d'une heure ou d'un fuseau horaire
+ISO_DATE_PATTERN = r"^(\d{4}-\d{2}-\d{2})(?:$|[T ]|Z$|[+-]\d{2}:?\d{2}$)"
+
+# Colonnes de dates des parquet de l'étape get, pour le comptage des dates reconnues et rejetées
+DATE_COLUMNS = [
+    "dateNotification",
+    "datePublicationDonnees",
+    "modification_dateNotificationModification",
+    "modification_datePublicationDonneesModification",
+]
+
+# Valeurs équivalentes à une date absente, qui ne sont pas comptées comme rejetées
+NULL_DATE_VALUES = ["", "NC"]
+
+
+@cache
+def date_corrections() -> tuple[list[str], dict[str, str | None]]:
+    """Formats non ISO acceptés et corrections (valeur → correction) de DATE_CORRECTIONS_FILEPATH."""
+    with open(DATE_CORRECTIONS_FILEPATH) as f:
+        reference = json.load(f)
+    formats = [item["format"] for item in reference["formats"]]
+    corrections = {
+        item["valeur"]: item["correction"] for item in reference["corrections"]
+    }
+    return formats, corrections
+
+
+def parse_date(column: str) -> pl.Expr:
+    """Date de la colonne (pl.String), null si la valeur n'est pas une date reconnue."""
+    formats, corrections = date_corrections()
+    value = pl.col(column).str.strip_chars()
+    value = pl.coalesce(value.str.extract(ISO_DATE_PATTERN), value).replace(
+        list(corrections), list(corrections.values())
+    )
+    return pl.coalesce(
+        value.str.to_date("%Y-%m-%d", strict=False),
+        *[value.str.to_date(date_format, strict=False) for date_format in formats],
+    ).alias(column)
+
+
+def date_parsing_counts(
+    lf: pl.LazyFrame, columns: list[str], by: list[str] | None = None
+) -> pl.LazyFrame:
+    """Nombre de valeurs de dates reconnues (parsed) et rejetées (rejected) des colonnes,
+    par valeur des colonnes by si elles sont indiquées."""
+    parsed = []
+    rejected = []
+    for column in columns:
+        present = pl.col(column).str.strip_chars().is_in(NULL_DATE_VALUES).not_()
+        date = parse_date(column)
+        parsed.append(date.is_not_null().sum())
+        rejected.append((present & date.is_null()).sum())
+    counts = [
+        pl.sum_horizontal(parsed).alias("parsed"),
+        pl.sum_horizontal(rejected).alias("rejected"),
+    ]
+    if by:
+        return lf.group_by(by).agg(counts)
+    return lf.select(counts)
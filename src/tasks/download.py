@@ -0,0 +1,215 @@
+"""
+Téléchargement asynchrone des ressources, séparé de leur traitement (get_clean).
+
+Les ressources sont téléchargées par une boucle asyncio (httpx.AsyncClient) dans un thread
+dédié, avec un nombre limité de connexions au total (DOWNLOAD_MAX_CONNECTIONS) et par hôte
+(DOWNLOAD_MAX_CONNECTIONS_PER_HOST). Chaque ressource téléchargée est écrite dans
+DOWNLOAD_DIR puis transmise aux workers de traitement : un hôte lent occupe une connexion,
+pas un worker.
+
+Le nombre de ressources téléchargées qui ne sont pas encore traitées est limité à
+DOWNLOAD_QUEUE_SIZE : au-delà, les téléchargements attendent la fin de traitements.
+"""
+
+import asyncio
+import importlib.util
+import queue
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from functools import partial
+from pathlib import Path
+
+import httpx
+
+from src.config import (
+    ASYNC_DOWNLOAD,
+    DOWNLOAD_DIR,
+    DOWNLOAD_HTTP2,
+    DOWNLOAD_MAX_CONNECTIONS,
+    DOWNLOAD_MAX_CONNECTIONS_PER_HOST,
+    DOWNLOAD_QUEUE_SIZE,
+    HTTP_HEADERS,
+    LOG_LEVEL,
+)
+from src.tasks.get import cache_status
+from src.tasks.profiling import add_phase_time
+from src.tasks.raw_store import is_stored
+from src.tasks.revalidation import (
+    conditional_headers,
+    get_validators,
+    is_not_modified,
+    response_validators,
+)
+from src.tasks.utils import full_resource_name, get_logger
+
+MAX_REDIRECTS = 20
+
+
+class DownloadPipeline:
+    """Ressources prêtes à être traitées, au fur et à mesure de leur téléchargement.
+
+    for resource in pipeline:
+        future = executor.submit(get_clean, resource, ...)
+        future.add_done_callback(partial(pipeline.done, resource))
+    """
+
+    def __init__(
+        self,
+        resources: list[dict],
+        available_parquet_files: set,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.resources = resources
+        self.available_parquet_files = available_parquet_files
+        self.transport = transport
+        self._ready = queue.Queue()
+        self._loop = None
+        self._slots = None
+        # Ressources téléchargées, en attente ou en cours de traitement (id des dicts)
+        self._holding_slot = set()
+
+    def __iter__(self) -> Iterator[dict]:
+        if not ASYNC_DOWNLOAD:
+            yield from self.resources
+            return
+
+        to_download = [r for r in self.resources if self.needs_download(r)]
+        to_download_ids = {id(r) for r in to_download}
+        thread = threading.Thread(
+            target=asyncio.run, args=(self._download_all(to_download),), daemon=True
+        )
+        thread.start()
+
+        # Ressources en cache ou locales : pas de téléchargement
+        for resource in self.resources:
+            if id(resource) not in to_download_ids:
+                yield resource
+
+        for _ in range(len(to_download)):
+            yield self._ready.get()
+        thread.join()
+
+    def needs_download(self, resource: dict) -> bool:
+        if not resource["url"].startswith("http"):
+            return False
+        in_cache, resource["revalidate"] = cache_status(
+            resource, self.available_parquet_files
+        )
+        if in_cache and not resource["revalidate"]:
+            return False
+        return not is_stored(resource["checksum"])
+
+    def done(self, resource: dict, future=None):
+        """À appeler une fois la ressource traitée : suppression du fichier téléchargé
+        et place libérée pour un nouveau téléchargement."""
+        downloaded_path = resource.pop("downloaded_path", None)
+        if downloaded_path:
+            Path(downloaded_path).unlink(missing_ok=True)
+
+        if id(resource) in self._holding_slot:
+            self._holding_slot.discard(id(resource))
+            try:
+                self._loop.call_soon_threadsafe(self._slots.release)
+            except RuntimeError:
+                # Tous les téléchargements sont terminés, la boucle est fermée
+                pass
+
+    async def _download_all(self, resources: list[dict]):
+        self._loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(DOWNLOAD_QUEUE_SIZE)
+        hosts = defaultdict(
+            partial(asyncio.Semaphore, DOWNLOAD_MAX_CONNECTIONS_PER_HOST)
+        )
+        DOWNLOAD_DIR.mkdir(exist_ok=True, parents=True)
+
+        try:
+            client = httpx.AsyncClient(
+                headers=HTTP_HEADERS,
+                http2=use_http2(),
+                timeout=20,
+                limits=httpx.Limits(max_connections=DOWNLOAD_MAX_CONNECTIONS),
+                transport=self.transport,
+            )
+        except Exception as e:
+            # Les ressources seront téléchargées par les workers
+            logger = get_logger(level=LOG_LEVEL)
+            logger.error(f"Téléchargement asynchrone impossible ({e})")
+            for resource in resources:
+                self._ready.put(resource)
+            return
+
+        async with client:
+            await asyncio.gather(
+                *[self._download(client, hosts, resource) for resource in resources]
+            )
+
+    async def _download(self, client: httpx.AsyncClient, hosts, resource: dict):
+        logger = get_logger(level=LOG_LEVEL)
+
+        await self._slots.acquire()
+        try:
+            start = time.perf_counter()
+            await download_resource(client, hosts, resource)
+            add_phase_time(resource, "download", time.perf_counter() - start)
+        except Exception as e:
+            # Nouvel essai, synchrone, par le worker qui traitera la ressource
+            logger.warning(
+                f"Échec du téléchargement de {full_resource_name(resource)} ({type(e).__name__}: {e})"
+            )
+        finally:
+            if "downloaded_path" in resource:
+                self._holding_slot.add(id(resource))
+            else:
+                self._slots.release()
+            self._ready.put(resource)
+
+
+async def download_resource(client: httpx.AsyncClient, hosts, resource: dict):
+    """Téléchargement d'une ressource dans DOWNLOAD_DIR (resource["downloaded_path"]),
+    ou resource["not_modified"] si elle n'a pas changé depuis sa mise en cache.
+
+    Les redirections (www.data.gouv.fr/api/1/datasets/r/... vers l'hôte du fichier) sont
+    suivies une par une, pour appliquer la limite de connexions de chaque hôte."""
+    validators = get_validators(resource["url"]) if resource["revalidate"] else None
+    headers = conditional_headers(validators)
+    path = DOWNLOAD_DIR / resource["filename"]
+
+    url = resource["url"]
+    for _ in range(MAX_REDIRECTS):
+        async with hosts[httpx.URL(url).host]:
+            async with client.stream("GET", url, headers=headers) as response:
+                if response.is_redirect:
+                    url = str(response.next_request.url)
+                    continue
+
+                if is_not_modified(response, validators):
+                    resource["not_modified"] = True
+                    return
+                response.raise_for_status()
+
+                try:
+                    # Écriture synchrone : disque local, chunks de 1 Mo
+                    with open(path, "wb") as f:
+                        async for chunk in response.aiter_bytes(1024**2):
+                            f.write(chunk)
+                except BaseException:
+                    path.unlink(missing_ok=True)
+                    raise
+
+                resource["http_validators"] = response_validators(response)
+                resource["downloaded_path"] = str(path)
+                return
+
+    raise httpx.TooManyRedirects(f"Plus de {MAX_REDIRECTS} redirections pour {url}")
+
+
+def use_http2() -> bool:
+    if DOWNLOAD_HTTP2 and importlib.util.find_spec("h2") is None:
+        logger = get_logger(level=LOG_LEVEL)
+        logger.warning(
+            'DOWNLOAD_HTTP2 : le paquet h2 n\'est pas installé (pip install "httpx[http2]"), téléchargements en HTTP/1.1'
+        )
+        return False
+    return DOWNLOAD_HTTP2
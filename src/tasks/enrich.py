@@ -11,8 +11,10 @@ from src.config import (
     SIRENE_DATA_DIR,
     SIRET_LATLONG_SCHEMA,
 )
+from src.schemas import SCHEMA_LOW_CARDINALITY
 from src.tasks.get import bootstrap_siret_latlong, get_from_s3
 from src.tasks.transform import (
+    cast_low_cardinality,
     extract_unique_acheteurs_siret,
     extract_unique_titulaires_siret,
 )
@@ -79,7 +81,8 @@ def add_etablissement_data(
             require_all=False,
         )
     )
-    return lf_sirets
+    # Noms des communes, départements et régions en pl.Categorical
+    return cast_low_cardinality(lf_sirets)
 
 
 def add_unite_legale_data(
@@ -165,7 +168,8 @@ def add_unite_legale_data(
 
     lf_sirets = lf_sirets.drop("categorieJuridiqueUniteLegale")
 
-    return lf_sirets
+    # acheteur_categorie et titulaire_categorie en pl.Enum
+    return cast_low_cardinality(lf_sirets)
 
 
 def enrich_from_sirene(lf: pl.LazyFrame):
@@ -332,6 +336,7 @@ def add_type_marche(lf: pl.LazyFrame) -> pl.LazyFrame:
         .then(pl.lit("Services"))
         .otherwise(pl.lit("Non catégorisé"))
         .fill_null(pl.lit("Code CPV invalide"))
+        .cast(SCHEMA_LOW_CARDINALITY["type"])
         .alias("type")
     )
     return lf
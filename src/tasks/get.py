@@ -1,6 +1,10 @@
-import tempfile
-from collections.abc import Iterator
-from functools import partial
+import sys
+import time
+from collections import defaultdict
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from functools import cache, partial
+from itertools import chain
 from pathlib import Path
 from time import sleep
 
@@ -19,11 +23,16 @@ from tenacity import (
 )
 
 from src.config import (
+    BATCH_CLEANING_MAX_FILESIZE,
+    BATCH_CLEANING_SIZE,
     DATA_DIR,
+    DECP_BATCH_CLEANING,
     DECP_PROCESSING_PUBLISH,
     DECP_USE_CACHE,
+    GET_DIR,
     HTTP_CLIENT,
     HTTP_HEADERS,
+    JSON_WHOLE_DOCUMENT_MAX_SIZE,
     LOG_LEVEL,
     RESOURCE_CACHE_DIR,
     S3_ACCESS_KEY_ID,
@@ -37,32 +46,93 @@ from src.config import (
     check_s3_config,
 )
 from src.schemas import SCHEMA_MARCHE_2019, SCHEMA_MARCHE_2022
+from src.tasks.cache_manifest import get_entry, record_resource
 from src.tasks.clean import (
+    INVALID_XML_CHARACTERS,
+    RESOURCE_KEY_COLUMN,
     clean_decp,
-    clean_invalid_characters,
+    cleaning_fingerprint,
     extract_innermost_struct,
 )
-from src.tasks.output import sink_to_files
+from src.tasks.dates import DATE_COLUMNS, date_parsing_counts
+from src.tasks.output import ParquetRowWriter, sink_to_files
+from src.tasks.profiling import add_phase_time, profiled, record_profile
 from src.tasks.publish import publish_to_s3
+from src.tasks.raw_store import hash_algorithm, read_raw, store_raw
+from src.tasks.revalidation import (
+    ResourceNotModified,
+    conditional_headers,
+    get_validators,
+    is_not_modified,
+    response_validators,
+    save_validators,
+)
 from src.tasks.transform import prepare_unites_legales
 from src.tasks.utils import (
+    FieldCensus,
+    StreamRewriter,
     full_resource_name,
     gen_artifact_row,
     get_logger,
-    stream_replace_bytestring,
 )
 
 
+def select_ijson_backend():
+    """Sélection du backend ijson le plus rapide disponible (C > CFFI > ctypes > python)."""
+    for backend_name in ["yajl2_c", "yajl2_cffi", "yajl2", "python"]:
+        try:
+            return ijson.get_backend(backend_name)
+        except ImportError:
+            continue
+
+
+IJSON_BACKEND = select_ijson_backend()
+
+
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=20))
-def stream_get(url: str, chunk_size=1024**2):  # chunk_size en octets (1 Mo par défaut)
+def stream_get(url: str, chunk_size=1024**2, resource: dict | None = None):
+    """Téléchargement en flux d'une ressource, par chunks de chunk_size octets.
+
+    Si la ressource (voir list_resources) est fournie :
+    - elle est lue depuis le stockage local des ressources téléchargées si son checksum
+      y est, ou y est ajoutée une fois téléchargée
+    - si elle a déjà été téléchargée par src/tasks/download.py, le fichier téléchargé
+      (resource["downloaded_path"]) est lu, ou ResourceNotModified est levée si elle n'a
+      pas changé (resource["not_modified"])
+    - si resource["revalidate"] est vrai, la requête est conditionnelle et lève
+      ResourceNotModified si la ressource n'a pas changé
+    - les validateurs HTTP de la réponse (ETag, etc.) sont ajoutés dans
+      resource["http_validators"]"""
     logger = get_logger(level=LOG_LEVEL)
+    resource = resource if resource is not None else {}
+    checksum = resource.get("checksum")
 
     if url.startswith("http"):
+        if resource.get("not_modified"):
+            raise ResourceNotModified(url)
+
+        stored_chunks = read_raw(checksum, chunk_size)
+        if stored_chunks is not None:
+            logger.debug(f"Lecture depuis le stockage local : {url}")
+            yield from stored_chunks
+            return
+
+        if resource.get("downloaded_path"):
+            # Ressource déjà téléchargée (src/tasks/download.py)
+            with open(resource["downloaded_path"], "rb") as f:
+                yield from store_raw(iter(partial(f.read, chunk_size), b""), checksum)
+            return
+
+        validators = get_validators(url) if resource.get("revalidate") else None
+        headers = HTTP_HEADERS | conditional_headers(validators)
         try:
             with HTTP_CLIENT.stream(
-                "GET", url, headers=HTTP_HEADERS, follow_redirects=True, timeout=20
+                "GET", url, headers=headers, follow_redirects=True, timeout=20
             ) as response:
-                yield from response.iter_bytes(chunk_size)
+                if is_not_modified(response, validators):
+                    raise ResourceNotModified(url)
+                resource["http_validators"] = response_validators(response)
+                yield from store_raw(response.iter_bytes(chunk_size), checksum)
         except httpx.TooManyRedirects:
             logger.error(f"⛔️ Erreur 429 Too Many Requests pour {url}")
             return
@@ -74,45 +144,50 @@ def stream_get(url: str, chunk_size=1024**2):  # chunk_size en octets (1 Mo par
                 yield chunk
 
 
-def get_resource(
-    r: dict, resources_artifact: list[dict] | list
-) -> tuple[pl.LazyFrame | None, DecpFormat | None]:
+def get_resource(r: dict) -> tuple[pl.LazyFrame | None, DecpFormat | None]:
     logger = get_logger(level=LOG_LEVEL)
 
     if DECP_PROCESSING_PUBLISH is False:
         logger.info(f"➡️  {full_resource_name(r)}")
 
-    output_path = DATA_DIR / "get" / r["filename"]
+    # Conservé pour refaire le nettoyage sans téléchargement (voir cleaning_fingerprint)
+    output_path = GET_DIR / r["checksum"]
     output_path.parent.mkdir(exist_ok=True, parents=True)
     url = r["url"]
     file_format = r["format"]
     logger.debug(f"Récupération de {r['dataset_code']} - {r['ori_filename']}")
+    # Le parsing est le temps de l'étape get qui n'est compté dans aucune autre phase
+    phases_before = sum(r.get("phases", {}).values())
+    start = time.perf_counter()
     if file_format == "json":
-        fields, decp_format = json_stream_to_parquet(url, output_path, r)
+        census, decp_format = json_stream_to_parquet(url, output_path, r)
     elif file_format == "xml":
-        try:
-            fields, decp_format = xml_stream_to_parquet(
-                url, output_path, fix_chars=False
-            )
-        except etree.XMLSyntaxError:
-            fields, decp_format = xml_stream_to_parquet(
-                url, output_path, fix_chars=True
-            )
+        census, decp_format = xml_stream_to_parquet(url, output_path, r)
+        if r["replacements"]["control_characters"]:
             logger.info(f"♻️  {full_resource_name(r)} nettoyé et traité")
     else:
         logger.warning(f"▶️  Format de fichier non supporté : {full_resource_name(r)}")
         return None, None
+    add_phase_time(
+        r,
+        "parse",
+        time.perf_counter()
+        - start
+        - (sum(r.get("phases", {}).values()) - phases_before),
+    )
 
     if decp_format is None:
         return None, None
 
-    lf: pl.LazyFrame = pl.scan_parquet(output_path.with_suffix(".parquet"))
+    # Statistiques des champs, pour le manifeste du cache et l'artifact des ressources
+    r["field_census"] = census.summary()
 
-    # Ajout des stats de la ressource à l'artifact
-    # https://github.com/ColinMaudry/decp-processing/issues/89
-    if DECP_PROCESSING_PUBLISH:
-        artifact_row = gen_artifact_row(r, lf, url, fields, decp_format)  # noqa
-        resources_artifact.append(artifact_row)
+    return scan_get_parquet(r), decp_format
+
+
+def scan_get_parquet(r: dict) -> pl.LazyFrame:
+    """Parquet de l'étape get d'une ressource, avec les colonnes de sa source."""
+    lf: pl.LazyFrame = pl.scan_parquet(GET_DIR / f"{r['checksum']}.parquet")
 
     # Exemple https://www.data.gouv.fr/datasets/5cd57bf68b4c4179299eb0e9/#/resources/bb90091c-f0cb-4a59-ad41-b0ab929aad93
     resource_web_url = (
@@ -130,7 +205,16 @@ def get_resource(
         lf = lf.rename({"source": "sourceDataset"})
         lf = lf.with_columns(pl.lit(r["dataset_code"]).alias("sourceDataset"))
 
-    return lf, decp_format
+    return lf
+
+
+def make_decp_formats() -> dict[str, DecpFormat]:
+    """Formats DECP par label. Nouvelles instances à chaque appel : le parsing en flux
+    (ijson) stocke son état dans le DecpFormat."""
+    return {
+        "DECP 2019": DecpFormat("DECP 2019", SCHEMA_MARCHE_2019, "marches"),
+        "DECP 2022": DecpFormat("DECP 2022", SCHEMA_MARCHE_2022, "marches.marche"),
+    }
 
 
 def _close_ijson_coro(coro) -> None:
@@ -160,46 +244,119 @@ def find_json_decp_format(chunk, decp_formats, resource: dict):
     return None
 
 
-def json_stream_to_parquet(
-    url: str, output_path: Path, resource: dict
-) -> tuple[set, DecpFormat or None]:
-    logger = get_logger(level=LOG_LEVEL)
+def fix_aws_backslashes(match: bytes) -> bytes:
+    """Correction d'une suite de backslashes du dataset AWS (éventuellement suivie d'une espace),
+    équivalente aux trois remplacements successifs : trois backslashes par un, puis deux
+    backslashes par un, puis backslash + espace par une espace."""
+    space = match.endswith(b" ")
+    n = len(match) - space
+    n = n // 3 + n % 3
+    n = n // 2 + n % 2
+    if space:
+        return b"\\" * (n - 1) + b" "
+    return b"\\" * n
+
+
+def read_whole_document(chunks: Iterator[bytes]) -> tuple[object, Iterable[bytes]]:
+    """Lecture et parsing d'une ressource entière avec orjson.
+
+    Renvoie le document parsé, ou None et les morceaux du flux (déjà lus et restants) pour
+    un parsing en flux si la ressource est plus grosse qu'annoncé ou si orjson échoue."""
+    buffered_chunks = []
+    size = 0
+    for chunk in chunks:
+        buffered_chunks.append(chunk)
+        size += len(chunk)
+        # La taille annoncée par data.gouv.fr peut être fausse (ou absente, 1000 par défaut)
+        if size > 2 * JSON_WHOLE_DOCUMENT_MAX_SIZE:
+            return None, chain(buffered_chunks, chunks)
+    try:
+        return orjson.loads(b"".join(buffered_chunks)), []
+    except orjson.JSONDecodeError:
+        return None, buffered_chunks
 
-    decp_format_2019 = DecpFormat("DECP 2019", SCHEMA_MARCHE_2019, "marches")
-    decp_format_2022 = DecpFormat("DECP 2022", SCHEMA_MARCHE_2022, "marches.marche")
-    decp_formats = [decp_format_2019, decp_format_2022]
 
-    fields = set()
+def find_document_decp_format(
+    document, decp_formats: list[DecpFormat], resource: dict
+) -> tuple[DecpFormat | None, list]:
+    """Équivalent de find_json_decp_format pour un document déjà parsé."""
+    logger = get_logger(level=LOG_LEVEL)
+
     for decp_format in decp_formats:
-        decp_format.liste_marches_ijson = ijson.sendable_list()
-        decp_format.coroutine_ijson = ijson.items_coro(
-            decp_format.liste_marches_ijson,
-            f"{decp_format.prefixe_json_marches}.item",
-            use_float=True,
-        )
+        marches = document
+        for key in decp_format.prefixe_json_marches.split("."):
+            marches = marches.get(key) if isinstance(marches, dict) else None
+        if isinstance(marches, list) and len(marches) > 0:
+            return decp_format, marches
+    logger.warning(
+        f"⚠️  Pas de match trouvé parmis les schémas passés : {full_resource_name(resource)}"
+    )
+    return None, []
 
-    tmp_file = tempfile.NamedTemporaryFile(mode="wb", suffix=".ndjson", delete=False)
 
-    http_stream_iter = stream_get(url)
+def json_stream_to_parquet(
+    url: str, output_path: Path, resource: dict
+) -> tuple[FieldCensus, DecpFormat or None]:
+    """Parsing d'une ressource JSON et écriture des marchés aplatis en parquet.
 
-    stream_replace_iter = stream_replace_bytestring(
-        http_stream_iter, b"\xef\xbb\xbf", b""
-    )  # Strip UTF-8 BOM
+    Le parser est choisi selon la taille de la ressource (resource["filesize"]) :
+    - petites ressources : lecture complète et orjson.loads, bien plus rapide
+    - grosses ressources : parsing en flux avec le backend ijson le plus rapide disponible
+    Le parser utilisé est indiqué dans resource["parser"] (artifact des ressources)."""
+    logger = get_logger(level=LOG_LEVEL)
+
+    decp_formats = list(make_decp_formats().values())
 
-    stream_replace_iter = stream_replace_bytestring(
-        stream_replace_iter, rb"NaN([,\n])", rb"null\1"
-    )  # NaN => null
+    census = FieldCensus()
 
+    rewrite_rules = [
+        ("BOM", b"\xef\xbb\xbf", b""),  # Strip UTF-8 BOM
+        ("NaN", rb"NaN([,\n])", rb"null\1"),  # NaN => null
+    ]
     # Le dataset AWS scraping a pas mal de bugs de backslash
     if "/68caf6b135f19236a4f37a32/" in url or "/aws/" in url:
-        stream_replace_iter = stream_replace_bytestring(
-            stream_replace_bytestring(
-                stream_replace_bytestring(stream_replace_iter, rb"(\\\\\\)", rb"\\"),
-                rb"\\\\",
-                rb"\\",
-            ),
-            rb"\\ ",
-            rb" ",
+        rewrite_rules.append(("backslash", rb"\\(?:\\+ ?| )", fix_aws_backslashes))
+    rewriter = StreamRewriter(rewrite_rules)
+
+    stream_replace_iter = profiled(
+        rewriter.rewrite(
+            profiled(stream_get(url, resource=resource), resource, "download")
+        ),
+        resource,
+        "rewrite",
+        inner="download",
+    )
+
+    if resource["filesize"] <= JSON_WHOLE_DOCUMENT_MAX_SIZE:
+        document, stream_replace_iter = read_whole_document(stream_replace_iter)
+        if document is not None:
+            resource["parser"] = "orjson"
+            decp_format, marches = find_document_decp_format(
+                document, decp_formats, resource
+            )
+            if decp_format is None:
+                return census, None
+
+            with ParquetRowWriter(output_path, decp_format.schema) as writer:
+                for marche in marches:
+                    write_marche_rows(marche, writer, decp_format, census)
+
+            resource["row_number"] = writer.row_count
+            resource["replacements"] = rewriter.counts
+            add_phase_time(resource, "parquet", writer.seconds)
+            return census, decp_format
+
+        logger.debug(f"Parsing en flux de {full_resource_name(resource)}")
+
+    resource["parser"] = f"ijson ({IJSON_BACKEND.backend_name})"
+    stream_replace_iter = iter(stream_replace_iter)
+
+    for decp_format in decp_formats:
+        decp_format.liste_marches_ijson = ijson.sendable_list()
+        decp_format.coroutine_ijson = IJSON_BACKEND.items_coro(
+            decp_format.liste_marches_ijson,
+            f"{decp_format.prefixe_json_marches}.item",
+            use_float=True,
         )
 
     # In first iteration, will find the right format
@@ -207,7 +364,7 @@ def json_stream_to_parquet(
         chunk = next(stream_replace_iter)
     except StopIteration:
         logger.error(f"⚠️  Flux vide pour {url}")
-        return set(), None
+        return census, None
 
     decp_format = find_json_decp_format(chunk, decp_formats, resource)
     if decp_format is None:
@@ -215,7 +372,7 @@ def json_stream_to_parquet(
         # « Exception ignored while closing generator » au moment du GC.
         for fmt in decp_formats:
             _close_ijson_coro(fmt.coroutine_ijson)
-        return set(), None
+        return census, None
 
     # Les formats non-retenus ne seront plus alimentés : on les ferme proprement
     # (flux incomplet → IncompleteJSONError neutralisée).
@@ -223,122 +380,150 @@ def json_stream_to_parquet(
         if fmt is not decp_format:
             _close_ijson_coro(fmt.coroutine_ijson)
 
-    for marche in decp_format.liste_marches_ijson:
-        new_fields = write_marche_rows(marche, tmp_file, decp_format)
-        fields = fields.union(new_fields)
-
-    del decp_format.liste_marches_ijson[:]
-
-    for chunk in stream_replace_iter:
-        decp_format.coroutine_ijson.send(chunk)
+    with ParquetRowWriter(output_path, decp_format.schema) as writer:
         for marche in decp_format.liste_marches_ijson:
-            new_fields = write_marche_rows(marche, tmp_file, decp_format)
-            fields = fields.union(new_fields)
+            write_marche_rows(marche, writer, decp_format, census)
 
         del decp_format.liste_marches_ijson[:]
 
-    decp_format.coroutine_ijson.close()
-    tmp_file.seek(0)
+        for chunk in stream_replace_iter:
+            decp_format.coroutine_ijson.send(chunk)
+            for marche in decp_format.liste_marches_ijson:
+                write_marche_rows(marche, writer, decp_format, census)
 
-    lf = pl.scan_ndjson(tmp_file.name, schema=decp_format.schema)
-    sink_to_files(lf, output_path, file_format="parquet")
+            del decp_format.liste_marches_ijson[:]
 
-    tmp_file.close()
+        decp_format.coroutine_ijson.close()
 
-    return fields, decp_format
+    resource["row_number"] = writer.row_count
+    resource["replacements"] = rewriter.counts
+    add_phase_time(resource, "parquet", writer.seconds)
+    return census, decp_format
 
 
 def xml_stream_to_parquet(
-    url: str, output_path: Path, fix_chars=False
-) -> tuple[set, DecpFormat]:
-    decp_format_2022 = DecpFormat("DECP 2022", SCHEMA_MARCHE_2022, "marches.marche")
-
-    fields = set()
-    parser = etree.XMLPullParser(tag="marche", recover=True)
-    with tempfile.NamedTemporaryFile(
-        mode="wb", suffix=".ndjson", delete=True
-    ) as tmp_file:
-        for chunk in stream_get(url):
-            if fix_chars:
-                chunk = clean_invalid_characters(chunk)
+    url: str, output_path: Path, resource: dict
+) -> tuple[FieldCensus, DecpFormat]:
+    """Parsing en flux d'une ressource XML et écriture des marchés aplatis en parquet.
+
+    Les caractères de contrôle, invalides en XML, sont supprimés du flux d'octets avant
+    le parsing. Chaque <marche> est supprimé de l'arbre une fois traité, la mémoire
+    utilisée ne dépend donc pas de la taille du fichier.
+
+    Une erreur de syntaxe (marché tronqué ou mal formé) fait échouer la ressource
+    (XMLSyntaxError) plutôt que de supprimer ou modifier des marchés sans le signaler."""
+    decp_format_2022 = make_decp_formats()["DECP 2022"]
+
+    census = FieldCensus()
+    rewriter = StreamRewriter(
+        [("control_characters", INVALID_XML_CHARACTERS, b"")], window=0
+    )
+    projection = schema_projection(tuple(decp_format_2022.schema))
+    parser = etree.XMLPullParser(tag="marche")
+    with ParquetRowWriter(output_path, decp_format_2022.schema) as writer:
+        chunks = profiled(stream_get(url, resource=resource), resource, "download")
+        for chunk in profiled(
+            rewriter.rewrite(chunks), resource, "rewrite", inner="download"
+        ):
             parser.feed(chunk)
             for _, elem in parser.read_events():
-                marche = parse_element(elem)
-                new_fields = write_marche_rows(marche, tmp_file, decp_format_2022)
-                fields = fields.union(new_fields)
-        # Vidage du buffer d'écriture sur le disque avant la lecture par son nom :
-        # sans cela, les petits fichiers (< taille du buffer) restent en mémoire et
-        # pl.scan_ndjson lit un fichier vide → 0 ligne (le chemin JSON, lui, fait seek(0)).
-        tmp_file.flush()
-        lf = pl.scan_ndjson(tmp_file.name, schema=decp_format_2022.schema)
-        sink_to_files(lf, output_path, file_format="parquet")
-    return fields, decp_format_2022
+                # Les éléments qui ne mènent à aucune colonne du schéma ne sont pas parsés
+                marche = parse_element(elem, projection.top_level_keys)
+                write_marche_rows(marche, writer, decp_format_2022, census)
+
+                # Suppression du marché et des éléments précédents (texte entre les
+                # marchés, commentaires) déjà traités
+                elem.clear(keep_tail=False)
+                parent = elem.getparent()
+                if parent is not None:
+                    while elem.getprevious() is not None:
+                        del parent[0]
+        parser.close()
+
+    resource["row_number"] = writer.row_count
+    resource["replacements"] = rewriter.counts
+    add_phase_time(resource, "parquet", writer.seconds)
+    return census, decp_format_2022
 
 
 # Générée par la LLM Euria, développée par Infomaniak
-def parse_element(elem):
+def parse_element(elem, keep_tags: frozenset | None = None):
     """
     Parse un élément XML en dictionnaire Python.
     Pour les tags comme <modalitesExecution>, <considerationsSociales>, etc.,
     on conserve la structure : {"modaliteExecution": [...]} au lieu de [...] (format 2022)
-    """
 
-    # Si l'élément n'a ni enfants ni texte → retourne None
-    if len(elem) == 0 and not elem.text:
-        return None
+    Si keep_tags est fourni, seuls les enfants directs portant ces tags sont parsés. Les
+    autres sont remplacés par SKIPPED_ELEMENT (None s'ils sont vides), pour le
+    recensement des champs (FieldCensus).
+    """
 
-    # Si l'élément n'a pas d'enfants → retourne son texte (nettoyé)
+    # Si l'élément n'a pas d'enfants → retourne son texte (nettoyé), ou None s'il est vide
     if len(elem) == 0:
-        return elem.text.strip() if elem.text else ""
+        return elem.text.strip() if elem.text else None
 
     # Collecte les enfants sous forme de listes (même si un seul enfant)
     children = {}
     for child in elem:
-        tag = child.tag
-        if tag not in children:
-            children[tag] = []
-        children[tag].append(parse_element(child))
-
-    # Cas spéciaux : ces éléments doivent toujours être des objets avec une clé liste
-    if elem.tag == "titulaires":
-        # Chaque <titulaire> devient un objet dans une liste
-        return [{"titulaire": item} for item in children.get("titulaire", [])]
-
-    # Pour les tags comme <considerationsSociales>, <modalitesExecution>, etc.
-    # on utilise le premier tag enfant existant
-    elif elem.tag in [
-        "considerationsSociales",
-        "considerationsEnvironnementales",
-        "techniques",
-        "modalitesExecution",
-        "typesPrix",
-    ]:
-        # On récupère le premier tag enfant (s’il existe)
-        if children:
-            # On prend le premier tag enfant comme clé
-            first_child_tag = next(iter(children.keys()))
-            # On retourne un objet avec cette clé → valeur = liste des enfants
-            return {first_child_tag: children[first_child_tag]}
+        if keep_tags is not None and child.tag not in keep_tags:
+            value = SKIPPED_ELEMENT if len(child) or child.text else None
         else:
-            # Si pas d'enfant → retourne un objet vide
-            return {next(iter(children.keys())) if children else "": []}
-
-    # Pour tous les autres éléments : si un seul enfant → valeur simple, sinon liste
-    result = {}
-    for tag, values in children.items():
-        if len(values) == 1:
-            result[tag] = values[0]  # Pas de liste si un seul élément
-        else:
-            result[tag] = values  # Sinon, on garde la liste
+            value = parse_element(child)
+        try:
+            children[child.tag].append(value)
+        except KeyError:
+            children[child.tag] = [value]
+
+    return XML_TAG_PARSERS.get(elem.tag, parse_object)(children)
+
+
+def parse_titulaires(children: dict[str, list]) -> list[dict]:
+    """Chaque <titulaire> devient un objet dans une liste."""
+    return [{"titulaire": item} for item in children.get("titulaire", [])]
+
+
+def parse_first_child_list(children: dict[str, list]) -> dict[str, list]:
+    """Pour les tags comme <considerationsSociales>, <modalitesExecution>, etc. :
+    objet dont la clé est le premier tag enfant et la valeur la liste de ces enfants."""
+    first_child_tag = next(iter(children.keys()))
+    return {first_child_tag: children[first_child_tag]}
+
+
+def parse_object(children: dict[str, list]) -> dict:
+    """Pour tous les autres éléments : si un seul enfant → valeur simple, sinon liste."""
+    return {
+        tag: values[0] if len(values) == 1 else values
+        for tag, values in children.items()
+    }
+
+
+# Valeur des éléments XML non parsés (voir parse_element)
+SKIPPED_ELEMENT = "…"
 
-    return result
+# Éléments dont la structure diffère de parse_object
+XML_TAG_PARSERS = {
+    "titulaires": parse_titulaires,
+    "considerationsSociales": parse_first_child_list,
+    "considerationsEnvironnementales": parse_first_child_list,
+    "techniques": parse_first_child_list,
+    "modalitesExecution": parse_first_child_list,
+    "typesPrix": parse_first_child_list,
+}
 
 
-def write_marche_rows(marche: dict, file, decp_format: DecpFormat) -> set[str]:
-    """Ajout d'une ligne ndjson pour chaque modification/version du marché."""
-    fields = set()
+def write_marche_rows(
+    marche: dict,
+    writer: ParquetRowWriter,
+    decp_format: DecpFormat,
+    census: FieldCensus,
+):
+    """Ajout d'une ligne pour chaque modification/version du marché.
+
+    Tous les champs du marché, y compris ceux qui ne sont pas dans le schéma, sont
+    recensés dans census."""
     if marche:  # marche peut être null (marches-securises.fr)
-        for mod in yield_modifications(marche):
+        projection = schema_projection(tuple(decp_format.schema))
+        for mod in yield_modifications(marche, projection, census):
             if mod is None:
                 continue
             # Pour decp-2019.json : désimbrication des données des titulaires
@@ -349,14 +534,14 @@ def write_marche_rows(marche: dict, file, decp_format: DecpFormat) -> set[str]:
                     liste_titulaires = mod.get(f)
                     if liste_titulaires and isinstance(liste_titulaires[0], list):
                         mod[f] = extract_innermost_struct(liste_titulaires)
-            file.write(orjson.dumps(mod))
-            file.write(b"\n")
-            fields = fields.union(mod.keys())
-    return fields
+            writer.write_row(mod)
 
 
-def yield_modifications(row: dict, separator="_") -> Iterator[dict] | None:
-    """Pour chaque modification, génère un objet/dict marché aplati."""
+def yield_modifications(
+    row: dict, projection: "SchemaProjection", census: FieldCensus
+) -> Iterator[dict] | None:
+    """Pour chaque modification, génère un objet/dict marché aplati, limité aux colonnes
+    de la projection. Tous les champs rencontrés sont recensés dans census."""
     raw_mods = row.pop("modifications", [])
     # Couvre le format 2022:
     if isinstance(raw_mods, dict) and "modification" in raw_mods:
@@ -368,18 +553,120 @@ def yield_modifications(row: dict, separator="_") -> Iterator[dict] | None:
     elif isinstance(raw_mods, str) or raw_mods is None:
         raw_mods = []
 
-    mods = [{}] + raw_mods
-    for i, mod in enumerate(mods):
-        mod["id"] = i
-        if "modification" in mod:
+    # Les champs du marché sont aplatis une seule fois, pas pour chaque modification
+    row.pop("modification", None)
+    present, empty = [], []
+    flat_row = projection.flatten(row, present, empty)
+    census.count_marche(present, empty)
+
+    # Version initiale du marché, sans modification
+    yield flat_row
+
+    for mod in raw_mods:
+        if isinstance(mod, dict) and "modification" in mod:
             mod = mod["modification"]
         titulaires = norm_titulaires(mod)
         if titulaires is not None:
             mod["titulaires"] = titulaires
-        row["modification"] = mod
-        yield pl.convert.normalize._simple_json_normalize(
-            row, separator, 10, lambda x: x
+        flat_mod = dict(flat_row)
+        if isinstance(mod, dict):
+            present, empty = [], []
+            projection.flatten_into(mod, "modification", flat_mod, present, empty)
+            census.count_modification(present, empty)
+        yield flat_mod
+
+
+class SchemaProjection:
+    """
+    Aplatissement d'un marché limité aux colonnes d'un schéma (ex : SCHEMA_MARCHE_2022).
+
+    Les objets imbriqués sont aplatis comme avec pl.json_normalize (noms joints par "_",
+    listes conservées telles quelles), mais seuls les objets qui mènent à une colonne du
+    schéma sont parcourus, et seules les valeurs des colonnes du schéma sont copiées.
+    Pour les autres objets, seuls les noms de leurs champs sont relevés.
+
+    Les noms des champs rencontrés sont ajoutés à la liste present, et à la liste empty
+    si leur valeur est vide : None, "" ou [], mais pas 0 (voir FieldCensus). Les noms
+    aplatis sont construits une seule fois par couple (préfixe, clé) et internés.
+    """
+
+    def __init__(self, columns: tuple[str, ...], separator: str = "_"):
+        self.separator = separator
+        self.columns = frozenset(columns)
+        # Préfixes des colonnes : "lieuExecution" pour "lieuExecution_code", etc.
+        self.prefixes = frozenset(
+            separator.join(parts[:i])
+            for parts in (column.split(separator) for column in columns)
+            for i in range(1, len(parts))
         )
+        # Éléments XML enfants de <marche> à parser (voir parse_element)
+        self.top_level_keys = frozenset(
+            column.split(separator)[0] for column in columns
+        ) | {"modifications"}
+        # {préfixe: {clé: nom aplati}}
+        self._names = {}
+
+    def flatten(self, data: dict, present: list, empty: list) -> dict:
+        flat = {}
+        nested = []
+        # Comme pl.json_normalize : au premier niveau, les valeurs des objets imbriqués
+        # ont la priorité sur les valeurs simples de même nom
+        for key, value in data.items():
+            if isinstance(value, dict):
+                nested.append((key, value))
+            else:
+                present.append(key)
+                if not value and value != 0:
+                    empty.append(key)
+                if key in self.columns:
+                    flat[key] = value
+        for key, value in nested:
+            self.flatten_into(value, key, flat, present, empty)
+        return flat
+
+    def flatten_into(
+        self, data: dict, prefix: str, flat: dict, present: list, empty: list
+    ):
+        if prefix not in self.prefixes:
+            self._add_field_names(data, prefix, present, empty)
+            return
+        names = self._prefix_names(prefix)
+        for key, value in data.items():
+            name = names.get(key) or self._name(names, prefix, key)
+            if isinstance(value, dict):
+                self.flatten_into(value, name, flat, present, empty)
+            else:
+                present.append(name)
+                if not value and value != 0:
+                    empty.append(name)
+                if name in self.columns:
+                    flat[name] = value
+
+    def _add_field_names(self, data: dict, prefix: str, present: list, empty: list):
+        names = self._prefix_names(prefix)
+        for key, value in data.items():
+            name = names.get(key) or self._name(names, prefix, key)
+            if isinstance(value, dict):
+                self._add_field_names(value, name, present, empty)
+            else:
+                present.append(name)
+                if not value and value != 0:
+                    empty.append(name)
+
+    def _prefix_names(self, prefix: str) -> dict:
+        names = self._names.get(prefix)
+        if names is None:
+            names = self._names[prefix] = {}
+        return names
+
+    def _name(self, names: dict, prefix: str, key: str) -> str:
+        name = names[key] = sys.intern(f"{prefix}{self.separator}{key}")
+        return name
+
+
+@cache
+def schema_projection(columns: tuple[str, ...]) -> SchemaProjection:
+    return SchemaProjection(columns)
 
 
 def norm_titulaires(titulaires):
@@ -446,38 +733,291 @@ def get_insee_cog_data(url, schema_overrides, columns) -> pl.DataFrame:
     return df_insee
 
 
+def cache_status(resource: dict, available_parquet_files: set) -> tuple[bool, bool]:
+    """Présence du parquet de la ressource en cache, et nécessité de revalider ce cache.
+
+    Sans checksum data.gouv.fr (identifiant de la ressource à la place), le cache est
+    validé par une requête conditionnelle (voir src/tasks/revalidation.py)."""
+    in_cache = (
+        DECP_USE_CACHE and f"{resource['checksum']}.parquet" in available_parquet_files
+    )
+    return in_cache, in_cache and hash_algorithm(resource["checksum"]) is None
+
+
+@dataclass
+class PendingCleaning:
+    """Ressource dont le nettoyage est fait en lot avec d'autres (DECP_BATCH_CLEANING),
+    une fois toutes les ressources récupérées (voir clean_batch)."""
+
+    resource: dict
+    decp_format: str
+    # Entrée du manifeste d'une ressource en cache nettoyée par une autre version du code
+    previous_entry: dict | None = None
+
+
+def batch_cleaning(resource: dict) -> bool:
+    return DECP_BATCH_CLEANING and resource["filesize"] <= BATCH_CLEANING_MAX_FILESIZE
+
+
 def get_clean(
     resource, resources_artifact: list, available_parquet_files: set
-) -> pl.DataFrame | None:
+) -> Path | PendingCleaning | None:
     logger = get_logger(level=LOG_LEVEL)
 
     logger.debug(f"get_clean {resource['ori_filename']}")
     with transaction():
         checksum = resource["checksum"]
         parquet_path = RESOURCE_CACHE_DIR / f"{checksum}"
+        in_cache, resource["revalidate"] = cache_status(
+            resource, available_parquet_files
+        )
 
-        # Si la ressource n'est pas en cache ou que l'utilisation du cache est désactivée
-        if (
-            DECP_USE_CACHE is False
-            or f"{checksum}.parquet" not in available_parquet_files
-        ):
+        # Si la ressource n'est pas en cache, que l'utilisation du cache est désactivée
+        # ou que le cache doit être revalidé
+        if not in_cache or resource["revalidate"]:
             # Récupération des données source...
-            lf, decp_format = get_resource(resource, resources_artifact)
+            try:
+                lf, decp_format = get_resource(resource)
+            except ResourceNotModified:
+                logger.debug(
+                    f"👍 Ressource non modifiée depuis sa mise en cache : {resource['dataset_code']}"
+                )
+                return use_cached_parquet(resource, resources_artifact, parquet_path)
 
             # Nettoyage des données source et typage des colonnes...
             # si la ressource est dans un format supporté
             if lf is not None and not Path(parquet_path).exists():
+                if batch_cleaning(resource):
+                    return PendingCleaning(resource, decp_format.label)
+                start = time.perf_counter()
                 lf: pl.LazyFrame = clean_decp(lf, decp_format)
                 sink_to_files(
                     lf, parquet_path, file_format="parquet", compression="zstd"
                 )
-                return parquet_path.with_suffix(".parquet")
+                add_phase_time(resource, "clean", time.perf_counter() - start)
+                record_profile(resource, sum(resource["phases"].values()))
+                return record_cleaned_resource(
+                    resource, parquet_path, decp_format.label, resources_artifact
+                )
             else:
                 return None
         else:
             # Le fichier parquet est déjà disponible pour ce checksum
             logger.debug(f"👍 Ressource déjà en cache : {resource['dataset_code']}")
-            return parquet_path.with_suffix(".parquet")
+            return use_cached_parquet(resource, resources_artifact, parquet_path)
+
+
+def use_cached_parquet(
+    resource: dict, resources_artifact: list, parquet_path: Path
+) -> Path | PendingCleaning:
+    """Réutilisation du parquet en cache d'une ressource.
+
+    Si le parquet a été produit par une autre version du nettoyage (cleaning_fingerprint),
+    le nettoyage est refait à partir du parquet de l'étape get, sans téléchargement."""
+    logger = get_logger(level=LOG_LEVEL)
+
+    entry = get_entry(resource["checksum"])
+    fingerprint = cleaning_fingerprint()
+    if entry is not None and entry["cleaning_fingerprint"] != fingerprint:
+        logger.debug(
+            f"🔁 Nouveau nettoyage de la ressource en cache : {resource['dataset_code']}"
+        )
+        if batch_cleaning(resource):
+            return PendingCleaning(resource, entry["decp_format"], previous_entry=entry)
+        decp_format = make_decp_formats()[entry["decp_format"]]
+        lf: pl.LazyFrame = clean_decp(scan_get_parquet(resource), decp_format)
+        sink_to_files(lf, parquet_path, file_format="parquet", compression="zstd")
+        return record_cleaned_resource(
+            resource,
+            parquet_path,
+            decp_format.label,
+            resources_artifact,
+            previous_entry=entry,
+        )
+    add_artifact_row(resource, resources_artifact, entry)
+    return parquet_path.with_suffix(".parquet")
+
+
+def record_cleaned_resource(
+    resource: dict,
+    parquet_path: Path,
+    decp_format_label: str,
+    resources_artifact: list,
+    previous_entry: dict | None = None,
+) -> Path:
+    """Enregistrement d'une ressource nettoyée dans le manifeste du cache et l'artifact."""
+    if "dates" not in resource:
+        record_date_parsing([resource], scan_get_parquet(resource))
+    entry = record_resource(
+        resource,
+        parquet_path.with_suffix(".parquet"),
+        decp_format_label,
+        cleaning_fingerprint(),
+        previous_entry=previous_entry,
+    )
+    if "http_validators" in resource:
+        save_validators(resource["url"], resource["http_validators"])
+    add_artifact_row(resource, resources_artifact, entry)
+    return parquet_path.with_suffix(".parquet")
+
+
+def record_date_parsing(resources: list[dict], lf: pl.LazyFrame):
+    """Nombre de dates reconnues et rejetées par le nettoyage (resource["dates"], artifact
+    des ressources), compté sur les lignes de l'étape get.
+
+    lf : lignes d'une ressource, ou de plusieurs ressources identifiées par
+    RESOURCE_KEY_COLUMN (voir clean_batch)."""
+    logger = get_logger(level=LOG_LEVEL)
+
+    columns = [col for col in DATE_COLUMNS if col in lf.collect_schema().names()]
+    if not columns:
+        counts = {}
+    elif len(resources) == 1:
+        row = date_parsing_counts(lf, columns).collect().row(0, named=True)
+        counts = {resources[0]["checksum"]: row}
+    else:
+        df = date_parsing_counts(lf, columns, by=[RESOURCE_KEY_COLUMN]).collect()
+        counts = {row.pop(RESOURCE_KEY_COLUMN): row for row in df.iter_rows(named=True)}
+    for resource in resources:
+        resource["dates"] = counts.get(
+            resource["checksum"], {"parsed": 0, "rejected": 0}
+        )
+        if resource["dates"]["rejected"]:
+            logger.debug(
+                f"📅 {resource['dates']['rejected']} dates rejetées sur "
+                f"{sum(resource['dates'].values())} : {full_resource_name(resource)}"
+            )
+
+
+def cleaning_batches(pending: list[PendingCleaning]) -> list[list[PendingCleaning]]:
+    """Lots de BATCH_CLEANING_SIZE ressources au plus, de même format et de même schéma
+    d'entrée (un seul plan de nettoyage par lot, voir clean_decp)."""
+    groups = defaultdict(list)
+    for p in pending:
+        schema = scan_get_parquet(p.resource).collect_schema()
+        groups[(p.decp_format, tuple(schema.items()))].append(p)
+    return [
+        group[i : i + BATCH_CLEANING_SIZE]
+        for group in groups.values()
+        for i in range(0, len(group), BATCH_CLEANING_SIZE)
+    ]
+
+
+def clean_batch(batch: list[PendingCleaning], resources_artifact: list) -> list[Path]:
+    """Nettoyage d'un lot de ressources en une seule requête, puis écriture du parquet en
+    cache de chaque ressource.
+
+    Les lignes de chaque ressource sont identifiées par RESOURCE_KEY_COLUMN, ce qui permet
+    d'appliquer les modifications ressource par ressource comme lors d'un nettoyage
+    séparé. Si le lot échoue, ses ressources sont nettoyées une par une pour que l'erreur
+    d'une ressource n'empêche pas le traitement des autres."""
+    logger = get_logger(level=LOG_LEVEL)
+
+    decp_format = make_decp_formats()[batch[0].decp_format]
+    start = time.perf_counter()
+    try:
+        lf = pl.concat(
+            [
+                scan_get_parquet(p.resource).with_columns(
+                    pl.lit(p.resource["checksum"]).alias(RESOURCE_KEY_COLUMN)
+                )
+                for p in batch
+            ]
+        )
+        df: pl.DataFrame = clean_decp(lf, decp_format).collect()
+        record_date_parsing([p.resource for p in batch], lf)
+    except Exception as e:
+        if len(batch) == 1:
+            raise
+        logger.warning(
+            f"⚠️  Échec du nettoyage d'un lot de {len(batch)} ressources "
+            f"({type(e).__name__}), nettoyage ressource par ressource"
+        )
+        parquet_files = []
+        for pending in batch:
+            try:
+                parquet_files.extend(clean_batch([pending], resources_artifact))
+            except Exception as e:
+                logger.error(
+                    f"❌ Erreur de traitement de {full_resource_name(pending.resource)} "
+                    f"({type(e).__name__}):"
+                )
+                logger.info(e)
+        return parquet_files
+
+    partitions = df.partition_by(RESOURCE_KEY_COLUMN, as_dict=True, include_key=False)
+    # Ressource dont toutes les lignes ont été supprimées par le nettoyage
+    empty = df.drop(RESOURCE_KEY_COLUMN).clear()
+    del df
+    for pending in batch:
+        sink_to_files(
+            partitions.get((pending.resource["checksum"],), empty).lazy(),
+            RESOURCE_CACHE_DIR / pending.resource["checksum"],
+            file_format="parquet",
+            compression="zstd",
+        )
+
+    # Durée du lot répartie entre ses ressources selon leur nombre de lignes
+    elapsed = time.perf_counter() - start
+    total_rows = sum(len(partition) for partition in partitions.values()) or 1
+    parquet_files = []
+    for pending in batch:
+        resource = pending.resource
+        rows = len(partitions.get((resource["checksum"],), empty))
+        if pending.previous_entry is None:
+            add_phase_time(resource, "clean", elapsed * rows / total_rows)
+            record_profile(resource, sum(resource["phases"].values()))
+        parquet_files.append(
+            record_cleaned_resource(
+                resource,
+                RESOURCE_CACHE_DIR / resource["checksum"],
+                decp_format.label,
+                resources_artifact,
+                previous_entry=pending.previous_entry,
+            )
+        )
+    return parquet_files
+
+
+def add_artifact_row(resource: dict, resources_artifact: list, entry: dict | None):
+    """Ajout des stats de la ressource à l'artifact, à partir du manifeste du cache.
+    https://github.com/ColinMaudry/decp-processing/issues/89"""
+    if DECP_PROCESSING_PUBLISH and entry is not None:
+        resources_artifact.append(gen_artifact_row(resource, entry))
+
+
+# Liste des fichiers en cache, transmise une seule fois à chaque processus (mode "process")
+# plutôt qu'à chaque ressource soumise
+_worker_available_parquet_files: set = set()
+
+
+def init_get_clean_worker(available_parquet_files: set):
+    """Initialisation d'un processus du pool (RESOURCE_EXECUTOR = "process")."""
+    global _worker_available_parquet_files
+    _worker_available_parquet_files = available_parquet_files
+
+
+def get_clean_in_worker(
+    resource: dict,
+) -> tuple[Path | PendingCleaning | None, list[dict]]:
+    """Exécute get_clean dans un processus du pool.
+
+    Les processus ne partagent pas la mémoire : la ligne d'artifact de la ressource est
+    renvoyée avec le chemin du parquet en cache au lieu d'être ajoutée à une liste partagée."""
+    resources_artifact = []
+    parquet_path = get_clean(
+        resource, resources_artifact, _worker_available_parquet_files
+    )
+    return parquet_path, resources_artifact
+
+
+def clean_batch_in_worker(
+    batch: list[PendingCleaning],
+) -> tuple[list[Path], list[dict]]:
+    """Exécute clean_batch dans un processus du pool (voir get_clean_in_worker)."""
+    resources_artifact = []
+    parquet_files = clean_batch(batch, resources_artifact)
+    return parquet_files, resources_artifact
 
 
 def bootstrap_siret_latlong() -> pl.LazyFrame:
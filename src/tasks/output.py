@@ -1,11 +1,16 @@
 import json
 import sqlite3
+import time
 from collections import ChainMap
+from collections.abc import Callable
+from decimal import Decimal
 from itertools import groupby
 from operator import itemgetter
 from pathlib import Path
 
 import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
 from polars import selectors as cs
 from prefect import task
 
@@ -54,6 +59,171 @@ def sink_to_files(
     del lf
 
 
+class ParquetRowWriter:
+    """
+    Écriture de lignes (dicts de marchés aplatis) directement dans un fichier parquet.
+
+    Les lignes sont accumulées en mémoire puis converties en colonnes Arrow selon le schéma
+    (DecpFormat.schema) et écrites par row groups de `row_group_size` lignes. Cela évite
+    l'aller-retour par un fichier NDJSON temporaire (orjson.dumps puis pl.scan_ndjson).
+
+    Comme pl.scan_ndjson(schema=...) :
+    - les champs absents du schéma sont ignorés
+    - les champs du schéma absents de la ligne sont null
+    - les nombres et booléens sont convertis en texte dans les colonnes String
+
+    Les valeurs d'une structure inattendue (texte à la place d'une liste ou d'un objet) sont
+    remplacées par null au lieu de faire échouer toute la ressource.
+
+    Usage :
+
+        with ParquetRowWriter(path, decp_format.schema) as writer:
+            writer.write_row(row)
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        schema: dict,
+        row_group_size: int = 50_000,
+        compression: str = "zstd",
+    ):
+        self.path = Path(path).with_suffix(".parquet")
+        self.tmp_path = self.path.with_suffix(".parquet.tmp")
+        self.row_group_size = row_group_size
+        self.row_count = 0
+        # Temps de conversion et d'écriture (voir src/tasks/profiling.py)
+        self.seconds = 0.0
+        self.columns = list(schema.keys())
+        self.arrow_schema = pl.DataFrame(schema=schema).to_arrow().schema
+        self.converters = {
+            name: _arrow_value_converter(dtype) for name, dtype in schema.items()
+        }
+        # pyarrow accepterait une chaîne de caractères comme une séquence de caractères,
+        # donc on ne tente la conversion directe que si les listes sont bien des listes,
+        # et jamais si une liste est imbriquée plus profondément.
+        self.list_columns = {
+            name for name, dtype in schema.items() if isinstance(dtype, pl.List)
+        }
+        self.always_convert_columns = {
+            name
+            for name, dtype in schema.items()
+            if _contains_list(dtype.inner if isinstance(dtype, pl.List) else dtype)
+        }
+        self._rows = []
+        self._writer = pq.ParquetWriter(
+            self.tmp_path, self.arrow_schema, compression=compression
+        )
+
+    def write_row(self, row: dict):
+        self._rows.append(row)
+        if len(self._rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        start = time.perf_counter()
+        arrays = []
+        for name, field in zip(self.columns, self.arrow_schema):
+            values = [row.get(name) for row in self._rows]
+            arrays.append(self._to_arrow(name, values, field.type))
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.arrow_schema)
+        self._writer.write_batch(batch, row_group_size=self.row_group_size)
+        self.row_count += len(self._rows)
+        self._rows = []
+        self.seconds += time.perf_counter() - start
+
+    def _to_arrow(self, name: str, values: list, arrow_type: pa.DataType) -> pa.Array:
+        if name not in self.always_convert_columns and (
+            name not in self.list_columns
+            or all(value is None or type(value) is list for value in values)
+        ):
+            try:
+                # Cas le plus courant : les valeurs ont déjà le bon type
+                return pa.array(values, type=arrow_type)
+            except (pa.ArrowTypeError, pa.ArrowInvalid):
+                pass
+        converter = self.converters[name]
+        return pa.array([converter(value) for value in values], type=arrow_type)
+
+    def close(self):
+        self.flush()
+        start = time.perf_counter()
+        self._writer.close()
+        self.seconds += time.perf_counter() - start
+        self.tmp_path.rename(self.path)
+
+    def abort(self):
+        self._writer.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def _arrow_value_converter(dtype: pl.DataType) -> Callable:
+    """Fonction de conversion d'une valeur JSON vers le type polars attendu."""
+    if isinstance(dtype, pl.List):
+        convert_item = _arrow_value_converter(dtype.inner)
+
+        def convert_list(value):
+            if isinstance(value, list):
+                return [convert_item(item) for item in value]
+            return None
+
+        return convert_list
+
+    if isinstance(dtype, pl.Struct):
+        fields = [
+            (field.name, _arrow_value_converter(field.dtype)) for field in dtype.fields
+        ]
+
+        def convert_struct(value):
+            if isinstance(value, dict):
+                return {name: convert(value.get(name)) for name, convert in fields}
+            return None
+
+        return convert_struct
+
+    if dtype == pl.String:
+        return _to_string
+
+    return lambda value: value
+
+
+def _contains_list(dtype: pl.DataType) -> bool:
+    if isinstance(dtype, pl.List):
+        return True
+    if isinstance(dtype, pl.Struct):
+        return any(_contains_list(field.dtype) for field in dtype.fields)
+    return False
+
+
+def _to_string(value) -> str | None:
+    """Conversion en texte identique à celle de pl.scan_ndjson pour une colonne String."""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float):
+        # Pas de notation scientifique ni de ".0" final (137614.0 => "137614")
+        text = repr(value)
+        if "e" in text:
+            text = format(Decimal(text), "f")
+            return text.rstrip("0").rstrip(".") if "." in text else text
+        return text.removesuffix(".0")
+    if isinstance(value, int):
+        return str(value)
+    return json.dumps(value, ensure_ascii=False)
+
+
 def save_to_postgres(df: pl.DataFrame, table_name: str):
     df.write_database(
         table_name=table_name,
@@ -143,14 +313,18 @@ def generate_final_schema(lf):
         "Int16": "integer",
         "Boolean": "boolean",
         "Date": "date",
+        # Colonnes à faible cardinalité (voir SCHEMA_LOW_CARDINALITY)
+        "Categorical": "string",
+        "Enum": "string",
     }
 
     # conversion en dict sérialisable en JSON
     for col in schema.keys():
-        polars_type = schema[col].__str__()
-        frictonless_schema.append(
-            {"name": col, "type": polars_frictionless_mapping[polars_type]}
-        )
+        polars_type = schema[col].base_type().__name__
+        field = {"name": col, "type": polars_frictionless_mapping[polars_type]}
+        if isinstance(schema[col], pl.Enum):
+            field["constraints"] = {"enum": schema[col].categories.to_list()}
+        frictonless_schema.append(field)
 
     # récupération du schéma de base
     with open(REFERENCE_DIR / "schema_base.json", "r", encoding="utf-8") as file:
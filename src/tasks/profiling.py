@@ -0,0 +1,142 @@
+"""
+Coût du traitement de chaque ressource, par phase.
+
+Les durées (secondes) sont ajoutées dans resource["phases"] au fil du traitement :
+- download : téléchargement (src/tasks/download.py) ou lecture du fichier téléchargé
+- rewrite : réécriture des octets (StreamRewriter : BOM, NaN, backslashes AWS,
+  caractères de contrôle XML)
+- parse : parsing et aplatissement des marchés (orjson, ijson ou lxml)
+- parquet : conversion des lignes en colonnes Arrow et écriture du parquet de l'étape get
+- clean : nettoyage (clean_decp) et écriture du parquet en cache
+
+Elles sont enregistrées à chaque exécution dans RESOURCE_PROFILES_DB_PATH, ce qui permet
+de classer les ressources les plus coûteuses avec l'évolution de leur coût (profile_report).
+"""
+
+import sqlite3
+import time
+from collections.abc import Iterable, Iterator
+from datetime import datetime
+
+from src.config import DATE_NOW, RESOURCE_PROFILES_DB_PATH
+
+PHASES = ["download", "rewrite", "parse", "parquet", "clean"]
+
+# Nombre d'exécutions précédentes pour le calcul de l'évolution du coût
+TREND_RUNS = 7
+
+
+def add_phase_time(resource: dict, phase: str, seconds: float):
+    phases = resource.setdefault("phases", {})
+    phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+def profiled(
+    chunks: Iterable, resource: dict, phase: str, inner: str | None = None
+) -> Iterator:
+    """Temps passé à produire les éléments d'un itérateur, ajouté à la phase.
+
+    inner : phase d'un itérateur enveloppé, dont le temps n'est pas compté deux fois
+    (la réécriture des octets lit le flux téléchargé)."""
+    phases = resource.setdefault("phases", {})
+    chunks = iter(chunks)
+    while True:
+        inner_before = phases.get(inner, 0.0)
+        start = time.perf_counter()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        finally:
+            elapsed = time.perf_counter() - start
+            elapsed -= phases.get(inner, 0.0) - inner_before
+            add_phase_time(resource, phase, elapsed)
+        yield chunk
+
+
+def connect() -> sqlite3.Connection:
+    # Plusieurs threads ou processus peuvent écrire en même temps
+    connection = sqlite3.connect(RESOURCE_PROFILES_DB_PATH, timeout=30)
+    connection.execute(
+        f"""CREATE TABLE IF NOT EXISTS profiles (
+            run_date TEXT,
+            resource_id TEXT,
+            dataset_code TEXT,
+            ori_filename TEXT,
+            filesize INTEGER,
+            parser TEXT,
+            {", ".join(f"{phase}_s REAL" for phase in PHASES)},
+            total_s REAL,
+            recorded_at TEXT,
+            PRIMARY KEY (run_date, resource_id)
+        )"""
+    )
+    return connection
+
+
+def record_profile(resource: dict, total_seconds: float):
+    """Enregistrement du coût d'une ressource traitée (une ligne par ressource et par jour)."""
+    phases = resource.get("phases", {})
+    connection = connect()
+    try:
+        with connection:
+            connection.execute(
+                f"INSERT OR REPLACE INTO profiles VALUES ({', '.join('?' * (len(PHASES) + 8))})",
+                (
+                    DATE_NOW,
+                    resource["id"],
+                    resource["dataset_code"],
+                    resource["ori_filename"],
+                    resource["filesize"],
+                    resource.get("parser"),
+                    *(round(phases.get(phase, 0.0), 3) for phase in PHASES),
+                    round(total_seconds, 3),
+                    datetime.now().isoformat(),
+                ),
+            )
+    finally:
+        connection.close()
+
+
+def profile_report(top_n: int, run_date: str = DATE_NOW) -> list[dict]:
+    """Les top_n ressources les plus coûteuses traitées le run_date, avec le coût moyen
+    de leurs TREND_RUNS traitements précédents."""
+    connection = connect()
+    try:
+        rows = connection.execute(
+            f"""
+            WITH ranked AS (
+                SELECT *, ROW_NUMBER() OVER (
+                    PARTITION BY resource_id ORDER BY run_date DESC
+                ) AS run_rank
+                FROM profiles
+                WHERE run_date <= ?
+            ),
+            previous AS (
+                SELECT resource_id, AVG(total_s) AS previous_total_s
+                FROM ranked
+                WHERE run_rank BETWEEN 2 AND {TREND_RUNS + 1}
+                GROUP BY resource_id
+            )
+            SELECT dataset_code, ori_filename, resource_id, filesize, parser,
+                {", ".join(f"{phase}_s" for phase in PHASES)},
+                total_s, previous_total_s
+            FROM ranked LEFT JOIN previous USING (resource_id)
+            WHERE run_rank = 1 AND run_date = ?
+            ORDER BY total_s DESC
+            LIMIT ?
+            """,
+            (run_date, run_date, top_n),
+        )
+        columns = [description[0] for description in rows.description]
+        report = [dict(zip(columns, row)) for row in rows.fetchall()]
+    finally:
+        connection.close()
+
+    for row in report:
+        previous = row.pop("previous_total_s")
+        row["evolution"] = (
+            f"{row['total_s'] / previous - 1:+.0%}" if previous else "nouveau"
+        )
+        row["filesize_mb"] = round(row.pop("filesize") / 1024**2, 1)
+    return report
@@ -0,0 +1,134 @@
+"""
+Stockage local des ressources téléchargées (octets bruts, compressés en zstd).
+
+Les fichiers sont identifiés par le checksum fourni par data.gouv.fr : si le checksum
+ne change pas, le contenu non plus, et un nouveau traitement de la ressource (après une
+modification du nettoyage par exemple) ne nécessite pas de la télécharger à nouveau.
+
+Le contenu téléchargé est vérifié avec ce checksum avant d'être stocké. La taille totale
+du stockage est limitée à RAW_STORE_MAX_SIZE_MB : à la fin du traitement des ressources
+(evict_raw_store), les fichiers les moins récemment utilisés sont supprimés en premier.
+
+Le stockage est désactivé par défaut (RAW_STORE_MAX_SIZE_MB=0) : les ressources sont alors
+téléchargées à nouveau à chaque traitement.
+"""
+
+import hashlib
+import os
+import re
+import uuid
+from collections.abc import Iterator
+from functools import partial
+from pathlib import Path
+
+import zstandard
+
+from src.config import LOG_LEVEL, RAW_STORE_DIR, RAW_STORE_MAX_SIZE_MB
+from src.tasks.utils import get_logger
+
+# Algorithme de hachage selon la longueur du checksum (hexadécimal)
+HASH_ALGORITHMS = {32: "md5", 40: "sha1", 64: "sha256", 128: "sha512"}
+
+
+def hash_algorithm(checksum: str | None) -> str | None:
+    """Algorithme correspondant au checksum, None si le checksum n'est pas un hash
+    (par exemple l'identifiant de la ressource, utilisé à défaut par list_resources)."""
+    if checksum and re.fullmatch(r"[0-9a-fA-F]+", checksum):
+        return HASH_ALGORITHMS.get(len(checksum))
+    return None
+
+
+def raw_store_path(checksum: str) -> Path:
+    checksum = checksum.lower()
+    return RAW_STORE_DIR / checksum[:2] / f"{checksum}.zst"
+
+
+def is_stored(checksum: str | None) -> bool:
+    return (
+        RAW_STORE_MAX_SIZE_MB > 0
+        and hash_algorithm(checksum) is not None
+        and raw_store_path(checksum).exists()
+    )
+
+
+def read_raw(checksum: str | None, chunk_size: int) -> Iterator[bytes] | None:
+    """Lecture d'une ressource stockée, None si elle ne l'est pas."""
+    if RAW_STORE_MAX_SIZE_MB <= 0 or hash_algorithm(checksum) is None:
+        return None
+
+    path = raw_store_path(checksum)
+    try:
+        # Date de dernière utilisation, pour la suppression des fichiers les plus anciens
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+
+    return _read_blob(path, chunk_size)
+
+
+def _read_blob(path: Path, chunk_size: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        reader = zstandard.ZstdDecompressor().stream_reader(f)
+        yield from iter(partial(reader.read, chunk_size), b"")
+
+
+def store_raw(chunks: Iterator[bytes], checksum: str | None) -> Iterator[bytes]:
+    """Transmet les chunks téléchargés en les écrivant dans le stockage.
+
+    Le fichier n'est conservé que si le flux a été lu en entier et que son hash
+    correspond au checksum."""
+    algorithm = hash_algorithm(checksum)
+    if RAW_STORE_MAX_SIZE_MB <= 0 or algorithm is None:
+        yield from chunks
+        return
+
+    logger = get_logger(level=LOG_LEVEL)
+    path = raw_store_path(checksum)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    hasher = hashlib.new(algorithm)
+
+    try:
+        with open(tmp_path, "wb") as f:
+            with zstandard.ZstdCompressor().stream_writer(f) as writer:
+                for chunk in chunks:
+                    hasher.update(chunk)
+                    writer.write(chunk)
+                    yield chunk
+
+        if hasher.hexdigest() == checksum.lower():
+            tmp_path.replace(path)
+        else:
+            logger.warning(
+                f"Le contenu téléchargé ne correspond pas au checksum {checksum}, il n'est pas stocké"
+            )
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def evict_raw_store():
+    """Suppression des fichiers les moins récemment utilisés au-delà de la taille maximale.
+
+    Appelée une fois à la fin du traitement des ressources, et non après chaque écriture :
+    le stockage peut donc dépasser sa taille maximale pendant une exécution."""
+    if RAW_STORE_MAX_SIZE_MB <= 0:
+        return
+    logger = get_logger(level=LOG_LEVEL)
+
+    blobs = []
+    for path in RAW_STORE_DIR.glob("*/*.zst"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        blobs.append((stat.st_mtime, stat.st_size, path))
+
+    total_size = sum(size for _, size, _ in blobs)
+    max_size = RAW_STORE_MAX_SIZE_MB * 1024**2
+
+    for _, size, path in sorted(blobs):
+        if total_size <= max_size:
+            break
+        path.unlink(missing_ok=True)
+        total_size -= size
+        logger.debug(f"Ressource brute supprimée du stockage : {path.name}")
@@ -0,0 +1,108 @@
+"""
+Revalidation HTTP des ressources sans checksum data.gouv.fr.
+
+Pour ces ressources, list_resources utilise l'identifiant de la ressource comme checksum :
+le parquet en cache ne serait jamais invalidé. Les en-têtes ETag, Last-Modified et
+Content-Length de la dernière réponse sont donc conservés par URL, et la ressource est
+demandée avec une requête conditionnelle. Si elle n'a pas changé (réponse 304), le parquet
+en cache est réutilisé sans téléchargement.
+"""
+
+import sqlite3
+from datetime import datetime
+
+import httpx
+
+from src.config import REVALIDATION_DB_PATH
+
+
+class ResourceNotModified(Exception):
+    """La ressource n'a pas changé depuis la dernière récupération."""
+
+
+def connect() -> sqlite3.Connection:
+    # Plusieurs threads ou processus peuvent écrire en même temps
+    connection = sqlite3.connect(REVALIDATION_DB_PATH, timeout=30)
+    connection.execute(
+        """CREATE TABLE IF NOT EXISTS validators (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            content_length INTEGER,
+            checked_at TEXT
+        )"""
+    )
+    return connection
+
+
+def get_validators(url: str) -> dict | None:
+    connection = connect()
+    try:
+        row = connection.execute(
+            "SELECT etag, last_modified, content_length FROM validators WHERE url = ?",
+            (url,),
+        ).fetchone()
+    finally:
+        connection.close()
+    if row is None:
+        return None
+    return {"etag": row[0], "last_modified": row[1], "content_length": row[2]}
+
+
+def save_validators(url: str, validators: dict):
+    """Enregistrement des validateurs, une fois la ressource traitée avec succès."""
+    connection = connect()
+    try:
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?, ?)",
+                (
+                    url,
+                    validators["etag"],
+                    validators["last_modified"],
+                    validators["content_length"],
+                    datetime.now().isoformat(),
+                ),
+            )
+    finally:
+        connection.close()
+
+
+def conditional_headers(validators: dict | None) -> dict:
+    headers = {}
+    if validators:
+        if validators["etag"]:
+            headers["If-None-Match"] = validators["etag"]
+        if validators["last_modified"]:
+            headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+def response_validators(response: httpx.Response) -> dict:
+    content_length = response.headers.get("Content-Length")
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "content_length": int(content_length) if content_length else None,
+    }
+
+
+def is_not_modified(response: httpx.Response, validators: dict | None) -> bool:
+    """Réponse 304, ou réponse 200 d'un serveur qui ignore les en-têtes conditionnels
+    mais renvoie les mêmes validateurs."""
+    if response.status_code == 304:
+        return True
+    if not validators:
+        return False
+
+    new_validators = response_validators(response)
+    if validators["etag"] and new_validators["etag"]:
+        return new_validators["etag"] == validators["etag"]
+    # Sans ETag, la date de modification seule ne suffit pas (précision à la seconde) :
+    # la taille doit aussi être identique
+    return (
+        validators["last_modified"] is not None
+        and validators["content_length"] is not None
+        and new_validators["last_modified"] == validators["last_modified"]
+        and new_validators["content_length"] == validators["content_length"]
+    )
@@ -0,0 +1,298 @@
+"""
+Ordonnancement continu du traitement des ressources (get_clean), sans lots.
+
+Les ressources prêtes sont traitées des plus grosses aux plus petites (filesize) : les plus
+longues commencent en premier, les petites occupent les workers libres jusqu'à la fin.
+Dès qu'un worker se libère, il reçoit la plus grosse ressource prête qui tient dans le
+budget mémoire (RESOURCE_MEMORY_BUDGET_MB, voir MemoryGovernor). Une ressource plus
+grosse que le budget est traitée seule. Sans budget (0), seul le nombre de workers limite
+les traitements simultanés. Une ressource qui ne tient pas dans le budget ne peut être
+dépassée que par MAX_OVERTAKES ressources plus petites : la mémoire libérée lui est ensuite
+réservée.
+
+L'utilisation des workers (temps de traitement cumulé / temps disponible) est calculée
+pour chaque exécution.
+"""
+
+import bisect
+import math
+import os
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future
+from functools import partial
+from itertools import count
+
+from src.config import (
+    JSON_WHOLE_DOCUMENT_MAX_SIZE,
+    LOG_LEVEL,
+    MAX_PREFECT_WORKERS,
+    RESOURCE_MEMORY_BUDGET_MB,
+)
+from src.tasks.utils import get_logger
+
+# Estimations grossières de la mémoire nécessaire, en multiple de la taille de la ressource :
+# document entier parsé par orjson, ou parsing en flux (nettoyage polars du parquet)
+WHOLE_DOCUMENT_MEMORY_FACTOR = 10
+STREAMING_MEMORY_FACTOR = 3
+MIN_RESOURCE_MEMORY = 20 * 1024**2
+
+# Nombre de ressources plus petites qui peuvent passer devant la plus grosse ressource prête
+# quand elle ne tient pas dans le budget
+MAX_OVERTAKES = 20
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def estimate_memory(resource: dict) -> int:
+    """Mémoire nécessaire estimée (en octets) pour traiter une ressource."""
+    filesize = resource["filesize"]
+    if resource["format"] == "json" and filesize <= JSON_WHOLE_DOCUMENT_MAX_SIZE:
+        factor = WHOLE_DOCUMENT_MEMORY_FACTOR
+    else:
+        factor = STREAMING_MEMORY_FACTOR
+    return max(filesize * factor, MIN_RESOURCE_MEMORY)
+
+
+def process_rss() -> int | None:
+    """Mémoire résidente (octets) du processus et de ses processus enfants (workers du
+    mode "process"), None si /proc n'est pas disponible (hors Linux)."""
+    pid = os.getpid()
+    try:
+        rss_pages = _resident_pages(pid)
+    except OSError:
+        return None
+
+    for child in _child_pids(pid):
+        try:
+            rss_pages += _resident_pages(child)
+        except (OSError, ValueError, IndexError):
+            # Processus terminé entre-temps
+            continue
+    return rss_pages * PAGE_SIZE
+
+
+def _child_pids(pid: int) -> list[str]:
+    """Processus enfants, lus dans /proc/<pid>/task/<tid>/children, ou en parcourant
+    tout /proc si le noyau ne fournit pas ces fichiers."""
+    if os.path.exists(f"/proc/{pid}/task/{pid}/children"):
+        children = []
+        for task in os.scandir(f"/proc/{pid}/task"):
+            try:
+                with open(f"{task.path}/children", "rb") as f:
+                    children += f.read().decode().split()
+            except OSError:
+                # Thread terminé entre-temps
+                continue
+        return children
+
+    children = []
+    for entry in os.scandir("/proc"):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry.name}/stat", "rb") as f:
+                stat = f.read()
+            # Le nom du processus, entre parenthèses, peut contenir des espaces
+            if int(stat.rsplit(b")", 1)[1].split()[1]) == pid:
+                children.append(entry.name)
+        except (OSError, ValueError, IndexError):
+            continue
+    return children
+
+
+def _resident_pages(pid) -> int:
+    with open(f"/proc/{pid}/statm", "rb") as f:
+        return int(f.read().split()[1])
+
+
+class MemoryGovernor:
+    """Budget mémoire des ressources en cours de traitement.
+
+    La mémoire utilisée est la somme des estimations des ressources en cours (in_flight),
+    plus leur dépassement mesuré : la croissance de la mémoire résidente (processus et
+    workers) depuis la dernière fin de traitement, au-delà des estimations des
+    ressources en cours à ce moment et de celles soumises depuis.
+
+    La mémoire résidente ne redescend presque jamais après la libération des buffers
+    (polars, pyarrow) : elle ne sert que de frein, et sa référence est remesurée à
+    chaque fin de traitement plutôt que de compter comme mémoire utilisée.
+    """
+
+    def __init__(self, budget_mb: int = RESOURCE_MEMORY_BUDGET_MB):
+        self.budget = budget_mb * 1024**2
+        self.in_flight = 0
+        self.throttling = False
+        self.reference_rss = process_rss()
+        # Croissance de la mémoire résidente attendue depuis reference_rss
+        self.allowance = 0
+
+    def used(self) -> int:
+        rss = process_rss() if self.reference_rss is not None else None
+        if rss is None:
+            return self.in_flight
+        overrun = rss - self.reference_rss - self.allowance
+        return self.in_flight + max(overrun, 0)
+
+    def headroom(self) -> float:
+        if self.budget <= 0:
+            return math.inf
+        return self.budget - self.used()
+
+    def reserve(self, memory: int):
+        self.in_flight += memory
+        self.allowance += memory
+        self.throttling = False
+
+    def release(self, memory: int):
+        self.in_flight -= memory
+        # Les ressources encore en cours peuvent atteindre leur estimation
+        if self.budget > 0:
+            self.reference_rss = process_rss()
+        self.allowance = self.in_flight
+
+    def throttle(self, memory: int, headroom: int):
+        """Log (une fois par période d'attente) quand une ressource doit attendre."""
+        if not self.throttling:
+            self.throttling = True
+            logger = get_logger(level=LOG_LEVEL)
+            logger.info(
+                f"⏳ Budget mémoire atteint ({(self.budget - headroom) // 1024**2} Mo "
+                f"utilisés sur {self.budget // 1024**2} Mo, {memory // 1024**2} Mo "
+                "estimés pour la ressource suivante) : attente de la fin d'un traitement"
+            )
+
+
+class ResourceScheduler:
+    """Soumission des ressources aux workers au fur et à mesure qu'ils se libèrent.
+
+    scheduler = ResourceScheduler()
+    for resource, future in scheduler.run(resources, submit):
+        ...
+    scheduler.utilisation  # une fois toutes les ressources traitées
+    """
+
+    def __init__(
+        self,
+        max_workers: int = MAX_PREFECT_WORKERS,
+        governor: MemoryGovernor | None = None,
+    ):
+        self.max_workers = max_workers
+        self.governor = governor or MemoryGovernor()
+        self.busy_seconds = 0.0
+        self.elapsed_seconds = 0.0
+        self._condition = threading.Condition()
+        # Ressources prêtes, triées de la plus grosse à la plus petite
+        self._ready = []
+        self._order = count()
+        self._feeding = False
+        self._feeding_error = None
+        self._running = 0
+        # Plus grosse ressource prête qui ne tient pas dans le budget (numéro d'ordre), et
+        # nombre de ressources passées devant elle
+        self._blocked = None
+        self._overtakes = 0
+
+    @property
+    def utilisation(self) -> float:
+        """Temps de traitement cumulé / temps disponible des workers."""
+        available_seconds = self.max_workers * self.elapsed_seconds
+        return self.busy_seconds / available_seconds if available_seconds else 0.0
+
+    def run(
+        self, resources: Iterable[dict], submit: Callable[[dict], Future]
+    ) -> Iterator[tuple[dict, Future]]:
+        """Soumission de toutes les ressources avec submit(resource) -> Future.
+
+        Les ressources sont lues dans un thread séparé (elles peuvent n'être prêtes qu'au
+        fur et à mesure de leur téléchargement, voir DownloadPipeline). Le générateur se
+        termine une fois toutes les ressources traitées."""
+        logger = get_logger(level=LOG_LEVEL)
+        start = time.perf_counter()
+
+        self._feeding = True
+        feeder = threading.Thread(target=self._feed, args=(resources,), daemon=True)
+        feeder.start()
+
+        submitted = 0
+        while True:
+            with self._condition:
+                resource = self._next_resource()
+                while resource is None:
+                    if not self._feeding and not self._ready and self._running == 0:
+                        break
+                    self._condition.wait()
+                    resource = self._next_resource()
+                if resource is None:
+                    break
+                memory = estimate_memory(resource)
+                self._running += 1
+                self.governor.reserve(memory)
+
+            future = submit(resource)
+            future.add_done_callback(
+                partial(self._release, memory, time.perf_counter())
+            )
+            submitted += 1
+            if submitted % 100 == 0:
+                logger.info(f"🗃️ {submitted} ressources soumises")
+            yield resource, future
+
+        feeder.join()
+        if self._feeding_error is not None:
+            raise self._feeding_error
+
+        self.elapsed_seconds = time.perf_counter() - start
+        logger.info(
+            f"📊 Utilisation des workers : {self.utilisation:.0%} "
+            f"({self.busy_seconds:.0f} s de traitement / "
+            f"{self.max_workers * self.elapsed_seconds:.0f} s disponibles)"
+        )
+
+    def _feed(self, resources: Iterable[dict]):
+        try:
+            for resource in resources:
+                with self._condition:
+                    bisect.insort(
+                        self._ready,
+                        (-resource["filesize"], next(self._order), resource),
+                    )
+                    self._condition.notify()
+        except Exception as e:
+            self._feeding_error = e
+        finally:
+            with self._condition:
+                self._feeding = False
+                self._condition.notify()
+
+    def _next_resource(self) -> dict | None:
+        """Plus grosse ressource prête qui tient dans le budget mémoire (à appeler avec
+        self._condition)."""
+        if self._running >= self.max_workers or not self._ready:
+            return None
+        _, order, largest = self._ready[0]
+        headroom = self.governor.headroom() if self._running else None
+        if headroom is None or estimate_memory(largest) <= headroom:
+            self._blocked = None
+            return self._ready.pop(0)[2]
+
+        if self._blocked != order:
+            self._blocked = order
+            self._overtakes = 0
+        # Au-delà de MAX_OVERTAKES, la mémoire libérée est réservée à la plus grosse
+        if self._overtakes < MAX_OVERTAKES:
+            for i, (_, _, resource) in enumerate(self._ready[1:], start=1):
+                if estimate_memory(resource) <= headroom:
+                    del self._ready[i]
+                    self._overtakes += 1
+                    return resource
+        self.governor.throttle(estimate_memory(largest), headroom)
+        return None
+
+    def _release(self, memory: int, submitted_at: float, future: Future):
+        with self._condition:
+            self.busy_seconds += time.perf_counter() - submitted_at
+            self._running -= 1
+            self.governor.release(memory)
+            self._condition.notify()
@@ -0,0 +1,144 @@
+"""
+Traitement des ressources réparti en shards (DECP_SHARD_COUNT).
+
+Chaque shard traite les ressources dont le hash du checksum tombe dans sa plage
+(shard_of), et écrit ses parquet dans le cache des ressources partagé
+(RESOURCE_CACHE_DIR). Les shards sont des exécutions du flow decp_ingest_shard : sur des
+workers Prefect (DECP_SHARD_DEPLOYMENT) ou dans des processus locaux.
+
+L'exécution principale dépose la liste des ressources dans le dossier de l'exécution
+(SHARDS_DIR/<run_id>), puis attend le résultat de tous les shards (parquet produits,
+lignes d'artifact) avant de les fusionner dans un ordre déterministe.
+"""
+
+import hashlib
+import json
+import shutil
+import time
+from collections.abc import Callable
+from datetime import datetime
+from pathlib import Path
+from uuid import uuid4
+
+from src.config import LOG_LEVEL, SHARD_TIMEOUT_HOURS, SHARDS_DIR
+from src.tasks.utils import get_logger
+
+
+class ShardFailed(Exception):
+    pass
+
+
+def shard_of(checksum: str, shard_count: int) -> int:
+    """Shard d'une ressource : même résultat sur toutes les machines (contrairement à
+    hash(), qui dépend de PYTHONHASHSEED)."""
+    digest = hashlib.sha1(checksum.encode()).digest()
+    # Plages contiguës de l'espace des hash
+    return int.from_bytes(digest[:8], "big") * shard_count >> 64
+
+
+def select_shard(resources: list[dict], shard_index: int, shard_count: int) -> list:
+    return [r for r in resources if shard_of(r["checksum"], shard_count) == shard_index]
+
+
+class ShardRun:
+    """Échanges entre l'exécution principale et ses shards, dans un dossier partagé."""
+
+    def __init__(self, run_id: str | None = None, shards_dir: Path = SHARDS_DIR):
+        self.run_id = run_id or f"{datetime.now():%Y-%m-%d_%H%M%S}_{uuid4().hex[:8]}"
+        self.run_dir = shards_dir / self.run_id
+
+    def write_resources(self, resources: list[dict], available_parquet_files: set):
+        self.run_dir.mkdir(exist_ok=True, parents=True)
+        self._write_json(
+            "resources.json",
+            {
+                "resources": resources,
+                "available_parquet_files": sorted(available_parquet_files),
+            },
+        )
+
+    def read_resources(self) -> tuple[list[dict], set]:
+        with open(self.run_dir / "resources.json") as f:
+            data = json.load(f)
+        return data["resources"], set(data["available_parquet_files"])
+
+    def write_result(
+        self, shard_index: int, parquet_files: list, resources_artifact: list
+    ):
+        self._write_json(
+            f"shard_{shard_index}.json",
+            {
+                "parquet_files": [str(path) for path in parquet_files],
+                "resources_artifact": resources_artifact,
+            },
+        )
+
+    def write_error(self, shard_index: int, error: Exception):
+        self._write_json(
+            f"shard_{shard_index}.error.json",
+            {"error": f"{type(error).__name__}: {error}"},
+        )
+
+    def wait_for_shards(
+        self,
+        shard_count: int,
+        is_running: Callable[[int], bool] | None = None,
+        timeout_hours: float = SHARD_TIMEOUT_HOURS,
+        poll_seconds: float = 10,
+    ) -> tuple[list[Path], list[dict]]:
+        """Attente du résultat de tous les shards, puis fusion : parquet triés par nom,
+        lignes d'artifact dans l'ordre des shards.
+
+        is_running(shard_index) permet de détecter un shard arrêté sans résultat (processus
+        local tué par manque de mémoire par exemple) sans attendre timeout_hours."""
+        logger = get_logger(level=LOG_LEVEL)
+
+        deadline = time.monotonic() + timeout_hours * 3600
+        pending = set(range(shard_count))
+        while pending:
+            for shard_index in sorted(pending):
+                error_path = self.run_dir / f"shard_{shard_index}.error.json"
+                if error_path.exists():
+                    with open(error_path) as f:
+                        error = json.load(f)["error"]
+                    raise ShardFailed(f"Échec du shard {shard_index} : {error}")
+                result_path = self.run_dir / f"shard_{shard_index}.json"
+                if result_path.exists():
+                    pending.discard(shard_index)
+                    logger.info(
+                        f"🧩 Shard {shard_index} terminé "
+                        f"({shard_count - len(pending)}/{shard_count})"
+                    )
+                elif (
+                    is_running is not None
+                    and not is_running(shard_index)
+                    # Résultat écrit juste avant la fin du processus
+                    and not result_path.exists()
+                ):
+                    raise ShardFailed(f"Shard {shard_index} arrêté sans résultat")
+            if pending and time.monotonic() > deadline:
+                raise ShardFailed(
+                    f"Shards non terminés après {timeout_hours} h : {sorted(pending)}"
+                )
+            if pending:
+                time.sleep(poll_seconds)
+
+        parquet_files = []
+        resources_artifact = []
+        for shard_index in range(shard_count):
+            with open(self.run_dir / f"shard_{shard_index}.json") as f:
+                result = json.load(f)
+            parquet_files.extend(Path(path) for path in result["parquet_files"])
+            resources_artifact.extend(result["resources_artifact"])
+        parquet_files.sort(key=lambda path: path.name)
+        return parquet_files, resources_artifact
+
+    def remove(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+    def _write_json(self, name: str, data):
+        # Écriture dans un fichier temporaire : le fichier n'apparaît que complet
+        tmp_path = self.run_dir / f"{name}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, default=str)
+        tmp_path.rename(self.run_dir / name)
@@ -0,0 +1,257 @@
+"""
+Traçage des étapes des flows : durée, temps CPU, pic de mémoire, lectures et écritures.
+
+    @flow
+    @traced("decp_processing")
+    def decp_processing():
+        with stage("consolidation") as span:
+            ...
+            span.rows_out = 1000
+
+Pour chaque étape (les étapes peuvent être imbriquées) :
+- wall_s : durée
+- cpu_s : temps CPU du processus (tous ses threads) et de ses processus enfants terminés
+- peak_rss_mb : pic de mémoire résidente du processus pendant l'étape (VmHWM, remis à zéro
+  au début de l'étape via /proc/self/clear_refs)
+- read_mb, write_mb : octets lus et écrits (rchar, wchar de /proc/self/io, cache disque et
+  réseau compris), disk_read_mb, disk_write_mb : octets lus et écrits sur le disque
+- rows_in, rows_out : nombre de lignes en entrée et en sortie, si l'étape les renseigne
+
+La trace est exportée au format Chrome trace (chrome://tracing, https://ui.perfetto.dev)
+dans TRACES_DIR après chaque étape, même si le flow échoue ensuite, et sous forme d'artifact
+Prefect à la fin du flow (y compris en cas d'échec), avec la durée de chaque étape lors de
+l'exécution précédente.
+"""
+
+import json
+import os
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+
+from prefect.artifacts import create_table_artifact
+
+from src.config import LOG_LEVEL, TRACES_DIR
+from src.tasks.utils import get_logger
+
+# Nombre de traces conservées par flow
+MAX_TRACES = 30
+
+
+def read_proc_io() -> dict[str, int]:
+    """Compteurs d'entrées/sorties du processus, vide hors Linux."""
+    try:
+        with open("/proc/self/io") as f:
+            return {
+                key: int(value)
+                for key, value in (line.split(": ") for line in f.read().splitlines())
+            }
+    except OSError:
+        return {}
+
+
+def read_peak_rss() -> int | None:
+    """Pic de mémoire résidente (octets) depuis la dernière remise à zéro."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        # Le pic mesuré sera celui depuis le début du processus
+        pass
+
+
+def cpu_seconds() -> float:
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+@dataclass
+class Span:
+    name: str
+    depth: int
+    rows_in: int | None = None
+    rows_out: int | None = None
+    start: float = 0.0
+    wall: float = 0.0
+    cpu: float = 0.0
+    peak_rss: int | None = None
+    io: dict = field(default_factory=dict)
+    # Pic de mémoire avant la remise à zéro par une étape imbriquée
+    children_peak_rss: int = 0
+
+    def to_row(self) -> dict:
+        def mb(value):
+            return round(value / 1024**2, 1) if value is not None else None
+
+        return {
+            "etape": "  " * self.depth + self.name,
+            "wall_s": round(self.wall, 2),
+            "cpu_s": round(self.cpu, 2),
+            "peak_rss_mb": mb(self.peak_rss),
+            "read_mb": mb(self.io.get("rchar")),
+            "write_mb": mb(self.io.get("wchar")),
+            "disk_read_mb": mb(self.io.get("read_bytes")),
+            "disk_write_mb": mb(self.io.get("write_bytes")),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+        }
+
+
+class Tracer:
+    current: "Tracer | None" = None
+
+    def __init__(self, flow_name: str, traces_dir: Path | None = None):
+        traces_dir = traces_dir or TRACES_DIR
+        self.flow_name = flow_name
+        self.traces_dir = traces_dir
+        self.started_at = datetime.now()
+        self.origin = time.perf_counter()
+        self.spans: list[Span] = []
+        self._stack: list[Span] = []
+        self.trace_path = (
+            traces_dir / f"{flow_name}_{self.started_at:%Y-%m-%dT%H%M%S}.json"
+        )
+
+    @contextmanager
+    def stage(self, name: str, rows_in: int | None = None):
+        parent = self._stack[-1] if self._stack else None
+        if parent is not None:
+            parent.children_peak_rss = max(
+                parent.children_peak_rss, read_peak_rss() or 0
+            )
+        span = Span(name, depth=len(self._stack), rows_in=rows_in)
+        self._stack.append(span)
+        reset_peak_rss()
+        io_before = read_proc_io()
+        cpu_before = cpu_seconds()
+        span.start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.wall = time.perf_counter() - span.start
+            span.cpu = cpu_seconds() - cpu_before
+            io_after = read_proc_io()
+            span.io = {key: io_after[key] - io_before[key] for key in io_after}
+            peak_rss = read_peak_rss()
+            if peak_rss is not None:
+                span.peak_rss = max(peak_rss, span.children_peak_rss)
+            self._stack.pop()
+            if parent is not None and span.peak_rss is not None:
+                parent.children_peak_rss = max(parent.children_peak_rss, span.peak_rss)
+            self.spans.append(span)
+            self.write_chrome_trace()
+
+    def write_chrome_trace(self):
+        events = [
+            {
+                "name": span.name,
+                "cat": self.flow_name,
+                "ph": "X",
+                "ts": round((span.start - self.origin) * 1e6),
+                "dur": round(span.wall * 1e6),
+                "pid": os.getpid(),
+                "tid": 0,
+                "args": span.to_row(),
+            }
+            for span in self.spans
+        ]
+        self.traces_dir.mkdir(exist_ok=True, parents=True)
+        tmp_path = self.trace_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        os.replace(tmp_path, self.trace_path)
+
+    def previous_trace(self) -> dict[str, float]:
+        """Durée des étapes lors de l'exécution précédente du flow."""
+        traces = sorted(
+            path
+            for path in self.traces_dir.glob(f"{self.flow_name}_*.json")
+            if path != self.trace_path
+        )
+        if not traces:
+            return {}
+        with open(traces[-1]) as f:
+            events = json.load(f)["traceEvents"]
+        return {event["args"]["etape"]: event["args"]["wall_s"] for event in events}
+
+    def finish(self):
+        """Artifact Prefect de la trace, et suppression des traces les plus anciennes."""
+        # Le traçage est terminé même si l'artifact ne peut pas être créé
+        Tracer.current = None
+        logger = get_logger(level=LOG_LEVEL)
+
+        self.write_chrome_trace()
+        previous = self.previous_trace()
+        # Étapes dans l'ordre de leur début (les étapes imbriquées se terminent avant)
+        rows = []
+        for span in sorted(self.spans, key=lambda s: s.start):
+            row = span.to_row()
+            row["wall_s_precedent"] = previous.get(row["etape"])
+            rows.append(row)
+        create_table_artifact(
+            table=rows,
+            key=f"{self.flow_name.replace('_', '-')}-trace",
+            description=f"Trace des étapes ({self.started_at:%Y-%m-%d %H:%M})",
+        )
+        logger.info(f"📊 Trace des étapes : {self.trace_path}")
+
+        traces = sorted(self.traces_dir.glob(f"{self.flow_name}_*.json"))
+        for path in traces[:-MAX_TRACES]:
+            path.unlink()
+
+
+def start_tracing(flow_name: str) -> Tracer:
+    Tracer.current = Tracer(flow_name)
+    return Tracer.current
+
+
+def start_subflow_tracing(flow_name: str) -> Tracer | None:
+    """Traçage d'un flow qui peut être appelé par un autre flow (sirene_preprocess) : ses
+    étapes sont ajoutées à la trace en cours s'il y en a une (None est alors renvoyé)."""
+    if Tracer.current is not None:
+        return None
+    return start_tracing(flow_name)
+
+
+def traced(flow_name: str) -> Callable:
+    """Décorateur d'un flow (sous @flow) : traçage de ses étapes (start_subflow_tracing),
+    terminé même si le flow échoue, avec la trace des étapes effectuées."""
+
+    def decorator(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            tracer = start_subflow_tracing(flow_name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if tracer is not None:
+                    tracer.finish()
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def stage(name: str, rows_in: int | None = None):
+    """Étape tracée si un traçage est en cours (start_tracing), sans effet sinon."""
+    if Tracer.current is None:
+        yield Span(name, depth=0, rows_in=rows_in)
+    else:
+        with Tracer.current.stage(name, rows_in) as span:
+            yield span
@@ -4,6 +4,8 @@ import polars as pl
 import polars.selectors as cs
 
 from src.config import DATA_DIR, DIST_DIR, LOG_LEVEL
+from src.schemas import SCHEMA_LOW_CARDINALITY
+from src.tasks.cache_manifest import row_counts
 from src.tasks.output import save_to_files
 from src.tasks.utils import (
     calculate_duplicates_across_source,
@@ -12,45 +14,31 @@ from src.tasks.utils import (
 )
 
 
-def apply_modifications(lff: pl.LazyFrame):
+def apply_modifications(
+    lff: pl.LazyFrame, columns: list[str] | None = None, keys: list[str] | None = None
+):
     """
     Gère les modifications dans le DataFrame des DECP.
     À ce stade les modifications ont été exploded dans write_marche_rows().
     Cette fonction récupère les informations des modifications (ex : modification_montant) et les insère dans les champs de base (ex : montant).
     (chaque ligne contient les informations complètes à jour à la date de notification)
     donneesActuelles et modification_id sont ajoutées après concaténation de toutes les ressources.
+    columns : colonnes de lff, si elles sont déjà connues (plan de nettoyage, voir clean_decp)
+    keys : identifiant d'un marché, ["uid"] par défaut (plusieurs ressources nettoyées en
+    une seule requête : ressource et uid)
+
+    Les lignes sont dans l'ordre produit par yield_modifications() : pour chaque marché, sa
+    version initiale puis ses modifications, qui ont toutes les colonnes fixes de la
+    version initiale. Les modifications sont donc appliquées en une seule passe triée, sans
+    jointure pour réintroduire les colonnes fixes (voir script/benchmark_modifications.py).
     """
-    # Étape 1: Extraire les données des modifications en renommant les colonnes
-    columns = lff.collect_schema().names()
-    columns_no_modif = [col for col in columns if not (col.startswith("modification_"))]
-
-    lf_mods = (
-        lff.select(cs.by_name("uid") | cs.starts_with("modification_"))
-        .rename(
-            {
-                column: column.removeprefix("modification_").removesuffix(
-                    "Modification"
-                )
-                for column in columns
-                if column.startswith("modification_") and column != "modification_id"
-            }
-        )
-        .filter(~pl.all_horizontal(pl.all().exclude("uid").is_null()))
-    )  # sans les lignes de données initiales
-
-    # Étape 2: Dédupliquer et créer une copie du DataFrame initial sans les colonnes "modifications"
-    # On peut dédupliquer aveuglément car la seule chose qui varient dans les lignes d'un même
-    # uid, c'est les données de modifs
-    lff = lff.unique("uid")
-
-    # Garder toutes les colonnes sauf les colonnes modification_*
-    lf_base = lff.drop(cs.starts_with("modification_"))
-
-    # Étape 3 : concaténation des données modifiées et des colonnes normales (pas modification_)
+    if columns is None:
+        columns = lff.collect_schema().names()
+    if keys is None:
+        keys = ["uid"]
 
     # Colonnes qui peuvent changer avec les modifications
     modified_columns = [
-        "uid",
         "dateNotification",
         "datePublicationDonnees",
         "montant",
@@ -58,40 +46,82 @@ def apply_modifications(lff: pl.LazyFrame):
         "titulaires",
     ]
 
-    lff = pl.concat(
-        [
-            lf_base.select(modified_columns),
-            lf_mods,
-        ],
-        how="diagonal",
-    )
-
-    # Étape 4: Réintroduire le tout avec les colonnes fixes (qui ne changent pas avec les modifications)
-    # Sélectionner uniquement les colonnes qui ne sont pas dans modification_columns
-    columns_to_keep = [col for col in columns_no_modif if col not in modified_columns]
-
-    # Créer un DataFrame avec uniquement les colonnes fixes, dédupliqué par uid
-    lf_fixed_columns = lf_base.select(["uid"] + columns_to_keep).unique("uid")
+    # Colonnes des modifications, et leur nom sans préfixe ni suffixe (ex : montant)
+    modifications = {
+        column: column.removeprefix("modification_").removesuffix("Modification")
+        for column in columns
+        if column.startswith("modification_") and column != "modification_id"
+    }
+    if "modification_id" in columns:
+        modifications["modification_id"] = "modification_id"
+    modification_of = {name: column for column, name in modifications.items()}
+
+    # Colonnes fixes (qui ne changent pas avec les modifications)
+    fixed_columns = [
+        col
+        for col in columns
+        if not col.startswith("modification_")
+        and col not in keys
+        and col not in modified_columns
+    ]
 
-    # Joindre pour réintroduire les colonnes fixes
-    lf_final = lff.join(
-        lf_fixed_columns,
-        on="uid",
-        how="left",
+    # Étape 1 : version initiale (première ligne de chaque marché) et lignes des
+    # modifications, sans les lignes de modification vides
+    if modifications:
+        is_modification = ~pl.all_horizontal(pl.col(list(modifications)).is_null())
+    else:
+        is_modification = pl.lit(False)
+    lff = lff.with_columns(
+        pl.struct(keys).is_first_distinct().alias("version_initiale")
+    ).filter(pl.col("version_initiale") | is_modification)
+
+    # Étape 2 : valeurs de la version initiale, ou de la modification
+    initial = pl.col("version_initiale")
+    lff = lff.select(
+        *keys,
+        *[
+            pl.when(initial)
+            .then(pl.col(col))
+            .otherwise(pl.col(modification_of[col]) if col in modification_of else None)
+            .alias(col)
+            for col in modified_columns
+        ],
+        # Champs de modification sans équivalent dans la version initiale
+        *[
+            pl.when(initial).then(None).otherwise(pl.col(column)).alias(name)
+            for column, name in modifications.items()
+            if name not in modified_columns
+        ],
+        *fixed_columns,
     )
 
-    # Étape 5: Remplir les valeurs nulles en utilisant les dernières valeurs non-nulles pour chaque id
-    lf_final = lf_final.sort(
-        ["uid", "dateNotification"],
-        descending=[False, False],
+    # Étape 3 : tri chronologique de chaque marché, et remplissage des valeurs nulles par
+    # la dernière valeur non nulle du même marché. Les marchés étant triés, la dernière
+    # valeur non nulle est celle du marché si elle n'est pas avant sa première ligne
+    # (pas de fenêtre .over())
+    lff = lff.sort([*keys, "dateNotification"])
+    row = pl.int_range(pl.len())
+    first_row = (
+        pl.when(
+            pl.any_horizontal(
+                [pl.col(key).ne_missing(pl.col(key).shift()) for key in keys]
+            )
+        )
+        .then(row)
+        .forward_fill()
     )
-    lf_final = lf_final.with_columns(
-        pl.col("montant", "dureeMois", "titulaires")
-        .fill_null(strategy="forward")
-        .over("uid")
+    lff = lff.with_columns(
+        [
+            pl.when(
+                pl.when(pl.col(col).is_not_null()).then(row).forward_fill() >= first_row
+            )
+            .then(pl.col(col).forward_fill())
+            .alias(col)
+            for col in ["montant", "dureeMois", "titulaires"]
+        ]
     )
 
-    return lf_final
+    return lff
 
 
 def sort_modifications(lff: pl.LazyFrame) -> pl.LazyFrame:
@@ -115,16 +145,32 @@ def sort_modifications(lff: pl.LazyFrame) -> pl.LazyFrame:
     return lff
 
 
+def non_empty_parquet_files(parquet_files: list) -> list:
+    """Mise de côté des parquet
+    - qui n'existent pas (s'il y a eu une erreur par exemple)
+    - qui ont une hauteur de 0
+    Le nombre de lignes est lu dans le manifeste du cache, les fichiers ne sont ouverts
+    que s'ils n'y sont pas"""
+    counts = row_counts()
+    checked_parquet_files = []
+    for file in parquet_files:
+        checksum = Path(file).stem
+        if checksum in counts:
+            non_empty = counts[checksum] > 0 and Path(file).exists()
+        else:
+            non_empty = check_parquet_file(file)
+        if non_empty:
+            checked_parquet_files.append(file)
+    return checked_parquet_files
+
+
 def concat_parquet_files(parquet_files: list) -> pl.LazyFrame:
     """Concatenation par morceaux (chunks) pour éviter de charger trop de fichiers en mémoire
     # et pour éviter "OSError: Too many open files"
-
-    # Mise de côté des parquet
-    # - qui n'existent pas (s'il y a eu une erreur par exemple)
-    # - qui ont une hauteur de 0"""
+    """
     logger = get_logger(level=LOG_LEVEL)
 
-    checked_parquet_files = [file for file in parquet_files if check_parquet_file(file)]
+    checked_parquet_files = non_empty_parquet_files(parquet_files)
 
     chunk_size = 500
     chunks = [
@@ -155,16 +201,16 @@ def concat_parquet_files(parquet_files: list) -> pl.LazyFrame:
     calculate_duplicates_across_source(lf_concat)
 
     logger.info("Suppression des lignes en doublon...")
+    return remove_duplicate_rows(lf_concat)
 
-    # Exemple de doublon : 20005584600014157140791205100
 
-    lf_concat = lf_concat.unique(
+def remove_duplicate_rows(lf: pl.LazyFrame) -> pl.LazyFrame:
+    # Exemple de doublon : 20005584600014157140791205100
+    return lf.unique(
         subset=["uid", "titulaire_id", "titulaire_typeIdentifiant", "dateNotification"],
         maintain_order=False,
     )
 
-    return lf_concat
-
 
 def extract_unique_acheteurs_siret(lf: pl.LazyFrame):
     # Extraction des SIRET des DECP dans une copie du df de base
@@ -262,6 +308,19 @@ def prepare_etablissements(lff: pl.LazyFrame) -> pl.LazyFrame:
     return lff
 
 
+def cast_low_cardinality(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """Conversion des colonnes présentes de SCHEMA_LOW_CARDINALITY en pl.Enum ou
+    pl.Categorical. Les valeurs absentes de la liste d'un pl.Enum sont converties en null."""
+    schema = lf.collect_schema()
+    return lf.with_columns(
+        [
+            pl.col(col).cast(dtype, strict=False)
+            for col, dtype in SCHEMA_LOW_CARDINALITY.items()
+            if col in schema and schema[col] != dtype
+        ]
+    )
+
+
 def sort_columns(lf: pl.LazyFrame, config_columns):
     logger = get_logger(level=LOG_LEVEL)
 
@@ -2,9 +2,10 @@ import json
 import logging
 import re
 import shutil
-import time
+from collections import Counter
+from collections.abc import Callable, Iterable, Iterator
 from datetime import datetime
-from pathlib import Path
+from functools import partial
 
 import polars as pl
 from prefect import task
@@ -14,38 +15,100 @@ from prefect.logging import get_run_logger
 
 from src.config import (
     ALL_CONFIG,
-    CACHE_EXPIRATION_TIME_HOURS,
     DATE_NOW,
     DIST_DIR,
     LOG_LEVEL,
-    RESOURCE_CACHE_DIR,
     SIRENE_DATA_DIR,
     TRACKED_DATASETS,
-    DecpFormat,
 )
 
 
-def stream_replace_bytestring(iterator, old_bytestring: bytes, new_bytestring: bytes):
+class StreamRewriter:
     """
-    Remplacement de texte encodé avec regex, avec prise en compte des bords de "chunk (merci Euria la LLM d'Infomaniak)
+    Remplacements multiples sur un flux d'octets, en un seul passage sur le flux.
+
+    Chaque règle (label, pattern regex, remplacement) est compilée une fois. Le remplacement
+    est soit un template d'octets (ex : rb"null\\1"), soit une fonction qui reçoit les
+    octets trouvés et renvoie les octets de remplacement. Les règles sont appliquées dans
+    l'ordre, chacune sur le résultat de la précédente.
+
+    Entre deux chunks, les `window` derniers octets sont conservés, au cas où une
+    occurrence serait coupée entre deux chunks. Une occurrence plus longue (ex : une suite
+    de backslashes) qui déborde sur ces octets est conservée en entier, quelle que soit sa
+    longueur.
+
+    Le nombre de remplacements par règle est disponible dans `counts` une fois le flux lu.
     """
-    buffer = b""
-    length_to_replace = len(old_bytestring)
 
-    for chunk in iterator:
-        buffer += chunk
-        buffer = re.sub(old_bytestring, new_bytestring, buffer)
-        # On garde un bout de quelques caractères au cas où le pattern est coupé entre les deux chunks
-        safe_end = len(buffer) - length_to_replace + 1
+    def __init__(
+        self,
+        rules: list[tuple[str, bytes, bytes | Callable[[bytes], bytes]]],
+        window: int = 64,
+    ):
+        self.window = window
+        self.counts = {label: 0 for label, _, _ in rules}
+        self.rules = []
+        for label, pattern, replacement in rules:
+            if callable(replacement):
+                replacement = partial(_call_on_match, replacement)
+            self.rules.append((label, re.compile(pattern), replacement))
+
+    def rewrite(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        buffer = bytearray()
+        for chunk in chunks:
+            buffer += chunk
+            if len(buffer) > self.window:
+                output = self._rewrite_buffer(buffer, final=False)
+                if output:
+                    yield output
+        if buffer:
+            yield self._rewrite_buffer(buffer, final=True)
+
+    def _rewrite_buffer(self, buffer: bytearray, final: bool) -> bytes:
+        """Remplacement des occurrences au début du buffer, jusqu'à la fenêtre conservée
+        pour le chunk suivant. La partie traitée est retirée du buffer."""
+        end = len(buffer)
+        if not final:
+            end -= self.window
+            # Une occurrence qui déborde sur la fenêtre pourrait se prolonger dans le
+            # chunk suivant : elle sera traitée avec lui
+            cut = end
+            for _, regex, _ in self.rules:
+                start = self._overflowing_match_start(regex, buffer, end)
+                if start is not None:
+                    cut = min(cut, start)
+            end = cut
+
+        with memoryview(buffer) as view:
+            output = view[:end].tobytes()
+        del buffer[:end]
+
+        for label, regex, replacement in self.rules:
+            output, count = regex.subn(replacement, output)
+            self.counts[label] += count
+        return output
+
+    def _overflowing_match_start(
+        self, regex: re.Pattern, buffer: bytearray, end: int
+    ) -> int | None:
+        """Début de l'occurrence qui commence avant `end` et se termine après, None s'il
+        n'y en a pas."""
+        search = max(end - self.window, 0)
+        while True:
+            match = next(
+                (m for m in regex.finditer(buffer, search) if m.end() > end), None
+            )
+            if match is None:
+                return None
+            # Une occurrence trouvée au début de la recherche peut commencer avant : la
+            # recherche reprend plus tôt (deux fois plus loin de end)
+            if match.start() > search or search == 0 or search == end:
+                return match.start()
+            search = max(2 * search - end, 0)
 
-        if safe_end > 0:
-            to_process, buffer = buffer[:safe_end], buffer[safe_end:]
-            chunk = to_process.replace(old_bytestring, new_bytestring)
-            yield chunk
 
-    if buffer:
-        buffer = re.sub(old_bytestring, new_bytestring, buffer)
-        yield buffer
+def _call_on_match(function: Callable[[bytes], bytes], match: re.Match) -> bytes:
+    return function(match.group())
 
 
 @task
@@ -62,51 +125,95 @@ def remove_sirene_data_dir(transaction):
 
 
 #
-# CACHE
+# STATS
 #
 
 
-def remove_unused_cache(
-    cache_dir: Path = RESOURCE_CACHE_DIR,
-    cache_expiration_time_hours: int = CACHE_EXPIRATION_TIME_HOURS,
-):
-    logger = get_logger(level=LOG_LEVEL)
-
-    now = time.time()
-    age_limit = cache_expiration_time_hours * 3600  # seconds
-    deleted_files = []
-    if cache_dir.exists():
-        for file in cache_dir.rglob("*"):
-            if file.is_file():
-                if now - file.stat().st_atime > age_limit:
-                    logger.debug(f"Suppression du fichier de cache: {file}")
-                    deleted_files.append(file)
-                    file.unlink()
-        logger.info(f"-> {len(deleted_files)} fichiers de cache supprimés")
-
+class FieldCensus:
+    """
+    Recensement des champs (noms aplatis) d'une ressource.
 
-#
-# STATS
-#
+    Pour chaque champ : nombre de marchés où il est présent, et nombre de marchés où il
+    est renseigné (ni null, ni chaîne ou liste vide). Les champs des modifications sont
+    comptés par modification.
 
+    Les marchés d'une ressource ont le plus souvent les mêmes champs : ce sont les
+    combinaisons de champs présents et vides qui sont comptées (une opération par
+    marché), le décompte par champ n'est calculé qu'à la fin.
+    """
 
-# Statistiques pour une ressource
-def gen_artifact_row(
-    file_info: dict,
-    lf: pl.LazyFrame,
-    url: str,
-    fields: set[str],
-    decp_format: DecpFormat,
-):
+    def __init__(self):
+        self.marches = 0
+        self.modifications = 0
+        # {(champs présents, champs vides): nombre de marchés}
+        self._marche_shapes = {}
+        self._modification_shapes = {}
+
+    def count_marche(self, present: list[str], empty: list[str]):
+        self.marches += 1
+        shape = (tuple(present), tuple(empty))
+        self._marche_shapes[shape] = self._marche_shapes.get(shape, 0) + 1
+
+    def count_modification(self, present: list[str], empty: list[str]):
+        self.modifications += 1
+        shape = (tuple(present), tuple(empty))
+        self._modification_shapes[shape] = self._modification_shapes.get(shape, 0) + 1
+
+    def summary(self) -> dict:
+        """Statistiques des champs pour l'artifact des ressources."""
+        fields = self.fields
+        return {
+            "data_fields": sorted(fields),
+            "data_fields_number": len(fields),
+            "data_fields_fill_rates": self.fill_rates(),
+            "marches_number": self.marches,
+            "modifications_number": self.modifications,
+        }
+
+    @property
+    def fields(self) -> set[str]:
+        return {
+            field
+            for shapes in (self._marche_shapes, self._modification_shapes)
+            for present, _ in shapes
+            for field in present
+        }
+
+    def fill_rates(self) -> dict[str, float]:
+        """Part des marchés (ou des modifications) où chaque champ est renseigné."""
+        rates = {}
+        for shapes, total in [
+            (self._marche_shapes, self.marches),
+            (self._modification_shapes, self.modifications),
+        ]:
+            present, empty = Counter(), Counter()
+            for (present_fields, empty_fields), count in shapes.items():
+                for field in present_fields:
+                    present[field] += count
+                for field in empty_fields:
+                    empty[field] += count
+            for field in present:
+                # Un nom peut apparaître deux fois dans un même marché, par exemple
+                # "lieuExecution_code" et "lieuExecution": {"code": ...}
+                filled = min(present[field] - empty[field], total)
+                rates[field] = round(filled / total, 3)
+        return dict(sorted(rates.items()))
+
+
+# Statistiques pour une ressource, à partir de son entrée dans le manifeste du cache
+# (voir src/tasks/cache_manifest.py)
+def gen_artifact_row(file_info: dict, entry: dict):
     artifact_row = {
         # file and schema metadata
         "open_data_dataset_id": file_info["dataset_id"],
         "open_data_dataset_name": file_info["dataset_name"],
         "download_date": DATE_NOW,
-        "data_fields": sorted(list(fields)),
-        "data_fields_number": len(fields),
-        "schema_label": decp_format.label,
-        "row_number": lf.select(pl.len()).collect().item(),
+        **(entry["field_census"] or {}),
+        "schema_label": entry["decp_format"],
+        "row_number": entry["source_row_count"],
+        "parser": file_info.get("parser"),
+        "replacements": file_info.get("replacements"),
+        "dates": file_info.get("dates"),
         # data.gouv.fr metadata
         "open_data_filename": file_info["ori_filename"],
         "open_data_id": file_info["id"],
@@ -115,7 +222,7 @@ def gen_artifact_row(
         "last_modified": file_info["last_modified"],
         "filesize": file_info["filesize"],
         "views": file_info["views"],
-        "url": url,
+        "url": file_info["url"],
     }
 
     return artifact_row
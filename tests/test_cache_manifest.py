@@ -0,0 +1,233 @@
+import os
+from datetime import datetime, timedelta
+
+import polars as pl
+import pytest
+
+import src.tasks.cache_manifest
+import src.tasks.get
+import src.tasks.profiling
+from src.tasks.cache_manifest import cached_parquet_files, get_entry, row_counts
+from src.tasks.cache_policy import evict_resource_cache
+from src.tasks.clean import clean_decp
+from src.tasks.get import (
+    PendingCleaning,
+    clean_batch,
+    cleaning_batches,
+    get_clean,
+    make_decp_formats,
+    scan_get_parquet,
+)
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(src.tasks.get, "RESOURCE_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(src.tasks.get, "GET_DIR", tmp_path / "get")
+    monkeypatch.setattr(src.tasks.cache_manifest, "GET_DIR", tmp_path / "get")
+    monkeypatch.setattr(
+        src.tasks.cache_manifest, "CACHE_MANIFEST_PATH", tmp_path / "manifest.sqlite"
+    )
+    monkeypatch.setattr(
+        src.tasks.profiling, "RESOURCE_PROFILES_DB_PATH", tmp_path / "profiles.sqlite"
+    )
+    return tmp_path
+
+
+RESOURCE = {
+    "dataset_id": "test_dataset",
+    "dataset_name": "Dataset de test",
+    "dataset_code": "test_dataset",
+    "id": "decp_2019",
+    "ori_filename": "decp_2019.json",
+    "checksum": "0123456789abcdef0123456789abcdef01234567",
+    "filename": "test_dataset_decp_2019_manifest",
+    "url": "./tests/data/decp_test_2019.json",
+    "format": "json",
+    "created_at": "2025-07-08T18:00:00Z",
+    "last_modified": "2025-07-08T19:00:00Z",
+    "filesize": 3076,
+    "views": 10,
+}
+
+
+def fail(*args, **kwargs):
+    raise AssertionError("La ressource en cache ne doit pas être traitée")
+
+
+def test_get_clean_records_manifest_entry(cache_dir, monkeypatch):
+    """Le manifeste est alimenté à l'écriture du parquet, puis l'artifact d'une
+    ressource en cache est généré sans la traiter ni ouvrir le parquet."""
+    monkeypatch.setattr(src.tasks.get, "DECP_USE_CACHE", True)
+    monkeypatch.setattr(src.tasks.get, "DECP_PROCESSING_PUBLISH", True)
+    resource = RESOURCE
+    artifact = []
+    parquet_path = get_clean(dict(resource), artifact, set())
+
+    entry = get_entry(resource["checksum"])
+    assert entry["row_count"] == pl.read_parquet(parquet_path).height > 0
+    assert entry["decp_format"] == "DECP 2019"
+    assert entry["parquet_size"] == parquet_path.stat().st_size
+    assert entry["field_census"]["marches_number"] > 0
+    assert artifact[0]["schema_label"] == "DECP 2019"
+    assert artifact[0]["row_number"] == entry["source_row_count"]
+
+    monkeypatch.setattr(src.tasks.get, "get_resource", fail)
+    monkeypatch.setattr(src.tasks.cache_manifest, "parquet_metadata", fail)
+    get_clean(dict(resource), artifact, {parquet_path.name})
+    assert artifact[1]["data_fields"] == artifact[0]["data_fields"]
+    assert get_entry(resource["checksum"])["last_used_at"] > entry["last_used_at"]
+
+
+def test_get_clean_recleans_outdated_fingerprint(cache_dir, monkeypatch):
+    """Un parquet en cache produit par une autre version du nettoyage est nettoyé à
+    nouveau à partir du parquet de l'étape get, sans télécharger la ressource."""
+    monkeypatch.setattr(src.tasks.get, "DECP_USE_CACHE", True)
+    parquet_path = get_clean(dict(RESOURCE), [], set())
+    expected = pl.read_parquet(parquet_path)
+    entry = get_entry(RESOURCE["checksum"])
+    assert entry["get_size"] > 0
+
+    monkeypatch.setattr(src.tasks.get, "cleaning_fingerprint", lambda: "nouveau")
+    monkeypatch.setattr(src.tasks.get, "get_resource", fail)
+    assert cached_parquet_files("nouveau", cache_dir, cache_dir / "get") == {
+        parquet_path.name
+    }
+    parquet_path.write_bytes(b"")
+    get_clean(dict(RESOURCE), [], {parquet_path.name})
+    new_entry = get_entry(RESOURCE["checksum"])
+    assert new_entry["cleaning_fingerprint"] == "nouveau"
+    assert new_entry["field_census"] == entry["field_census"]
+    assert pl.read_parquet(parquet_path).equals(expected)
+
+    # Sans parquet de l'étape get, la ressource devra être traitée à nouveau
+    (cache_dir / "get" / parquet_path.name).unlink()
+    assert cached_parquet_files("autre", cache_dir, cache_dir / "get") == set()
+
+
+def test_clean_batch_matches_single_cleaning(cache_dir, monkeypatch):
+    """Le nettoyage par lots produit pour chaque ressource le même parquet qu'un
+    nettoyage séparé, y compris pour des marchés de même uid dans deux ressources."""
+    monkeypatch.setattr(src.tasks.get, "DECP_BATCH_CLEANING", True)
+    resources = [
+        dict(RESOURCE),
+        dict(RESOURCE, id="decp_2019_copie", checksum="copie" * 8),
+        dict(
+            RESOURCE,
+            id="decp_2022",
+            checksum="2022" * 10,
+            url="./tests/data/decp_test_2022.json",
+        ),
+    ]
+    pending = [get_clean(r, [], set()) for r in resources]
+    assert all(isinstance(p, PendingCleaning) for p in pending)
+
+    batches = cleaning_batches(pending)
+    assert [len(batch) for batch in batches] == [2, 1]
+    parquet_files = [path for batch in batches for path in clean_batch(batch, [])]
+
+    decp_formats = make_decp_formats()
+    for p, parquet_path in zip(pending, parquet_files):
+        expected = clean_decp(
+            scan_get_parquet(p.resource), decp_formats[p.decp_format]
+        ).collect()
+        assert parquet_path.name == f"{p.resource['checksum']}.parquet"
+        assert pl.read_parquet(parquet_path).equals(expected)
+        assert get_entry(p.resource["checksum"])["row_count"] == expected.height > 0
+
+
+def test_cached_parquet_files_syncs_manifest(cache_dir):
+    """Les parquet sans entrée sont ajoutés au manifeste, les entrées sans parquet
+    retirées."""
+    pl.DataFrame({"uid": ["1", "2"]}).write_parquet(cache_dir / "ancien.parquet")
+    pl.DataFrame({"uid": []}, schema={"uid": pl.String}).write_parquet(
+        cache_dir / "vide.parquet"
+    )
+    (cache_dir / "illisible.parquet").write_bytes(b"pas un parquet")
+
+    assert cached_parquet_files("actuel", cache_dir) == {
+        "ancien.parquet",
+        "vide.parquet",
+    }
+    assert row_counts() == {"ancien": 2, "vide": 0}
+
+    (cache_dir / "ancien.parquet").unlink()
+    assert cached_parquet_files("actuel", cache_dir) == {"vide.parquet"}
+    assert row_counts() == {"vide": 0}
+
+
+def test_evict_resource_cache_lru(cache_dir):
+    """Éviction selon la dernière utilisation enregistrée dans le manifeste (et non
+    st_atime), dans la limite de taille du cache, sans toucher aux parquet de
+    l'exécution en cours."""
+    now = datetime.now()
+    for name, size_mb, last_used_days_ago in [
+        ("expire", 1, 10),
+        ("ancien", 1, 3),
+        ("recent", 1, 1),
+        ("protege", 1, 20),
+    ]:
+        (cache_dir / f"{name}.parquet").write_bytes(os.urandom(size_mb * 1024**2))
+        last_used_at = (now - timedelta(days=last_used_days_ago)).isoformat()
+        src.tasks.cache_manifest._insert_entries(
+            [
+                {
+                    "checksum": name,
+                    "row_count": 1,
+                    "schema_hash": None,
+                    "decp_format": None,
+                    "source_row_count": None,
+                    "field_census": None,
+                    "parquet_size": size_mb * 1024**2,
+                    "source_size": None,
+                    "created_at": last_used_at,
+                    "last_used_at": last_used_at,
+                    "cleaning_fingerprint": None,
+                    "get_size": None,
+                }
+            ]
+        )
+
+    stats = evict_resource_cache(
+        {"protege"},
+        run_started_at=now.isoformat(),
+        cache_dir=cache_dir,
+        get_dir=cache_dir / "get",
+        max_size_mb=2,
+        expiration_time_hours=7 * 24,
+    )
+
+    # "expire" a expiré, "ancien" est le moins récemment utilisé au-delà de 2 Mo
+    assert sorted(p.stem for p in cache_dir.glob("*.parquet")) == ["protege", "recent"]
+    assert sorted(row_counts()) == ["protege", "recent"]
+    assert stats["evicted_files"] == 2
+    assert stats["freed_bytes"] == 2 * 1024**2
+    assert stats["hits"] == 1
+    assert stats["hit_ratio"] == 1.0
+
+
+def test_evict_resource_cache_get_dir_orphans(cache_dir):
+    """Les parquet de GET_DIR sans entrée dans le manifeste sont supprimés, sauf ceux de
+    l'exécution en cours."""
+    get_dir = cache_dir / "get"
+    get_dir.mkdir()
+    run_started_at = datetime.now()
+    before_run = (run_started_at - timedelta(hours=1)).timestamp()
+    for name in ["orphelin", "protege", "en_cours"]:
+        (get_dir / f"{name}.parquet").write_bytes(b"0" * 1024)
+    for name in ["orphelin", "protege"]:
+        os.utime(get_dir / f"{name}.parquet", (before_run, before_run))
+
+    stats = evict_resource_cache(
+        {"protege"},
+        run_started_at=run_started_at.isoformat(),
+        cache_dir=cache_dir,
+        get_dir=get_dir,
+        max_size_mb=0,
+        expiration_time_hours=7 * 24,
+    )
+
+    # "en_cours" a été écrit depuis le début de l'exécution
+    assert sorted(p.stem for p in get_dir.glob("*.parquet")) == ["en_cours", "protege"]
+    assert stats["evicted_files"] == 1
+    assert stats["freed_bytes"] == 1024
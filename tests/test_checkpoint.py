@@ -0,0 +1,44 @@
+import polars as pl
+
+from src.tasks.checkpoint import StageCheckpoints, file_hash
+
+
+def test_stage_checkpoints_resume(tmp_path):
+    """Une exécution relancée saute les étapes terminées dont les entrées et sorties n'ont
+    pas changé, et reprend à la première étape qui a échoué."""
+    run_dir = tmp_path / "runs" / "2026-01-01"
+    input_path = tmp_path / "entree.parquet"
+    output_path = tmp_path / "sortie.csv"
+    pl.DataFrame({"uid": ["1", "2"]}).write_parquet(input_path)
+
+    checkpoints = StageCheckpoints(run_dir)
+    assert not checkpoints.resumed
+    assert checkpoints.should_run("export", [input_path], [output_path])
+    output_path.write_text("uid\n1\n2\n")
+    checkpoints.done("export")
+    # L'étape "publication" échoue
+    assert checkpoints.should_run("publication", [output_path], [])
+
+    checkpoints = StageCheckpoints(run_dir)
+    assert checkpoints.resumed
+    assert not checkpoints.should_run("export", [input_path], [output_path])
+    assert checkpoints.should_run("publication", [output_path], [])
+
+    # Sortie modifiée ou entrée modifiée : l'étape est à nouveau exécutée
+    output_path.write_text("uid\n1\n")
+    assert checkpoints.should_run("export", [input_path], [output_path])
+    output_path.write_text("uid\n1\n2\n")
+    checkpoints.done("export")
+    assert not checkpoints.should_run("export", [input_path], [output_path])
+    pl.DataFrame({"uid": ["1", "3"]}).write_parquet(input_path)
+    assert checkpoints.should_run("export", [input_path], [output_path])
+
+    # Le hash d'un parquet ne dépend que de son contenu
+    copy_path = tmp_path / "copie.parquet"
+    pl.DataFrame({"uid": ["1", "3"]}).write_parquet(copy_path)
+    assert file_hash(copy_path) == file_hash(input_path)
+    assert file_hash(tmp_path / "absent.parquet") is None
+
+    (tmp_path / "runs" / "2025-12-31").mkdir()
+    checkpoints.remove_previous_runs()
+    assert [p.name for p in (tmp_path / "runs").iterdir()] == ["2026-01-01"]
@@ -1,14 +1,21 @@
 import datetime
+import inspect
 
 import polars as pl
+from polars import selectors as cs
 
+import src.tasks.clean
+import src.tasks.dates
 from src.config import DecpFormat
 from src.schemas import SCHEMA_MARCHE_2019, SCHEMA_MARCHE_2022
 from src.tasks.clean import (
+    CleaningPlanBuilder,
     clean_decp,
     clean_invalid_characters,
     clean_null_equivalent,
     clean_titulaires,
+    cleaning_fingerprint,
+    cleaning_plan,
     extract_innermost_struct,
     fix_data_types,
 )
@@ -293,3 +300,67 @@ def test_clean_decp():
 
     # Check codeCPV
     assert df_result["codeCPV"].to_list() == ["12345678", "87654100"]
+
+
+def test_cleaning_plan_builder():
+    """Les with_columns indépendants sont fusionnés, pas ceux qui lisent une colonne produite
+    dans la même projection."""
+    lf = pl.LazyFrame({"a": [" x "], "b": [" y "]})
+    builder = CleaningPlanBuilder(lf.collect_schema())
+    builder.with_columns(pl.col("a").str.strip_chars())
+    builder.with_columns(pl.col("b").str.strip_chars())
+    builder.with_columns((pl.col("a") + pl.col("b")).alias("ab"))
+    builder.with_columns(pl.col(pl.String).str.to_uppercase().name.keep())
+    plan = builder.build("test", 0.0)
+
+    assert plan.projections == 3
+    assert plan.requested_projections == 4
+    assert builder.collect_schema().names() == ["a", "b", "ab"]
+    assert plan.apply(lf).collect().row(0) == ("X", "Y", "XY")
+
+
+def test_cleaning_plan_builder_selector():
+    """Un sélecteur commence une nouvelle projection : il voit les colonnes produites par
+    les with_columns précédents (ici la conversion de "n" en texte), même s'il n'écrit
+    aucune de ces colonnes."""
+    lf = pl.LazyFrame({"a": ["x"], "n": [1]})
+    builder = CleaningPlanBuilder(lf.collect_schema())
+    builder.with_columns(pl.col("n").cast(pl.String))
+    builder.with_columns(cs.string().str.len_chars().name.suffix("_len"))
+    builder.with_columns(pl.col("a").str.to_uppercase())
+    plan = builder.build("test", 0.0)
+
+    assert plan.projections == 2
+    assert builder.collect_schema().names() == ["a", "n", "a_len", "n_len"]
+    assert plan.apply(lf).collect().row(0) == ("X", "1", 1, 1)
+
+
+def test_cleaning_plan_reused():
+    """Un seul plan par format et schéma d'entrée."""
+    schema = {"id": pl.String, "acheteur_id": pl.String, "sourceFile": pl.String}
+    schema |= SCHEMA_MARCHE_2022
+    decp_format_2022 = DecpFormat("DECP 2022", SCHEMA_MARCHE_2022, "marches")
+    lf = pl.LazyFrame(schema=schema)
+
+    plan = cleaning_plan(decp_format_2022, lf.collect_schema())
+    assert cleaning_plan(decp_format_2022, lf.collect_schema()) is plan
+    assert plan.depth < plan.unfused_depth
+
+
+def test_cleaning_fingerprint_modules(monkeypatch):
+    """L'empreinte change avec le code de tous les modules utilisés par le nettoyage."""
+    cleaning_fingerprint.cache_clear()
+    fingerprint = cleaning_fingerprint()
+    getsource = inspect.getsource
+
+    def modified_getsource(module):
+        source = getsource(module)
+        return source + "# modifié" if module is src.tasks.dates else source
+
+    monkeypatch.setattr(src.tasks.clean.inspect, "getsource", modified_getsource)
+    cleaning_fingerprint.cache_clear()
+    assert cleaning_fingerprint() != fingerprint
+
+    monkeypatch.undo()
+    cleaning_fingerprint.cache_clear()
+    assert cleaning_fingerprint() == fingerprint
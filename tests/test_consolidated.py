@@ -0,0 +1,114 @@
+import datetime
+
+import polars as pl
+import pytest
+
+import src.tasks.transform
+import src.tasks.utils
+from src.tasks.consolidated import build_consolidated
+
+
+@pytest.fixture(autouse=True)
+def no_manifest(tmp_path, monkeypatch):
+    # Les parquet de test ne sont pas dans le manifeste du cache
+    monkeypatch.setattr(src.tasks.transform, "row_counts", lambda: {})
+    # Fichiers intermédiaires et statistiques de doublons hors de DATA_DIR et DIST_DIR
+    monkeypatch.setattr(src.tasks.transform, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(src.tasks.utils, "DIST_DIR", tmp_path)
+
+
+def write_resource(path, uids: list[str], montant: int):
+    pl.DataFrame(
+        {
+            "uid": uids,
+            "titulaire_id": ["12345678900011"] * len(uids),
+            "titulaire_typeIdentifiant": ["SIRET"] * len(uids),
+            "dateNotification": [datetime.date(2024, 1, 1)] * len(uids),
+            "montant": [montant] * len(uids),
+            "sourceDataset": [path.stem[0]] * len(uids),
+        }
+    ).write_parquet(path)
+    return path
+
+
+def test_build_consolidated_incremental(tmp_path):
+    """Seuls les uid des ressources nouvelles, modifiées ou retirées sont à nouveau
+    consolidés et enrichis, et le résultat est celui d'une construction complète."""
+    enriched_uids = []
+
+    def enrich(lf):
+        enriched_uids.append(sorted(lf.collect()["uid"]))
+        return lf.with_columns(pl.lit(True).alias("enrichi")), tmp_path / "latlong"
+
+    consolidated_dir = tmp_path / "consolidated"
+    files = [
+        write_resource(tmp_path / "a1.parquet", ["1", "2"], 10),
+        write_resource(tmp_path / "b1.parquet", ["2", "3"], 10),
+        write_resource(tmp_path / "c1.parquet", ["4"], 10),
+    ]
+    build_consolidated(files, enrich, consolidated_dir)
+    assert enriched_uids[-1] == ["1", "2", "3", "4"]
+
+    # b1 modifiée (b2), c1 retirée, d1 ajoutée
+    files = [
+        files[0],
+        write_resource(tmp_path / "b2.parquet", ["3"], 20),
+        write_resource(tmp_path / "d1.parquet", ["5"], 10),
+    ]
+    lf, _ = build_consolidated(files, enrich, consolidated_dir)
+    # L'uid 2 de b1 est toujours dans a1, l'uid 4 n'existe plus
+    assert enriched_uids[-1] == ["2", "3", "5"]
+
+    incremental = lf.collect().sort("uid")
+    assert incremental.select("uid", "montant", "enrichi").rows() == [
+        ("1", 10, True),
+        ("2", 10, True),
+        ("3", 20, True),
+        ("5", 10, True),
+    ]
+
+    # Sans modification, rien n'est à nouveau enrichi
+    build_consolidated(files, enrich, consolidated_dir)
+    assert enriched_uids[-1] == []
+
+    full, _ = build_consolidated(files, enrich, tmp_path / "complet")
+    assert full.collect().sort("uid").equals(incremental)
+
+
+def test_build_consolidated_applies_new_coordinates(tmp_path):
+    """Les SIRET géocodés après l'enrichissement d'un uid sont appliqués à ses lignes
+    conservées par la construction incrémentale."""
+    latlong_path = tmp_path / "siret_latlong.parquet"
+
+    def write_latlong(latitude):
+        pl.DataFrame(
+            {
+                "siret": ["12345678900011"],
+                "latitude": [latitude],
+                "longitude": [2.0],
+                "status": ["success" if latitude is not None else "failed"],
+            }
+        ).write_parquet(latlong_path)
+
+    def enrich(lf):
+        return lf.with_columns(
+            acheteur_id=pl.lit("98765432100011"),
+            acheteur_latitude=pl.lit(48.0),
+            acheteur_longitude=pl.lit(2.0),
+            titulaire_latitude=pl.lit(None, pl.Float64),
+            titulaire_longitude=pl.lit(None, pl.Float64),
+            titulaire_distance=pl.lit(None, pl.Int16),
+        ), latlong_path
+
+    consolidated_dir = tmp_path / "consolidated"
+    files = [write_resource(tmp_path / "a1.parquet", ["1"], 10)]
+    write_latlong(None)
+    lf, _ = build_consolidated(files, enrich, consolidated_dir)
+    assert lf.collect()["titulaire_distance"].to_list() == [None]
+
+    # Géocodage du titulaire lors d'une exécution suivante, sans ressource modifiée
+    write_latlong(49.0)
+    lf, _ = build_consolidated(files, enrich, consolidated_dir)
+    df = lf.collect()
+    assert df.select("titulaire_latitude", "titulaire_longitude").row(0) == (49.0, 2.0)
+    assert df["titulaire_distance"].to_list() == [111]
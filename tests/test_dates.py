@@ -0,0 +1,55 @@
+import datetime
+
+import polars as pl
+
+from src.tasks.dates import date_parsing_counts, parse_date
+
+
+def test_parse_date():
+    values = {
+        "2023-01-01": datetime.date(2023, 1, 1),
+        " 2023-01-02 ": datetime.date(2023, 1, 2),
+        "2023-01-03T10:00:00": datetime.date(2023, 1, 3),
+        "2023-01-04+02:00": datetime.date(2023, 1, 4),
+        "2023-01-05-05:00": datetime.date(2023, 1, 5),
+        "2023-01-06Z": datetime.date(2023, 1, 6),
+        "2023-01-07 10:00:00+01:00": datetime.date(2023, 1, 7),
+        # Formats et corrections de reference/date_corrections.json
+        "September, 16 2021 00:00:00": datetime.date(2021, 9, 16),
+        "16/09/2021": datetime.date(2021, 9, 16),
+        "0222-04-29": datetime.date(2022, 4, 29),
+        "0222-04-29T00:00:00+02:00": datetime.date(2022, 4, 29),
+        "0002-11-30": None,
+        "2023-13-01": None,
+        "2023-01-01abc": None,
+        "invalid-date": None,
+        None: None,
+    }
+    df = pl.DataFrame({"dateNotification": list(values)})
+
+    result = df.select(parse_date("dateNotification"))
+
+    assert result["dateNotification"].dtype == pl.Date
+    assert result["dateNotification"].to_list() == list(values.values())
+
+
+def test_date_parsing_counts():
+    lf = pl.LazyFrame(
+        {
+            "resource_checksum": ["a", "a", "a", "b"],
+            "dateNotification": ["2023-01-01", "0002-11-30", "", "2023-01-01"],
+            "datePublicationDonnees": ["2023-01-02", "NC", None, "invalid-date"],
+        }
+    )
+    columns = ["dateNotification", "datePublicationDonnees"]
+
+    assert date_parsing_counts(lf, columns).collect().row(0, named=True) == {
+        "parsed": 3,
+        "rejected": 2,
+    }
+    by_resource = (
+        date_parsing_counts(lf, columns, by=["resource_checksum"])
+        .collect()
+        .sort("resource_checksum")
+    )
+    assert by_resource.rows() == [("a", 2, 1), ("b", 1, 1)]
@@ -0,0 +1,66 @@
+import asyncio
+from collections import Counter
+from pathlib import Path
+
+import httpx
+
+import src.tasks.download
+from src.tasks.download import DownloadPipeline
+from src.tasks.get import stream_get
+
+
+def test_download_pipeline(tmp_path, monkeypatch):
+    """Les ressources sont téléchargées en parallèle, dans la limite de connexions par
+    hôte, et transmises une fois téléchargées. Le nombre de fichiers téléchargés en
+    attente de traitement est limité."""
+    content = Path("tests/data/decp_test_2019.json").read_bytes()
+    connections = Counter()
+    max_connections = Counter()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        if host == "www.data.gouv.fr":
+            # Redirection vers l'hôte du fichier
+            return httpx.Response(
+                302, headers={"Location": f"https://static.test{request.url.path}"}
+            )
+        connections[host] += 1
+        max_connections[host] = max(max_connections[host], connections[host])
+        await asyncio.sleep(0.05)
+        connections[host] -= 1
+        return httpx.Response(200, content=content, headers={"ETag": '"v1"'})
+
+    monkeypatch.setattr(src.tasks.download, "ASYNC_DOWNLOAD", True)
+    monkeypatch.setattr(src.tasks.download, "DOWNLOAD_DIR", tmp_path)
+    monkeypatch.setattr(src.tasks.download, "DOWNLOAD_MAX_CONNECTIONS_PER_HOST", 2)
+    monkeypatch.setattr(src.tasks.download, "DOWNLOAD_QUEUE_SIZE", 3)
+
+    resources = [
+        {
+            "dataset_name": "Dataset de test",
+            "ori_filename": f"decp_{i}.json",
+            "checksum": f"ressource-{i}",
+            "filename": f"test_dataset_decp_{i}",
+            "url": f"https://www.data.gouv.fr/api/1/datasets/r/{i}",
+        }
+        for i in range(8)
+    ] + [{"url": "tests/data/decp_test_2019.json", "checksum": "local"}]
+
+    pipeline = DownloadPipeline(
+        resources, set(), transport=httpx.MockTransport(handler)
+    )
+    ready = []
+    for resource in pipeline:
+        assert len(list(tmp_path.iterdir())) <= 3
+        if resource["url"].startswith("http"):
+            assert resource["http_validators"]["etag"] == '"v1"'
+            # Le worker lit le fichier téléchargé, sans requête HTTP
+            assert b"".join(stream_get(resource["url"], resource=resource)) == content
+        ready.append(resource["checksum"])
+        pipeline.done(resource)
+
+    # La ressource locale n'est pas téléchargée : elle est transmise en premier
+    assert ready[0] == "local"
+    assert sorted(ready[1:]) == [f"ressource-{i}" for i in range(8)]
+    assert max_connections["static.test"] == 2
+    assert list(tmp_path.iterdir()) == []
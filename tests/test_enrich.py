@@ -6,6 +6,7 @@ import polars as pl
 from polars.testing import assert_frame_equal
 
 from src.config import BASE_DIR
+from src.schemas import SCHEMA_LOW_CARDINALITY
 from src.tasks.enrich import (
     add_etablissement_data,
     add_type_marche,
@@ -29,7 +30,10 @@ class TestEnrich:
                 "titulaire_nom": ["Org 1", "Org 2"],
                 "titulaire_siren": ["123456789", "123456790"],
                 "titulaire_categorie": ["ETI", None],
-            }
+            },
+            schema_overrides={
+                "titulaire_categorie": SCHEMA_LOW_CARDINALITY["titulaire_categorie"]
+            },
         )
 
         assert_frame_equal(
@@ -55,7 +59,10 @@ class TestEnrich:
                 "acheteur_nom": ["Org 1", "Org 2", "Collectivité de Corse"],
                 "acheteur_siren": ["123456789", "123456790", "200076958"],
                 "acheteur_categorie": [None, "Région", "Région"],
-            }
+            },
+            schema_overrides={
+                "acheteur_categorie": SCHEMA_LOW_CARDINALITY["acheteur_categorie"]
+            },
         )
 
         assert_frame_equal(
@@ -283,7 +290,8 @@ class TestEnrich:
                 "uid": ["1", "2", "3", "4"],
                 "codeCPV": ["1581791-1", "4587554-2", "4876655-5", "618765-3"],
                 "type": ["Fournitures", "Travaux", "Fournitures", "Services"],
-            }
+            },
+            schema_overrides={"type": SCHEMA_LOW_CARDINALITY["type"]},
         )
 
         assert_frame_equal(
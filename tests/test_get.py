@@ -1,11 +1,20 @@
 import polars as pl
+import pytest
+from lxml import etree
 
+import src.tasks.get
 from src.config import SIRET_LATLONG_SCHEMA
+from src.schemas import SCHEMA_MARCHE_2022
 from src.tasks.get import (
+    IJSON_BACKEND,
     bootstrap_siret_latlong,
     get_etablissements,
+    json_stream_to_parquet,
+    schema_projection,
     xml_stream_to_parquet,
+    yield_modifications,
 )
+from src.tasks.utils import FieldCensus
 
 REQUIRED_GEO_COLUMNS = {
     "numeroVoieEtablissement",
@@ -43,7 +52,7 @@ def test_xml_stream_to_parquet_small_file_is_not_empty(tmp_path):
     xml_path.write_bytes(xml)
 
     output_path = tmp_path / "out"
-    xml_stream_to_parquet(str(xml_path), output_path, fix_chars=False)
+    xml_stream_to_parquet(str(xml_path), output_path, {})
 
     df = pl.read_parquet(output_path.with_suffix(".parquet"))
     assert df.height == 1
@@ -52,6 +61,126 @@ def test_xml_stream_to_parquet_small_file_is_not_empty(tmp_path):
     assert df["nature"].to_list() == ["Marché"]
 
 
+def test_xml_stream_to_parquet_control_characters(tmp_path):
+    """Les caractères de contrôle sont supprimés en un seul passage, sans échec du parsing."""
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        "<marches>\n"
+        " <marche><id>1</id><objet>Entretien\x02 des espaces verts</objet>\n"
+        "  <titulaires><titulaire><id>123</id></titulaire></titulaires>\n"
+        "  <techniques><technique>Accord-cadre</technique>"
+        "<technique>Concours</technique></techniques>\n"
+        " </marche>\n"
+        " <marche><id>2</id><objet>Réfection\x1f de la toiture</objet></marche>\n"
+        "</marches>\n"
+    ).encode("utf-8")
+    xml_path = tmp_path / "decp_control.xml"
+    xml_path.write_bytes(xml)
+
+    resource = {}
+    xml_stream_to_parquet(str(xml_path), tmp_path / "out", resource)
+
+    df = pl.read_parquet(tmp_path / "out.parquet")
+    assert resource["replacements"] == {"control_characters": 2}
+    assert df["objet"].to_list() == [
+        "Entretien des espaces verts",
+        "Réfection de la toiture",
+    ]
+    assert df["titulaires"].to_list() == [
+        [{"titulaire": {"typeIdentifiant": None, "id": "123"}}],
+        None,
+    ]
+    assert df["techniques_technique"].to_list() == [["Accord-cadre", "Concours"], None]
+
+
+def test_xml_stream_to_parquet_syntax_error(tmp_path):
+    """Un marché mal formé fait échouer la ressource, sans parquet partiel."""
+    xml = (
+        b"<marches>\n"
+        b" <marche><id>1</id></marche>\n"
+        b" <marche><id>2</id><montant>3</marche>\n"
+        b"</marches>\n"
+    )
+    xml_path = tmp_path / "decp_invalide.xml"
+    xml_path.write_bytes(xml)
+
+    with pytest.raises(etree.XMLSyntaxError):
+        xml_stream_to_parquet(str(xml_path), tmp_path / "out", {})
+    assert list(tmp_path.glob("out*")) == []
+
+
+def test_yield_modifications_schema_projection():
+    """Seules les colonnes du schéma sont aplaties, mais tous les champs sont recensés."""
+    marche = {
+        "id": "1",
+        "montant": 1000,
+        "lieuExecution": {"code": "75056", "typeCode": "Code commune"},
+        "lieuExecution_code": "écrasé par lieuExecution.code",
+        "actesSousTraitance": [{"acteSousTraitance": {"id": 1}}],
+        "donneesExecution": {"datePublication": "2024-01-01", "tarifs": {"n": 2}},
+        "objet": "",
+        "modifications": [{"montant": 2000, "objetModification": "Avenant"}],
+    }
+    projection = schema_projection(tuple(SCHEMA_MARCHE_2022))
+    census = FieldCensus()
+    rows = list(yield_modifications(marche, projection, census))
+
+    assert rows == [
+        {
+            "id": "1",
+            "montant": 1000,
+            "objet": "",
+            "lieuExecution_code": "75056",
+            "lieuExecution_typeCode": "Code commune",
+        },
+        {
+            "id": "1",
+            "montant": 1000,
+            "objet": "",
+            "lieuExecution_code": "75056",
+            "lieuExecution_typeCode": "Code commune",
+            "modification_montant": 2000,
+        },
+    ]
+    assert census.marches == 1
+    assert census.modifications == 1
+    assert census.fill_rates() == {
+        "actesSousTraitance": 1.0,
+        "donneesExecution_datePublication": 1.0,
+        "donneesExecution_tarifs_n": 1.0,
+        "id": 1.0,
+        "lieuExecution_code": 1.0,
+        "lieuExecution_typeCode": 1.0,
+        "modification_montant": 1.0,
+        "modification_objetModification": 1.0,
+        "montant": 1.0,
+        "objet": 0.0,
+    }
+
+
+def test_json_stream_to_parquet_parser_selection(tmp_path, monkeypatch):
+    """Les petites ressources sont parsées en entier (orjson), les grosses en flux
+    (ijson), avec le même résultat."""
+    url = "tests/data/decp_test_2019.json"
+
+    small_resource = {"filesize": 1000, "dataset_name": "test", "ori_filename": url}
+    census_small, format_small = json_stream_to_parquet(
+        url, tmp_path / "small", small_resource
+    )
+    assert small_resource["parser"] == "orjson"
+
+    monkeypatch.setattr(src.tasks.get, "JSON_WHOLE_DOCUMENT_MAX_SIZE", 0)
+    big_resource = {"filesize": 1000, "dataset_name": "test", "ori_filename": url}
+    census_big, format_big = json_stream_to_parquet(url, tmp_path / "big", big_resource)
+    assert big_resource["parser"] == f"ijson ({IJSON_BACKEND.backend_name})"
+
+    assert format_small.label == format_big.label == "DECP 2019"
+    assert census_small.fill_rates() == census_big.fill_rates()
+    assert pl.read_parquet(tmp_path / "small.parquet").equals(
+        pl.read_parquet(tmp_path / "big.parquet")
+    )
+
+
 def test_bootstrap_siret_latlong_produces_extended_schema(tmp_path, monkeypatch):
     fake_decp = tmp_path / "decp_fake.parquet"
     pl.DataFrame(
@@ -1,9 +1,42 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
 
+import polars as pl
 import pytest
 from prefect.testing.utilities import prefect_test_harness
 
-from src.flows.decp_processing import decp_processing
+import src.tasks.cache_manifest
+import src.tasks.cache_policy
+import src.tasks.get
+import src.tasks.profiling
+import src.tasks.tracing
+from src.flows.decp_processing import decp_processing, make_executor
+from src.tasks.get import get_clean_in_worker
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    """Cache des ressources, profils et traces dans tmp_path plutôt que dans DATA_DIR."""
+    # Les workers du mode "process" importent à nouveau src.config
+    monkeypatch.setenv("DECP_DATA_DIR", str(tmp_path))
+    monkeypatch.delenv("RESOURCE_CACHE_DIR", raising=False)
+    (tmp_path / "resource_cache").mkdir()
+    for module in [src.tasks.get, src.tasks.cache_policy]:
+        monkeypatch.setattr(module, "RESOURCE_CACHE_DIR", tmp_path / "resource_cache")
+        monkeypatch.setattr(module, "GET_DIR", tmp_path / "get")
+    monkeypatch.setattr(src.tasks.cache_manifest, "GET_DIR", tmp_path / "get")
+    monkeypatch.setattr(
+        src.tasks.cache_manifest,
+        "CACHE_MANIFEST_PATH",
+        tmp_path / "resource_cache" / "manifest.sqlite",
+    )
+    monkeypatch.setattr(
+        src.tasks.profiling,
+        "RESOURCE_PROFILES_DB_PATH",
+        tmp_path / "resource_profiles.sqlite",
+    )
+    monkeypatch.setattr(src.tasks.tracing, "TRACES_DIR", tmp_path / "traces")
+    return tmp_path
 
 
 @pytest.fixture(autouse=False, scope="function")
@@ -32,3 +65,34 @@ def prefect_test_fixture(tmp_path_factory):
 
 def test_decp_processing(prefect_test_fixture):
     decp_processing()
+
+
+def test_make_executor_process_mode(monkeypatch):
+    """En mode "process", get_clean tourne dans un processus séparé et renvoie le
+    chemin du parquet en cache ainsi que les lignes d'artifact de la ressource."""
+    monkeypatch.setattr("src.flows.decp_processing.RESOURCE_EXECUTOR", "process")
+    resource = {
+        "dataset_id": "test_dataset",
+        "dataset_name": "Dataset de test",
+        "dataset_code": "test_dataset",
+        "id": "decp_2019",
+        "ori_filename": "decp_2019.json",
+        "checksum": "test_make_executor_process_mode",
+        "filename": "test_dataset_decp_2019_process",
+        "url": "./tests/data/decp_test_2019.json",
+        "format": "json",
+        "created_at": "2025-07-08T18:00:00Z",
+        "last_modified": "2025-07-08T19:00:00Z",
+        "filesize": 3076,
+        "views": 10,
+    }
+
+    with make_executor(set()) as executor:
+        assert isinstance(executor, ProcessPoolExecutor)
+        parquet_path, artifact_rows = executor.submit(
+            get_clean_in_worker, resource
+        ).result()
+
+    assert pl.read_parquet(parquet_path).height > 0
+    # Pas d'artifact quand la publication est désactivée
+    assert artifact_rows == []
@@ -0,0 +1,94 @@
+import json
+
+import polars as pl
+
+import src.tasks.output
+from src.schemas import SCHEMA_LOW_CARDINALITY, SCHEMA_MARCHE_2022
+from src.tasks.output import ParquetRowWriter, generate_final_schema
+
+
+def test_parquet_row_writer_matches_scan_ndjson(tmp_path):
+    """Les valeurs sont converties comme le faisait pl.scan_ndjson(schema=...)."""
+    rows = [
+        {
+            "id": "1",
+            "montant": 137614.0,
+            "tauxAvance": 0.1,
+            "offresRecues": 3,
+            "attributionAvance": True,
+            "titulaires": [
+                {"titulaire": {"typeIdentifiant": "SIRET", "id": 12345678900023}}
+            ],
+            "techniques_technique": ["Accord-cadre"],
+            "champ_hors_schema": "ignoré",
+        },
+        {"id": "2", "montant": 1e20},
+    ]
+    with ParquetRowWriter(tmp_path / "rows", SCHEMA_MARCHE_2022) as writer:
+        for row in rows:
+            writer.write_row(row)
+
+    df = pl.read_parquet(tmp_path / "rows.parquet")
+    assert writer.row_count == 2
+    assert df.columns == list(SCHEMA_MARCHE_2022.keys())
+    assert df["montant"].to_list() == ["137614", "100000000000000000000"]
+    assert df["tauxAvance"].to_list() == ["0.1", None]
+    assert df["offresRecues"].to_list() == ["3", None]
+    assert df["attributionAvance"].to_list() == ["true", None]
+    assert df["titulaires"][0].to_list() == [
+        {"titulaire": {"typeIdentifiant": "SIRET", "id": "12345678900023"}}
+    ]
+    assert df["techniques_technique"].to_list() == [["Accord-cadre"], None]
+
+
+def test_parquet_row_writer_malformed_values(tmp_path):
+    """Une valeur de structure inattendue devient null au lieu de faire échouer la ressource."""
+    rows = [
+        {
+            "id": "1",
+            "titulaires": [{"titulaire": "typeIdentifiant"}],
+            "techniques_technique": "Accord-cadre",
+        }
+    ]
+    with ParquetRowWriter(
+        tmp_path / "rows", SCHEMA_MARCHE_2022, row_group_size=1
+    ) as writer:
+        for row in rows:
+            writer.write_row(row)
+
+    df = pl.read_parquet(tmp_path / "rows.parquet")
+    assert df["titulaires"][0].to_list() == [{"titulaire": None}]
+    assert df["techniques_technique"].to_list() == [None]
+
+
+def test_parquet_row_writer_empty(tmp_path):
+    with ParquetRowWriter(tmp_path / "empty", SCHEMA_MARCHE_2022):
+        pass
+
+    df = pl.read_parquet(tmp_path / "empty.parquet")
+    assert df.height == 0
+    assert df.schema == pl.Schema(SCHEMA_MARCHE_2022)
+
+
+def test_generate_final_schema(tmp_path, monkeypatch):
+    monkeypatch.setattr(src.tasks.output, "DIST_DIR", tmp_path)
+    lf = pl.LazyFrame(
+        schema={
+            "uid": pl.String,
+            "montant": pl.Float64,
+            "procedure": pl.Categorical,
+            "type": SCHEMA_LOW_CARDINALITY["type"],
+        }
+    )
+
+    generate_final_schema(lf)
+
+    with open(tmp_path / "schema.json") as f:
+        fields = {field["name"]: field for field in json.load(f)["fields"]}
+    assert fields["procedure"]["type"] == "string"
+    assert fields["type"]["type"] == "string"
+    assert fields["type"]["constraints"] == {
+        "enum": SCHEMA_LOW_CARDINALITY["type"].categories.to_list()
+    }
+    assert "constraints" not in fields["procedure"]
+    assert fields["montant"]["type"] == "number"
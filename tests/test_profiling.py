@@ -0,0 +1,71 @@
+import time
+
+import src.tasks.profiling as profiling
+from src.tasks.profiling import add_phase_time, profile_report, profiled, record_profile
+
+
+def test_profiled_excludes_inner_phase():
+    """Le temps d'un itérateur enveloppé n'est compté que dans sa propre phase."""
+    resource = {}
+
+    def slow_download():
+        for chunk in [b"a", b"b"]:
+            time.sleep(0.02)
+            yield chunk
+
+    def rewrite(chunks):
+        for chunk in chunks:
+            yield chunk.upper()
+
+    chunks = profiled(
+        rewrite(profiled(slow_download(), resource, "download")),
+        resource,
+        "rewrite",
+        inner="download",
+    )
+    assert list(chunks) == [b"A", b"B"]
+    assert resource["phases"]["download"] >= 0.04
+    assert resource["phases"]["rewrite"] < 0.02
+
+
+def test_profile_report_ranks_resources(tmp_path, monkeypatch):
+    """Classement des ressources par coût, avec l'évolution par rapport aux exécutions
+    précédentes."""
+    monkeypatch.setattr(
+        profiling, "RESOURCE_PROFILES_DB_PATH", tmp_path / "profiles.sqlite"
+    )
+
+    def resource(resource_id, **phases):
+        r = {
+            "id": resource_id,
+            "dataset_code": "dataset",
+            "ori_filename": f"{resource_id}.json",
+            "filesize": 2 * 1024**2,
+            "parser": "ijson",
+        }
+        for phase, seconds in phases.items():
+            add_phase_time(r, phase, seconds)
+        return r
+
+    for run_date, seconds in [("2026-01-01", 10.0), ("2026-01-02", 20.0)]:
+        monkeypatch.setattr(profiling, "DATE_NOW", run_date)
+        r = resource("lente", download=seconds / 2, clean=seconds / 2)
+        record_profile(r, sum(r["phases"].values()))
+
+    monkeypatch.setattr(profiling, "DATE_NOW", "2026-01-03")
+    for r in [
+        resource("lente", download=10.0, parse=20.0),
+        resource("rapide", parse=1.0),
+        resource("moyenne", parse=5.0),
+    ]:
+        record_profile(r, sum(r["phases"].values()))
+
+    report = profile_report(2, run_date="2026-01-03")
+    assert [row["resource_id"] for row in report] == ["lente", "moyenne"]
+    assert report[0]["download_s"] == 10.0
+    assert report[0]["parse_s"] == 20.0
+    assert report[0]["clean_s"] == 0.0
+    # 30 s contre 15 s en moyenne lors des exécutions précédentes
+    assert report[0]["evolution"] == "+100%"
+    assert report[1]["evolution"] == "nouveau"
+    assert report[0]["filesize_mb"] == 2.0
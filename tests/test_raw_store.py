@@ -0,0 +1,79 @@
+import hashlib
+import os
+
+import pytest
+
+import src.tasks.raw_store
+from src.tasks.get import stream_get
+from src.tasks.raw_store import evict_raw_store, raw_store_path, read_raw, store_raw
+
+
+@pytest.fixture(autouse=True)
+def raw_store_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(src.tasks.raw_store, "RAW_STORE_DIR", tmp_path)
+    # Stockage désactivé par défaut
+    monkeypatch.setattr(src.tasks.raw_store, "RAW_STORE_MAX_SIZE_MB", 10_000)
+    return tmp_path
+
+
+def test_store_and_read_raw():
+    chunks = [b'{"marches": ', b"[]}"]
+    checksum = hashlib.sha1(b"".join(chunks)).hexdigest()
+
+    assert read_raw(checksum, 1024) is None
+    assert list(store_raw(iter(chunks), checksum)) == chunks
+    assert b"".join(read_raw(checksum, 1024)) == b"".join(chunks)
+    # Aucun fichier temporaire ne subsiste
+    assert [p.name for p in raw_store_path(checksum).parent.iterdir()] == [
+        f"{checksum}.zst"
+    ]
+
+
+def test_store_raw_checksum_mismatch_or_partial_read():
+    chunks = [b"abc", b"def"]
+    checksum = hashlib.sha1(b"autre contenu").hexdigest()
+    assert list(store_raw(iter(chunks), checksum)) == chunks
+    assert read_raw(checksum, 1024) is None
+
+    # Flux interrompu : rien n'est stocké
+    checksum = hashlib.sha1(b"abcdef").hexdigest()
+    stream = store_raw(iter(chunks), checksum)
+    next(stream)
+    stream.close()
+    assert read_raw(checksum, 1024) is None
+    assert list(raw_store_path(checksum).parent.iterdir()) == []
+
+    # Identifiant de ressource à la place du checksum : pas de stockage
+    resource_id = "bb90091c-f0cb-4a59-ad41-b0ab929aad93"
+    assert list(store_raw(iter(chunks), resource_id)) == chunks
+    assert read_raw(resource_id, 1024) is None
+
+
+def test_raw_store_eviction(monkeypatch):
+    monkeypatch.setattr(src.tasks.raw_store, "RAW_STORE_MAX_SIZE_MB", 1)
+    checksums = []
+    for i in range(3):
+        # Données aléatoires, incompressibles
+        data = os.urandom(400 * 1024)
+        checksum = hashlib.sha256(data).hexdigest()
+        list(store_raw(iter([data]), checksum))
+        checksums.append(checksum)
+        os.utime(raw_store_path(checksum), (i, i))
+        if i == 1:
+            # La première ressource est relue : c'est la seconde qui sera supprimée
+            read_raw(checksums[0], 1024)
+    evict_raw_store()
+
+    assert read_raw(checksums[0], 1024) is not None
+    assert read_raw(checksums[1], 1024) is None
+    assert read_raw(checksums[2], 1024) is not None
+
+
+def test_stream_get_reads_from_raw_store():
+    data = b'{"marches": []}'
+    checksum = hashlib.md5(data).hexdigest()
+    list(store_raw(iter([data]), checksum))
+
+    # Pas de requête HTTP : l'URL n'existe pas
+    url = "https://decp.invalid/ressource.json"
+    assert b"".join(stream_get(url, resource={"checksum": checksum})) == data
@@ -0,0 +1,77 @@
+from pathlib import Path
+
+import httpx
+import polars as pl
+
+import src.tasks.cache_manifest
+import src.tasks.get
+import src.tasks.profiling
+import src.tasks.revalidation
+from src.tasks.get import get_clean
+
+
+def test_get_clean_revalidates_resource_without_checksum(tmp_path, monkeypatch):
+    """Une ressource sans checksum data.gouv.fr n'est retéléchargée et retraitée que
+    si elle a changé (requête conditionnelle, réponse 304 sinon)."""
+    content = Path("tests/data/decp_test_2019.json").read_bytes()
+    server = {"etag": '"v1"', "requests": []}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        server["requests"].append(request)
+        if request.headers.get("If-None-Match") == server["etag"]:
+            return httpx.Response(304)
+        return httpx.Response(200, content=content, headers={"ETag": server["etag"]})
+
+    monkeypatch.setattr(
+        src.tasks.get,
+        "HTTP_CLIENT",
+        httpx.Client(transport=httpx.MockTransport(handler)),
+    )
+    monkeypatch.setattr(src.tasks.get, "DECP_USE_CACHE", True)
+    monkeypatch.setattr(src.tasks.get, "RESOURCE_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(src.tasks.get, "GET_DIR", tmp_path / "get")
+    monkeypatch.setattr(src.tasks.cache_manifest, "GET_DIR", tmp_path / "get")
+    monkeypatch.setattr(
+        src.tasks.profiling, "RESOURCE_PROFILES_DB_PATH", tmp_path / "profiles.sqlite"
+    )
+    monkeypatch.setattr(
+        src.tasks.revalidation, "REVALIDATION_DB_PATH", tmp_path / "revalidation.sqlite"
+    )
+    monkeypatch.setattr(
+        src.tasks.cache_manifest, "CACHE_MANIFEST_PATH", tmp_path / "manifest.sqlite"
+    )
+
+    resource_id = "8c1b8e8a-1c34-4f6c-9a43-000000000001"
+    resource = {
+        "dataset_id": "test_dataset",
+        "dataset_name": "Dataset de test",
+        "dataset_code": "test_dataset",
+        "id": resource_id,
+        "ori_filename": "decp_2019.json",
+        # Pas de checksum : list_resources utilise l'identifiant de la ressource
+        "checksum": resource_id,
+        "filename": "test_dataset_decp_2019_revalidation",
+        "url": "https://decp.test/datasets/r/decp_2019.json",
+        "format": "json",
+        "created_at": "2025-07-08T18:00:00Z",
+        "last_modified": "2025-07-08T19:00:00Z",
+        "filesize": 3076,
+        "views": 10,
+    }
+    parquet_path = tmp_path / f"{resource_id}.parquet"
+
+    # Première récupération
+    assert get_clean(dict(resource), [], set()) == parquet_path
+    assert "If-None-Match" not in server["requests"][-1].headers
+    parquet_path.write_bytes(b"")  # Marqueur : le parquet ne doit pas être réécrit
+
+    # Ressource inchangée : 304, le parquet en cache est réutilisé
+    assert get_clean(dict(resource), [], {parquet_path.name}) == parquet_path
+    assert server["requests"][-1].headers["If-None-Match"] == '"v1"'
+    assert parquet_path.read_bytes() == b""
+
+    # Ressource modifiée : nouveau téléchargement et nouveau parquet
+    server["etag"] = '"v2"'
+    assert get_clean(dict(resource), [], {parquet_path.name}) == parquet_path
+    assert pl.read_parquet(parquet_path).height > 0
+    assert len(server["requests"]) == 3
@@ -0,0 +1,158 @@
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import src.tasks.scheduler
+from src.tasks.scheduler import (
+    MemoryGovernor,
+    ResourceScheduler,
+    estimate_memory,
+)
+
+
+def make_resource(name: str, filesize_mb: int) -> dict:
+    return {"name": name, "format": "xml", "filesize": filesize_mb * 1024**2}
+
+
+def test_scheduler_longest_first_within_memory_budget():
+    """Les plus grosses ressources passent en premier, sans dépasser le budget mémoire
+    (sauf pour une ressource plus grosse que le budget, traitée seule)."""
+    # Triées comme dans decp_processing
+    resources = [
+        make_resource("énorme", 500),
+        make_resource("grosse", 200),
+        make_resource("moyenne", 100),
+        make_resource("moyenne 2", 100),
+        make_resource("petite", 10),
+    ]
+    # XML : 3 x filesize, soit 300 Mo pour "moyenne"
+    scheduler = ResourceScheduler(max_workers=2, governor=MemoryGovernor(700))
+
+    lock = threading.Lock()
+    running = []
+    started = []
+    peaks = []
+
+    def process(resource):
+        with lock:
+            running.append(resource)
+            started.append(resource["name"])
+            peaks.append(sum(estimate_memory(r) for r in running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(resource)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        submit = lambda resource: executor.submit(process, resource)  # noqa: E731
+        futures = [future for _, future in scheduler.run(resources, submit)]
+
+    assert all(future.done() for future in futures)
+    assert sorted(started) == sorted(r["name"] for r in resources)
+    # "moyenne" (300 Mo) ne tient pas dans le budget avec "grosse" (600 Mo) : "petite"
+    # (30 Mo) occupe le worker libre
+    assert started == ["énorme", "grosse", "petite", "moyenne", "moyenne 2"]
+    # "énorme" (1500 Mo) est seule, les autres ne dépassent pas le budget
+    assert peaks[0] == estimate_memory(resources[0])
+    assert max(peaks[1:]) <= 700 * 1024**2
+    assert 0 < scheduler.utilisation <= 1
+
+
+def test_scheduler_keeps_workers_busy():
+    """Pas d'attente de la ressource la plus lente : les workers libres reçoivent les
+    ressources suivantes."""
+    durations = {"lente": 0.3}
+    resources = [make_resource("lente", 100)] + [
+        make_resource(f"rapide {i}", 1) for i in range(6)
+    ]
+    scheduler = ResourceScheduler(max_workers=2, governor=MemoryGovernor(10_000))
+
+    def process(resource):
+        time.sleep(durations.get(resource["name"], 0.05))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        submit = lambda resource: executor.submit(process, resource)  # noqa: E731
+        for _ in scheduler.run(iter(resources), submit):
+            pass
+
+    # Lots de 2 : 0.3 + 3 x 0.05 = 0.45 s. En continu : 0.3 s
+    assert time.perf_counter() - start < 0.4
+    assert scheduler.utilisation > 0.8
+
+
+def test_memory_governor_uses_measured_rss(monkeypatch):
+    """Le dépassement mesuré des estimations compte : les nouvelles ressources attendent,
+    sauf si aucune n'est en cours. La mémoire résidente conservée après la fin d'un
+    traitement ne compte plus."""
+    rss = {"value": 1000 * 1024**2}
+    monkeypatch.setattr(src.tasks.scheduler, "process_rss", lambda: rss["value"])
+    governor = MemoryGovernor(500)
+
+    governor.reserve(100 * 1024**2)
+    assert governor.headroom() == 400 * 1024**2
+    # Les ressources en cours dépassent leur estimation de 350 Mo
+    rss["value"] += 450 * 1024**2
+    assert governor.headroom() == 50 * 1024**2
+
+    scheduler = ResourceScheduler(max_workers=4, governor=governor)
+    scheduler._running = 1
+    scheduler._ready = [(0, 0, make_resource("moyenne", 100))]
+    assert scheduler._next_resource() is None
+    assert governor.throttling
+
+    scheduler._running = 0
+    assert scheduler._next_resource()["name"] == "moyenne"
+
+    # Fin du traitement : la mémoire résidente ne redescend pas, mais le budget est libéré
+    governor.release(100 * 1024**2)
+    assert governor.headroom() == 500 * 1024**2
+    governor.reserve(100 * 1024**2)
+    rss["value"] += 80 * 1024**2
+    assert governor.headroom() == 400 * 1024**2
+
+
+def test_memory_governor_without_budget():
+    """Sans budget (0), seul le nombre de workers limite les traitements simultanés."""
+    governor = MemoryGovernor(0)
+    governor.reserve(100_000 * 1024**2)
+
+    scheduler = ResourceScheduler(max_workers=4, governor=governor)
+    scheduler._running = 1
+    scheduler._ready = [(0, 0, make_resource("grosse", 50_000))]
+    assert scheduler._next_resource()["name"] == "grosse"
+    assert not governor.throttling
+
+
+def test_largest_resource_not_overtaken_forever(monkeypatch):
+    """Une ressource qui ne tient pas dans le budget n'est dépassée que par MAX_OVERTAKES
+    ressources plus petites."""
+    monkeypatch.setattr(src.tasks.scheduler, "process_rss", lambda: 1000 * 1024**2)
+    monkeypatch.setattr(src.tasks.scheduler, "MAX_OVERTAKES", 2)
+    governor = MemoryGovernor(500)
+    governor.reserve(300 * 1024**2)
+
+    scheduler = ResourceScheduler(max_workers=8, governor=governor)
+    scheduler._running = 1
+    scheduler._ready = [(0, 0, make_resource("grosse", 100))] + [
+        (0, i, make_resource(f"petite_{i}", 10)) for i in range(1, 5)
+    ]
+    assert scheduler._next_resource()["name"] == "petite_1"
+    assert scheduler._next_resource()["name"] == "petite_2"
+    assert scheduler._next_resource() is None
+    assert governor.throttling
+
+    # La mémoire libérée lui est réservée
+    governor.release(300 * 1024**2)
+    assert scheduler._next_resource()["name"] == "grosse"
+    assert scheduler._next_resource()["name"] == "petite_3"
+
+
+def test_child_pids():
+    """Les workers du mode "process" sont trouvés sans parcourir tout /proc."""
+    with subprocess.Popen(["sleep", "5"]) as child:
+        try:
+            assert str(child.pid) in src.tasks.scheduler._child_pids(os.getpid())
+        finally:
+            child.kill()
@@ -0,0 +1,48 @@
+import pytest
+
+from src.tasks.sharding import ShardFailed, ShardRun, select_shard, shard_of
+
+
+def test_select_shard_partitions_resources():
+    """Chaque ressource est dans un et un seul shard, toujours le même."""
+    resources = [{"checksum": f"{i:040x}"} for i in range(1000)]
+    shards = [select_shard(resources, i, 4) for i in range(4)]
+    assert sorted(r["checksum"] for shard in shards for r in shard) == sorted(
+        r["checksum"] for r in resources
+    )
+    assert all(150 < len(shard) < 350 for shard in shards)
+    assert shard_of("abc", 4) == shard_of("abc", 4)
+    assert select_shard(resources, 0, 1) == resources
+
+
+def test_shard_run_merge(tmp_path):
+    """Les résultats des shards sont fusionnés dans un ordre qui ne dépend pas de l'ordre
+    de fin des shards."""
+    shard_run = ShardRun(shards_dir=tmp_path)
+    resources = [{"checksum": "a", "filesize": 200}, {"checksum": "b", "filesize": 300}]
+    shard_run.write_resources(resources, {"a.parquet"})
+
+    shard = ShardRun(shard_run.run_id, shards_dir=tmp_path)
+    assert shard.read_resources() == (resources, {"a.parquet"})
+    shard.write_result(1, [tmp_path / "c.parquet"], [{"url": "c"}])
+    shard.write_result(0, [tmp_path / "b.parquet", tmp_path / "a.parquet"], [])
+
+    parquet_files, artifact = shard_run.wait_for_shards(2, poll_seconds=0)
+    assert [p.name for p in parquet_files] == ["a.parquet", "b.parquet", "c.parquet"]
+    assert artifact == [{"url": "c"}]
+
+    shard_run.remove()
+    assert not shard_run.run_dir.exists()
+
+
+def test_shard_run_failures(tmp_path):
+    shard_run = ShardRun(shards_dir=tmp_path)
+    shard_run.write_resources([], set())
+    shard_run.write_result(0, [], [])
+
+    with pytest.raises(ShardFailed, match="arrêté sans résultat"):
+        shard_run.wait_for_shards(2, is_running=lambda i: False, poll_seconds=0)
+
+    shard_run.write_error(1, MemoryError("plus de mémoire"))
+    with pytest.raises(ShardFailed, match="MemoryError"):
+        shard_run.wait_for_shards(2, poll_seconds=0)
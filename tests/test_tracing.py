@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+import src.tasks.tracing
+from src.tasks.tracing import Tracer, stage, start_tracing, traced
+
+
+def test_tracer_nested_stages(tmp_path, monkeypatch):
+    """Les étapes imbriquées sont tracées au format Chrome trace, avec le pic de mémoire
+    de l'étape parente qui inclut celui de ses étapes imbriquées."""
+    artifacts = []
+    monkeypatch.setattr(
+        src.tasks.tracing, "create_table_artifact", lambda **kw: artifacts.append(kw)
+    )
+
+    # Sans traçage en cours, les étapes n'ont pas d'effet
+    with stage("hors_trace") as span:
+        span.rows_out = 1
+
+    tracer = start_tracing("test_flow")
+    tracer.traces_dir = tmp_path
+    tracer.trace_path = tmp_path / "test_flow_2026-01-02T000000.json"
+    (tmp_path / "test_flow_2026-01-01T000000.json").write_text(
+        json.dumps({"traceEvents": [{"args": {"etape": "parent", "wall_s": 9.0}}]})
+    )
+
+    with stage("parent", rows_in=3) as parent:
+        with stage("enfant") as child:
+            data = bytearray(50 * 1024**2)
+            (tmp_path / "sortie.bin").write_bytes(data)
+            del data
+        parent.rows_out = 2
+    tracer.finish()
+
+    assert Tracer.current is None
+    trace = json.loads(tracer.trace_path.read_text())
+    events = {event["name"]: event for event in trace["traceEvents"]}
+    assert set(events) == {"parent", "enfant"}
+    assert events["enfant"]["ph"] == "X"
+    assert events["parent"]["dur"] >= events["enfant"]["dur"]
+    assert child.io["wchar"] >= 50 * 1024**2
+    assert parent.peak_rss >= child.peak_rss
+
+    rows = artifacts[0]["table"]
+    assert [row["etape"] for row in rows] == ["parent", "  enfant"]
+    assert rows[0]["rows_in"] == 3 and rows[0]["rows_out"] == 2
+    assert rows[0]["wall_s_precedent"] == 9.0
+    assert artifacts[0]["key"] == "test-flow-trace"
+
+
+def test_traced_flow_failure(tmp_path, monkeypatch):
+    """Si le flow échoue, la trace des étapes effectuées est écrite et le traçage est
+    terminé : le flow suivant n'ajoute pas ses étapes à cette trace."""
+    monkeypatch.setattr(src.tasks.tracing, "create_table_artifact", lambda **kw: None)
+    monkeypatch.setattr(src.tasks.tracing, "TRACES_DIR", tmp_path)
+
+    @traced("test_flow")
+    def failing_flow():
+        with stage("etape_terminee"):
+            pass
+        with stage("etape_en_echec"):
+            raise ValueError("échec")
+
+    with pytest.raises(ValueError):
+        failing_flow()
+
+    assert Tracer.current is None
+    (trace_path,) = tmp_path.glob("test_flow_*.json")
+    events = json.loads(trace_path.read_text())["traceEvents"]
+    assert [event["name"] for event in events] == ["etape_terminee", "etape_en_echec"]
@@ -1,9 +1,11 @@
 import polars as pl
 from polars.testing import assert_frame_equal
 
+from src.schemas import SCHEMA_LOW_CARDINALITY
 from src.tasks.transform import (
     apply_modifications,
     calculate_naf_cpv_matching,
+    cast_low_cardinality,
     prepare_etablissements,
     prepare_unites_legales,
     sort_modifications,
@@ -285,6 +287,53 @@ class TestHandleModificationsMarche:
             check_dtypes=False,
         )
 
+    def test_apply_modifications_fill_null_par_marche(self):
+        # Le remplissage des valeurs nulles ne déborde pas sur le marché suivant, y compris
+        # pour un même uid dans deux ressources (clés uid et resource_checksum)
+        base = {
+            "dureeMois": 12,
+            "titulaires": None,
+            "dateNotification": "2023-01-01",
+            "datePublicationDonnees": "2023-01-02",
+            "modification_dateNotificationModification": None,
+            "modification_datePublicationDonneesModification": None,
+            "modification_montant": None,
+        }
+        lf = pl.LazyFrame(
+            [
+                base | {"uid": "1", "resource_checksum": "a", "montant": 1000},
+                base
+                | {
+                    "uid": "1",
+                    "resource_checksum": "a",
+                    "montant": 1000,
+                    "modification_dateNotificationModification": "2023-02-01",
+                    "modification_montant": 2000,
+                },
+                base | {"uid": "1", "resource_checksum": "b", "montant": None},
+                base
+                | {
+                    "uid": "1",
+                    "resource_checksum": "b",
+                    "montant": None,
+                    "modification_dateNotificationModification": "2023-02-01",
+                },
+                base | {"uid": "2", "resource_checksum": "b", "montant": None},
+            ]
+        )
+
+        result_df = apply_modifications(lf, keys=["uid", "resource_checksum"]).collect()
+
+        assert result_df.select(
+            "uid", "resource_checksum", "dateNotification", "montant"
+        ).rows() == [
+            ("1", "a", "2023-01-01", 1000),
+            ("1", "a", "2023-02-01", 2000),
+            ("1", "b", "2023-01-01", None),
+            ("1", "b", "2023-02-01", None),
+            ("2", "b", "2023-01-01", None),
+        ]
+
     def test_sort_modifications(self):
         """
         Générée par la LLM Euria, développée et hébergée en Suisse par Infomaniak. Vérifiée par l'auteur.
@@ -407,3 +456,35 @@ class TestCalculateNafCpvMatching:
         )
         assert pair.height == 1
         assert pair["nb_marches"].item() == n
+
+
+def test_cast_low_cardinality(tmp_path):
+    lf = pl.LazyFrame(
+        {
+            "uid": ["1", "2"],
+            "procedure": ["Appel d'offres ouvert", "Procédure adaptée"],
+            "type": ["Travaux", "Autre"],
+        }
+    )
+
+    df = cast_low_cardinality(lf).collect()
+
+    assert df.schema["uid"] == pl.String
+    assert df.schema["procedure"] == pl.Categorical
+    assert df.schema["type"] == SCHEMA_LOW_CARDINALITY["type"]
+    # Valeur absente de la liste du pl.Enum
+    assert df["type"].to_list() == ["Travaux", None]
+
+    # Parquet écrits séparément, avec des catégories différentes, concaténés et joints
+    # sans pl.StringCache
+    df.slice(0, 1).write_parquet(tmp_path / "a.parquet")
+    df.slice(1, 1).write_parquet(tmp_path / "b.parquet")
+    lf_concat = pl.concat(
+        [pl.scan_parquet(tmp_path / f"{name}.parquet") for name in ["a", "b"]]
+    )
+    assert lf_concat.collect_schema() == df.schema
+    joined = lf_concat.join(
+        pl.scan_parquet(tmp_path / "b.parquet").select("procedure", uid_b="uid"),
+        on="procedure",
+    ).collect()
+    assert joined.select("uid", "uid_b").rows() == [("2", "2")]
@@ -0,0 +1,53 @@
+import re
+
+from src.tasks.get import fix_aws_backslashes
+from src.tasks.utils import StreamRewriter
+
+RULES = [
+    ("BOM", b"\xef\xbb\xbf", b""),
+    ("NaN", rb"NaN([,\n])", rb"null\1"),
+    ("backslash", rb"\\(?:\\+ ?| )", fix_aws_backslashes),
+]
+
+
+def chained_re_sub(data: bytes) -> bytes:
+    """Remplacements successifs sur le document entier, comme le faisaient les
+    stream_replace_bytestring chaînés."""
+    data = re.sub(b"\xef\xbb\xbf", b"", data)
+    data = re.sub(rb"NaN([,\n])", rb"null\1", data)
+    data = re.sub(rb"(\\\\\\)", rb"\\", data)
+    data = re.sub(rb"\\\\", rb"\\", data)
+    return re.sub(rb"\\ ", rb" ", data)
+
+
+def test_stream_rewriter_chunk_boundaries():
+    data = (
+        b'\xef\xbb\xbf{"a": NaN,\n"b": "x\\\\\\\\\\ y", "c": "\\\\\\", "d": NaN\n'
+        b'"e": "\\ \\\\ \\\\\\ \\\\\\\\ \\\\\\\\\\\\\\"}'
+    )
+    expected = chained_re_sub(data)
+
+    for chunk_size in range(1, len(data) + 1):
+        chunks = [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+        rewriter = StreamRewriter(RULES, window=8)
+        assert b"".join(rewriter.rewrite(chunks)) == expected, chunk_size
+        assert rewriter.counts == {"BOM": 1, "NaN": 2, "backslash": 7}
+
+
+def test_stream_rewriter_long_run_across_chunks():
+    """Une suite de backslashes plus longue que la fenêtre, coupée entre deux chunks, est
+    remplacée en entier."""
+    data = b'{"a": "x' + b"\\" * 20 + b' y", "b": "' + b"\\" * 45 + b'"}'
+    expected = chained_re_sub(data)
+
+    for chunk_size in range(1, len(data) + 1):
+        chunks = [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+        rewriter = StreamRewriter(RULES, window=8)
+        assert b"".join(rewriter.rewrite(chunks)) == expected, chunk_size
+        assert rewriter.counts["backslash"] == 2
+
+
+def test_stream_rewriter_empty_stream():
+    rewriter = StreamRewriter(RULES)
+    assert list(rewriter.rewrite([])) == []
+    assert rewriter.counts == {"BOM": 0, "NaN": 0, "backslash": 0}